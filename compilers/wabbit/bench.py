@@ -0,0 +1,810 @@
+# bench.py
+#
+# Benchmarks for the different parts of the compiler.  Each benchmark
+# is a plain function registered by name.  Run one of them with:
+#
+#     bash % python3 -m compilers.wabbit.bench tokenize
+#
+# or run all of them by leaving off the name.  Results are printed,
+# nothing is asserted.  These are for comparing implementations, not
+# for testing them.
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import ChainMap
+
+from compilers.wabbit import errors
+from compilers.wabbit.bytecode import OPCODES, encode, decode, dispatch, handler_table
+from compilers.wabbit.cfg import ControlFlow
+from compilers.wabbit.check import check_program, CHECKERS, IncrementalChecker
+from compilers.wabbit.hashcons import Interner
+from compilers.wabbit.incremental import IncrementalProgram
+from compilers.wabbit.inline import inline_functions
+from compilers.wabbit.ir_code_interpreter import Interpreter
+from compilers.wabbit.ircode import generate_ircode, generate_module
+from compilers.wabbit.model import Node, OPTIONAL_FIELDS, Expression, Definition, Statement, BinaryOperator, \
+    UnaryOperator, FunctionCall, TypeCast, Location, Literal, Fetch, Variable, Constant, Function, FunctionParameter, \
+    Assignment, Print, If, While, Break, Continue, Return
+from compilers.wabbit.optimize import PassManager, PASSES
+from compilers.wabbit.parallel import parse_parallel, check_parallel
+from compilers.wabbit.parse import Parser, StackParser, parse_flat
+from compilers.wabbit.peg import parse_program
+from compilers.wabbit.resolve import resolve_program
+from compilers.wabbit.serialize import dumps, loads
+from compilers.wabbit.ssa import to_ssa, from_ssa
+from compilers.wabbit.tokenizer import tokenize, tokenize_file, TokenStream
+from compilers.wabbit.typesys import INT, FLOAT, BINARY_OPS, binary_ops, check_binop
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Tests')
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """ Register a benchmark under the name of the function (minus the bench_ prefix) """
+    BENCHMARKS[func.__name__[len('bench_'):]] = func
+    return func
+
+
+def load_tests():
+    """ Return a dict of {filename: source} for the programs in Tests/ """
+    sources = {}
+    for filename in sorted(os.listdir(TESTS_DIR)):
+        if filename.endswith('.wb'):
+            with open(os.path.join(TESTS_DIR, filename), encoding='ascii') as f:
+                sources[filename] = f.read()
+    return sources
+
+
+SYNTHETIC_BLOCK = '''\
+/* block {n} */
+var a{n} int = {n};
+var b{n} float = {n}.5 * 2.0;   // trailing comment
+const c{n} = 'x';
+while a{n} < 100 {{
+    a{n} = a{n} + 1;
+    if a{n} >= 50 {{
+        b{n} = b{n} - .25;
+    }} else {{
+        print c{n};
+    }}
+}}
+'''
+
+
+def synthetic_program(size, template=SYNTHETIC_BLOCK):
+    """ Generate a valid program of (roughly) size characters """
+    blocks = []
+    total = 0
+    n = 0
+    while total < size:
+        block = template.format(n=n)
+        blocks.append(block)
+        total += len(block)
+        n += 1
+    return ''.join(blocks)
+
+
+def best_time(func, *args, repeat=3):
+    """ Best wall-clock time of several runs, plus the result of the last run """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def count_tokens(text):
+    return sum(1 for _ in tokenize(text))
+
+
+@benchmark
+def bench_tokenize():
+    """ Tokenizer throughput in tokens/sec """
+    inputs = list(load_tests().items())
+    for size in (1_000_000, 4_000_000):
+        inputs.append((f'synthetic {size // 1_000_000}MB', synthetic_program(size)))
+
+    print(f'{"input":<24}{"chars":>12}{"tokens":>12}{"seconds":>10}{"tokens/sec":>14}')
+    for name, text in inputs:
+        seconds, ntokens = best_time(count_tokens, text)
+        print(f'{name:<24}{len(text):>12}{ntokens:>12}{seconds:>10.4f}{ntokens / seconds:>14,.0f}')
+
+
+def peak_memory(func, *args):
+    """ Peak memory allocated (in bytes) while running func, plus its result """
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+
+def count_file_tokens(path):
+    with open(path, encoding='ascii') as f:
+        return count_tokens(f.read())
+
+
+@benchmark
+def bench_tokenize_file():
+    """ Peak memory of tokenizing a whole file in memory vs. streaming it in chunks """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print(f'{"size":<8}{"mode":<10}{"tokens":>12}{"seconds":>10}{"peak KB":>12}')
+        for size in (4_000_000, 16_000_000):
+            path = os.path.join(tmpdir, 'big.wb')
+            with open(path, 'w', encoding='ascii') as f:
+                f.write(synthetic_program(size))
+            for mode, func in (('read', count_file_tokens),
+                               ('stream', lambda p: sum(1 for _ in tokenize_file(p)))):
+                start = time.perf_counter()
+                ntokens = func(path)
+                seconds = time.perf_counter() - start
+                peak, _ = peak_memory(func, path)
+                print(f'{size // 1_000_000:>4}MB   {mode:<10}{ntokens:>12}{seconds:>10.3f}{peak // 1024:>12,}')
+
+
+def retained_memory(func, *args):
+    """ Memory (in bytes) still allocated by the result of func once it returns """
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        return tracemalloc.get_traced_memory()[0], result
+    finally:
+        tracemalloc.stop()
+
+
+@benchmark
+def bench_token_stream():
+    """ Memory held by a list of Tokens vs. a compact TokenStream """
+    print(f'{"size":<8}{"mode":<10}{"tokens":>12}{"KB held":>12}{"bytes/token":>13}{"build s":>10}{"parse s":>10}')
+    for size in (1_000_000, 4_000_000):
+        text = synthetic_program(size)
+        for mode, build in (('list', lambda t: list(tokenize(t))), ('compact', TokenStream.from_text)):
+            held, tokens = retained_memory(build, text)
+            build_seconds, _ = best_time(build, text)
+            parse_seconds, _ = best_time(lambda: Parser(tokens).parse_statements(), repeat=1)
+            print(f'{size // 1_000_000:>4}MB   {mode:<10}{len(tokens):>12}{held // 1024:>12,}'
+                  f'{held / len(tokens):>13.1f}{build_seconds:>10.3f}{parse_seconds:>10.3f}')
+            del tokens
+
+
+def parse_text(text):
+    return Parser(tokenize(text)).parse_statements()
+
+
+@benchmark
+def bench_incremental():
+    """ Full tokenize + parse vs. an incremental update after a small edit """
+    text = synthetic_program(1_000_000)
+    print(f'program: {text.count(chr(10)) + 1} lines, {len(text)} chars')
+    seconds, _ = best_time(parse_text, text)
+    print(f'{"full tokenize + parse":<36}{seconds * 1000:>10.2f} ms')
+
+    program = IncrementalProgram(text)
+    middle = text.index('a2000 + 1')
+    edits = [
+        ('change one character', (middle + len('a2000 + '), 1, '2')),
+        ('insert a space', (middle, 0, ' ')),
+        ('insert a statement', (text.index('/* block 2000 */'), 0, 'print 42;\n')),
+        ('insert a comment', (middle, 0, '/* note */')),
+    ]
+    for name, edit in edits:
+        seconds, _ = best_time(program.edit, *edit, repeat=1)
+        print(f'{name:<36}{seconds * 1000:>10.2f} ms')
+
+
+@benchmark
+def bench_incremental_check():
+    """ Checking a whole program vs. an IncrementalChecker update after a small edit """
+    text = synthetic_program(1_000_000)
+    program = IncrementalProgram(text)
+    print(f'program: {len(program.statements)} top-level statements')
+    seconds, _ = best_time(check_quietly, parse_text(text))
+    print(f'{"full check":<36}{seconds * 1000:>10.2f} ms')
+
+    seconds, _ = best_time(lambda: IncrementalChecker().update(program.statements, program.shift))
+    print(f'{"first update (checks everything)":<36}{seconds * 1000:>10.2f} ms')
+    checker = IncrementalChecker()
+    checker.update(program.statements, program.shift)
+    seconds, _ = best_time(checker.update, program.statements, program.shift)
+    print(f'{"update, nothing changed":<36}{seconds * 1000:>10.2f} ms')
+    edits = [
+        ('change a loop body', ('a2000 + 1', 'a2000 + 2')),
+        ('change the type of a global', ('var b2000 float = 2000.5 * 2.0;', 'var b2000 int = 2000 * 2;')),
+        ('insert a statement', ('/* block 2000 */', '/* block 2000 */ print 42;')),
+        ('delete a declaration', ("const c2000 = 'x';", '')),
+    ]
+    print(f'{"edit":<36}{"update ms":>10}{"rechecked":>11}')
+    for name, (old, new) in edits:
+        offset = program.text.index(old)
+        program.edit(offset, len(old), new)
+        seconds, _ = best_time(checker.update, program.statements, program.shift, repeat=1)
+        print(f'{name:<36}{seconds * 1000:>10.2f}{len(checker.rechecked):>11}')
+
+
+def random_expression(rng, depth):
+    if depth == 0 or rng.random() < 0.2:
+        return rng.choice(['x', 'y', 'x0', '2.0', '0.5'])
+    if rng.random() < 0.15:
+        return f'({random_expression(rng, depth - 1)})'
+    op = rng.choice(['+', '-', '*', '/', '*', '+'])
+    return f'{random_expression(rng, depth - 1)} {op} {random_expression(rng, depth - 1)}'
+
+
+def expression_program(lines, seed=0):
+    """ A program that is mostly arithmetic expressions """
+    rng = random.Random(seed)
+    decls = 'var x float = 1.0;\nvar y float = 2.0;\nvar x0 float = 0.5;\nvar r float;\n'
+    return decls + ''.join(f'r = {random_expression(rng, 6)};\n' for _ in range(lines))
+
+
+def count_calls(func, *args):
+    """ Number of Python function calls made while running func """
+    calls = 0
+
+    def profile(frame, event, arg):
+        nonlocal calls
+        if event == 'call':
+            calls += 1
+
+    sys.setprofile(profile)
+    try:
+        func(*args)
+    finally:
+        sys.setprofile(None)
+    return calls
+
+
+@benchmark
+def bench_parse_expressions():
+    """ Parser function calls and time on expression heavy programs """
+    tests = load_tests()
+    inputs = [('mandel_loop.wb', tests['mandel_loop.wb']),
+              ('expressions 2k lines', expression_program(2_000)),
+              ('expressions 20k lines', expression_program(20_000))]
+    print(f'{"input":<24}{"tokens":>10}{"calls":>12}{"calls/token":>13}{"parse s":>10}')
+    for name, text in inputs:
+        tokens = list(tokenize(text))
+        calls = count_calls(lambda: Parser(tokens).parse_statements())
+        seconds, _ = best_time(lambda: Parser(tokens).parse_statements())
+        print(f'{name:<24}{len(tokens):>10}{calls:>12}{calls / len(tokens):>13.2f}{seconds:>10.4f}')
+
+
+def nested_blocks(depth):
+    """ depth nested if/while statements """
+    opening = ''.join('if x < 1 {\n' if n % 2 else 'while x < 1 {\n' for n in range(depth))
+    return 'var x int = 0;\n' + opening + 'x = x + 1;\n' + '}\n' * depth
+
+
+def nested_parens(depth):
+    return 'var x int = 0;\nprint ' + '-(' * depth + 'x' + ')' * depth + ';\n'
+
+
+def parse_with(parser_class, tokens):
+    try:
+        parser_class(tokens).parse_statements()
+        return 'ok'
+    except RecursionError:
+        return 'RecursionError'
+
+
+@benchmark
+def bench_deep_nesting():
+    """ Recursive Parser vs. StackParser on deeply nested programs """
+    print(f'{"input":<24}{"depth":>8}{"Parser s":>16}{"StackParser s":>16}')
+    inputs = [('flat synthetic 1MB', 0, synthetic_program(1_000_000))]
+    for depth in (100, 1_000, 100_000):
+        inputs.append(('nested blocks', depth, nested_blocks(depth)))
+        inputs.append(('nested parentheses', depth, nested_parens(depth)))
+    for name, depth, text in inputs:
+        tokens = list(tokenize(text))
+        results = []
+        for parser_class in (Parser, StackParser):
+            start = time.perf_counter()
+            outcome = parse_with(parser_class, tokens)
+            seconds = time.perf_counter() - start
+            results.append(f'{seconds:.4f}' if outcome == 'ok' else outcome)
+        print(f'{name:<24}{depth:>8}{results[0]:>16}{results[1]:>16}')
+
+
+@benchmark
+def bench_peg():
+    """ Packrat PEG engine (with different memo table caps) vs. the hand written Parser """
+    inputs = [('mandel.wb', load_tests()['mandel.wb'])]
+    inputs += [(f'synthetic {size // 1000}KB', synthetic_program(size)) for size in (100_000, 400_000)]
+    print(f'{"input":<20}{"tokens":>10}{"Parser s":>10}{"PEG s":>10}{"PEG 10k memo s":>16}{"PEG 100 memo s":>16}')
+    for name, text in inputs:
+        tokens = list(tokenize(text))
+        times = [best_time(lambda: parse_program(tokens, max_memo))[0] for max_memo in (1_000_000, 10_000, 100)]
+        if name == 'mandel.wb':
+            parser = '-'  # Parser doesn't handle functions
+        else:
+            parser = f'{best_time(lambda: Parser(tokens).parse_statements())[0]:.4f}'
+        print(f'{name:<20}{len(tokens):>10}{parser:>10}{times[0]:>10.4f}{times[1]:>16.4f}{times[2]:>16.4f}')
+
+
+def synthetic_lines(lines):
+    """ A synthetic program of about the given number of lines """
+    return synthetic_program(lines * len(SYNTHETIC_BLOCK) // SYNTHETIC_BLOCK.count('\n'))
+
+
+@benchmark
+def bench_parse():
+    """ Parser throughput (tokens are produced up front, only parsing is timed) """
+    inputs = [(name, text) for name, text in load_tests().items() if 'func' not in text]
+    inputs.append(('synthetic 100k lines', synthetic_lines(100_000)))
+    print(f'{"input":<24}{"tokens":>10}{"Parser s":>10}{"tokens/sec":>14}{"StackParser s":>15}')
+    for name, text in inputs:
+        tokens = list(tokenize(text))
+        seconds, _ = best_time(lambda: Parser(tokens).parse_statements())
+        stack_seconds, _ = best_time(lambda: StackParser(tokens).parse_statements())
+        print(f'{name:<24}{len(tokens):>10}{seconds:>10.4f}{len(tokens) / seconds:>14,.0f}{stack_seconds:>15.4f}')
+
+
+SYNTHETIC_FUNCTION = '''\
+/* function {n} */
+const k{n} = {n};
+func f{n}(x int, y float) float {{
+    var i int = 0;
+    var total float = y;
+    while i < x + k{n} {{
+        if i * 2 > x {{
+            total = total + float(i) / 2.0;
+        }} else {{
+            total = total - y;
+        }}
+        i = i + 1;
+    }}
+    return total;
+}}
+'''
+
+
+def function_program(functions):
+    """ A program made of many independent top-level functions """
+    return 'import func put(x int) int;\n' + ''.join(SYNTHETIC_FUNCTION.format(n=n) for n in range(functions))
+
+
+@benchmark
+def bench_parallel():
+    """ Serial tokenize + parse vs. parsing top-level declarations in a process pool """
+    print(f'cpus: {os.cpu_count()}')
+    print(f'{"input":<24}{"tokens":>10}{"serial s":>10}' + ''.join(f'{f"{n} workers":>12}' for n in (1, 2, 4, 8)))
+    for functions in (2_000, 20_000):
+        text = function_program(functions)
+        ntokens = count_tokens(text)
+        serial, _ = best_time(parse_text, text, repeat=1)
+        speedups = []
+        for workers in (1, 2, 4, 8):
+            seconds, _ = best_time(parse_parallel, text, workers, repeat=1)
+            speedups.append(f'{serial / seconds:.2f}x')
+        print(f'{f"{functions} functions":<24}{ntokens:>10}{serial:>10.3f}' + ''.join(f'{s:>12}' for s in speedups))
+
+
+def check_parallel_quietly(program, workers):
+    with errors.collecting(echo=False):
+        return check_parallel(program, workers)
+
+
+@benchmark
+def bench_parallel_check():
+    """ Serial check_program vs. checking function bodies in a process pool (check_parallel works on a FlatTree) """
+    print(f'cpus: {os.cpu_count()}')
+    print(f'{"input":<18}{"model s":>9}{"flat s":>9}' + ''.join(f'{f"{n} workers":>12}' for n in (1, 2, 4, 8)))
+    for functions in (1_000, 10_000):
+        text = function_program(functions)
+        model, _ = best_time(check_quietly, parse_text(text), repeat=1)
+        tree = parse_flat(tokenize(text))
+        flat, _ = best_time(check_quietly, tree, repeat=1)
+        times = []
+        for workers in (1, 2, 4, 8):
+            seconds, _ = best_time(check_parallel_quietly, tree, workers, repeat=1)
+            times.append(f'{seconds:.3f}')
+        print(f'{f"{functions} functions":<18}{model:>9.3f}{flat:>9.3f}' + ''.join(f'{t:>12}' for t in times))
+
+
+def walk(node):
+    """ All the model nodes in a tree (or list of trees) """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, Node):
+            yield node
+            stack.extend(getattr(node, name, None) for name in node._fields if name != 'declaration')
+
+
+DICT_CLASSES = {}
+
+
+def with_dicts(node):
+    """ Copy of a tree made of plain classes that keep their attributes in a __dict__ (like model.py used to) """
+    if isinstance(node, list):
+        return [with_dicts(n) for n in node]
+    if not isinstance(node, Node):
+        return node
+    cls = type(node)
+    if cls not in DICT_CLASSES:
+        DICT_CLASSES[cls] = type(cls.__name__, (), {})
+    copy = DICT_CLASSES[cls]()
+    for name in node._fields:
+        value = getattr(node, name, None)
+        if name not in OPTIONAL_FIELDS:
+            setattr(copy, name, with_dicts(value))
+        elif value is not None and name != 'declaration':  # The old classes only had what was set
+            setattr(copy, name, value)
+    return copy
+
+
+def with_slots(node):
+    """ Copy of a tree made of the (slotted) model classes """
+    if isinstance(node, list):
+        return [with_slots(n) for n in node]
+    if not isinstance(node, Node):
+        return node
+    copy = type(node).__new__(type(node))
+    for name in node._fields:
+        value = getattr(node, name, None)
+        setattr(copy, name, value if name == 'declaration' else with_slots(value))
+    return copy
+
+
+@benchmark
+def bench_node_memory():
+    """ Memory held by a checked AST made of __dict__ classes vs. the slotted model classes """
+    text = synthetic_program(9_000_000)
+    statements = parse_text(text)
+    check_quietly(statements)  # Only for the annotations. Type errors don't matter here
+    nodes = sum(1 for _ in walk(statements))
+    print(f'program: {len(text)} chars, {nodes} nodes')
+    print(f'{"classes":<12}{"MB held":>10}{"bytes/node":>12}')
+    for name, copy in (('__dict__', with_dicts), ('__slots__', with_slots)):
+        held, tree = retained_memory(copy, statements)
+        print(f'{name:<12}{held / 1e6:>10.1f}{held / nodes:>12.1f}')
+        del tree
+
+
+def check_quietly(program, max_errors=None):
+    with errors.collecting(max_errors, echo=False):
+        return check_program(program)
+
+
+@benchmark
+def bench_flat_tree():
+    """ Memory held by model objects vs. a FlatTree, and checking/IR generation on both """
+    text = synthetic_program(4_000_000)
+    nodes = sum(1 for _ in walk(parse_text(text)))  # Model nodes. A FlatTree also has a node for each list
+    print(f'program: {len(text)} chars, {nodes} nodes')
+    print(f'{"store":<10}{"MB held":>10}{"bytes/node":>12}{"check s":>10}{"ircode s":>10}')
+    for name, build in (('model', parse_text), ('flat', lambda t: parse_flat(tokenize(t)))):
+        held, program = retained_memory(build, text)
+        check_seconds, _ = best_time(check_quietly, program, repeat=1)
+        ircode_seconds, _ = best_time(generate_ircode, program, repeat=1)
+        print(f'{name:<10}{held / 1e6:>10.1f}{held / nodes:>12.1f}{check_seconds:>10.3f}{ircode_seconds:>10.3f}')
+        del program
+
+
+@benchmark
+def bench_hashcons():
+    """ Model nodes and parse time without and with sharing identical expressions """
+    inputs = [('mandel.wb', load_tests()['mandel.wb']),
+              ('expressions 20k lines', expression_program(20_000)),
+              ('synthetic 1MB', synthetic_program(1_000_000))]
+    print(f'{"input":<24}{"nodes":>10}{"shared":>10}{"Parser s":>10}{"Interner s":>12}{"MB held":>9}{"MB shared":>11}')
+    for name, text in inputs:
+        tokens = list(tokenize(text))
+        nodes = sum(1 for _ in walk(Parser(tokens).parse_statements()))
+        shared = len({id(node) for node in walk(Parser(tokens, Interner()).parse_statements())})
+        seconds, _ = best_time(lambda: Parser(tokens).parse_statements())
+        interned_seconds, _ = best_time(lambda: Parser(tokens, Interner()).parse_statements())
+        held, _ = retained_memory(lambda: Parser(tokens).parse_statements())
+        shared_held, _ = retained_memory(lambda: Parser(tokens, Interner()).parse_statements())
+        print(f'{name:<24}{nodes:>10}{shared:>10}{seconds:>10.4f}{interned_seconds:>12.4f}'
+              f'{held / 1e6:>9.1f}{shared_held / 1e6:>11.1f}')
+
+
+
+def compile_front(text):
+    """ tokenize + parse + check (the part a compile cache can skip) """
+    statements = parse_text(text)
+    check_quietly(statements)
+    return statements
+
+
+@benchmark
+def bench_serialize():
+    """ Loading a checked model from serialize.py's format or a pickle vs. tokenizing, parsing and checking again """
+    inputs = [(name, text) for name, text in load_tests().items() if '`' not in text]  # The checker can't do addresses
+    inputs.append(('synthetic 1MB', synthetic_program(1_000_000)))
+    print(f'{"input":<20}{"source":>10}{"binary":>10}{"pickle":>10}{"parse+check ms":>16}{"loads ms":>10}{"pickle ms":>11}')
+    for name, text in inputs:
+        statements = compile_front(text)
+        data = dumps(statements)
+        pickled = pickle.dumps(statements)
+        parse_seconds, _ = best_time(compile_front, text)
+        load_seconds, _ = best_time(loads, data)
+        pickle_seconds, _ = best_time(pickle.loads, pickled)
+        print(f'{name:<20}{len(text):>10}{len(data):>10}{len(pickled):>10}{parse_seconds * 1000:>16.2f}'
+              f'{load_seconds * 1000:>10.2f}{pickle_seconds * 1000:>11.2f}')
+
+
+# How check.py used to find the checker for a node, for comparison
+ISINSTANCE_CHAINS = (
+    (Expression, (BinaryOperator, UnaryOperator, FunctionCall, TypeCast, Location, Literal, Fetch)),
+    (Definition, (Variable, Constant, Function, FunctionParameter)),
+    (Statement, (Assignment, Print, If, While, Break, Continue, Return)),
+)
+
+
+def isinstance_dispatch(node):
+    if isinstance(node, list):
+        return list
+    for group, classes in ISINSTANCE_CHAINS:
+        if isinstance(node, group):
+            for cls in classes:
+                if isinstance(node, cls):
+                    return cls
+
+
+def dict_dispatch(node):
+    return CHECKERS[type(node)]
+
+
+@benchmark
+def bench_dispatch():
+    """ Finding the handler for a node: isinstance chains vs. the cached lookup of visitor.py """
+    statements = compile_front(synthetic_program(1_000_000))
+    nodes = list(walk(statements))
+    print(f'{len(nodes)} nodes')
+    for name, dispatch in (('isinstance chain', isinstance_dispatch), ('Dispatcher', dict_dispatch)):
+        seconds, _ = best_time(lambda: [dispatch(node) for node in nodes])
+        print(f'{name:<24}{seconds * 1e9 / len(nodes):>8.1f} ns/node')
+    for name, run in (('check_program', check_quietly), ('generate_ircode', generate_ircode)):
+        seconds, _ = best_time(run, statements)
+        print(f'{name:<24}{seconds * 1e9 / len(nodes):>8.1f} ns/node')
+
+
+def nested_uses(depth, uses=20):
+    """ A global used many times at the bottom of depth nested blocks """
+    return ('var x int = 0;\n' + 'while x < 1 {\n' * depth + 'x = x + 1;\n' * uses + '}\n' * depth) * 100
+
+
+@benchmark
+def bench_resolve():
+    """ Looking a name up in nested scopes (ChainMap) vs. indexing a frame with the slot from resolve.py """
+    print(f'{"depth":>6}{"ChainMap.get ns":>17}{"frame[slot] ns":>16}{"resolve ms":>12}{"check ms":>10}')
+    for depth in (1, 10, 50):
+        statements = parse_text(nested_uses(depth))
+        env = ChainMap({'x': 0})
+        for _ in range(depth):
+            env = env.new_child()
+        frame = [0]
+        n = 100_000
+        lookup, _ = best_time(lambda: [env.get('x') for _ in range(n)])
+        index, _ = best_time(lambda: [frame[0] for _ in range(n)])
+        resolve_seconds, _ = best_time(resolve_program, statements)
+        check_seconds, _ = best_time(check_quietly, statements)
+        print(f'{depth:>6}{lookup * 1e9 / n:>17.1f}{index * 1e9 / n:>16.1f}'
+              f'{resolve_seconds * 1000:>12.2f}{check_seconds * 1000:>10.2f}')
+
+
+def broken_program(size):
+    """ synthetic_program() with one more type error in every block """
+    return synthetic_program(size, SYNTHETIC_BLOCK + 'print a{n} + b{n};  // int + float\n')
+
+
+@benchmark
+def bench_diagnostics():
+    """ Checking a program full of errors to the end vs. stopping at max_errors """
+    print(f'{"program":<16}{"max_errors":>12}{"errors":>8}{"check ms":>10}')
+    for name, text in (('synthetic 1MB', synthetic_program(1_000_000)), ('broken 1MB', broken_program(1_000_000))):
+        program = parse_text(text)
+        for max_errors in (None, 20):
+            with errors.collecting(max_errors, echo=False) as diagnostics:
+                check_program(program)
+            seconds, _ = best_time(check_quietly, program, max_errors)
+            print(f'{name:<16}{str(max_errors):>12}{diagnostics.error_count:>8}{seconds * 1000:>10.1f}')
+
+
+@benchmark
+def bench_type_tables():
+    """ Typing a binary operator with a (type, op, type) dict key vs. the dense tables indexed by type id """
+    n = 100_000
+    pairs = [(INT, '+', INT), (FLOAT, '<', FLOAT), (INT, '+', FLOAT)] * (n // 3)
+    print(f'{"lookup":<28}{"ns":>8}')
+    for name, lookup in (('dict[(left, op, right)]', lambda: [binary_ops.get(key) for key in pairs]),
+                         ('TABLE[op][left][right]', lambda: [BINARY_OPS[op][left.id][right.id]
+                                                             for left, op, right in pairs]),
+                         ('check_binop()', lambda: [check_binop(*key) for key in pairs])):
+        seconds, _ = best_time(lookup)
+        print(f'{name:<28}{seconds * 1e9 / len(pairs):>8.1f}')
+    statements = parse_text(synthetic_program(1_000_000))
+    check_quietly(statements)
+    for name, run in (('check_program ms', check_quietly), ('generate_ircode ms', generate_ircode)):
+        seconds, _ = best_time(run, statements)
+        print(f'{name:<28}{seconds * 1000:>8.1f}')
+
+
+# One method per opcode that does nothing, to time dispatching on its own
+NullMachine = type('NullMachine', (), {f'run_{name}': lambda self, *operands: None for name in OPCODES})
+
+
+def getattr_dispatch(machine, code):
+    for opcode, *args in code:
+        getattr(machine, f'run_{opcode}')(*args)
+
+
+@benchmark
+def bench_bytecode():
+    """ IR code as a list of tuples vs. Bytecode (array of ints + pools) """
+    print(f'{"program":<16}{"instructions":>13}{"tuples KB":>11}{"bytecode KB":>13}{"encode ms":>11}{"decode ms":>11}'
+          f'{"getattr ms":>12}{"table ms":>10}')
+    programs = [('mandel_loop.wb', load_tests()['mandel_loop.wb']), ('synthetic 1MB', synthetic_program(1_000_000))]
+    for name, text in programs:
+        statements = parse_text(text)
+        check_quietly(statements)
+        tuples_held, code = retained_memory(generate_ircode, statements)
+        bytecode_held, bytecode = retained_memory(encode, code)
+        encode_seconds, _ = best_time(encode, code)
+        decode_seconds, _ = best_time(decode, bytecode)
+        machine = NullMachine()
+        getattr_seconds, _ = best_time(getattr_dispatch, machine, code)
+        table_seconds, _ = best_time(dispatch, bytecode, handler_table(machine, 'run_'))
+        print(f'{name:<16}{len(code):>13}{tuples_held // 1024:>11,}{bytecode_held // 1024:>13,}'
+              f'{encode_seconds * 1000:>11.1f}{decode_seconds * 1000:>11.1f}'
+              f'{getattr_seconds * 1000:>12.1f}{table_seconds * 1000:>10.1f}')
+
+
+def compile_ircode(text):
+    """ IR code for a program, or None if it doesn't check or ircode.py can't handle it yet """
+    statements = parse_text(text)
+    try:
+        with errors.collecting(echo=False) as diagnostics:
+            check_program(statements)
+        if diagnostics.has_errors:
+            return None
+        return generate_ircode(statements)
+    except (RuntimeError, ValueError):
+        return None
+
+
+@benchmark
+def bench_optimize():
+    """ Instructions each pass of optimize.py takes out of the programs in Tests/ """
+    names = [optimization.__name__ for optimization in PASSES]
+    print(f'{"program":<18}{"before":>7}' + ''.join(f'{name[:11]:>12}' for name in names) + f'{"after":>7}{"ms":>7}')
+    total = PassManager()
+    for filename, text in load_tests().items():
+        code = compile_ircode(text)
+        if code is None:
+            print(f'{filename:<18}  (skipped, doesn\'t compile to IR)')
+            continue
+        seconds, _ = best_time(lambda: PassManager().run(code))
+        manager = PassManager()
+        optimized = manager.run(code)
+        total.run(code)
+        print(f'{filename:<18}{len(code):>7}' + ''.join(f'{manager.removed[name]:>12}' for name in names)
+              + f'{len(optimized):>7}{seconds * 1000:>7.2f}')
+    print()
+    total.report()
+
+
+@benchmark
+def bench_ssa():
+    """ Converting the programs in Tests/ to SSA form (ssa.py) and back to stack IR """
+    print(f'{"program":<18}{"IR":>6}{"blocks":>8}{"phis":>6}{"registers":>11}{"back":>6}{"to ms":>8}{"back ms":>9}')
+    for filename, text in load_tests().items():
+        code = compile_ircode(text)
+        if code is None:
+            print(f'{filename:<18}  (skipped, doesn\'t compile to IR)')
+            continue
+        to_seconds, function = best_time(to_ssa, code)
+        back_seconds, back = best_time(from_ssa, function)
+        phis = sum(len(block.phis) for block in function.blocks)
+        print(f'{filename:<18}{len(code):>6}{len(function.blocks):>8}{phis:>6}{function.registers:>11}{len(back):>6}'
+              f'{to_seconds * 1000:>8.2f}{back_seconds * 1000:>9.2f}')
+
+
+def skipping_program(iterations, size):
+    """ A loop with an if whose consequence (size statements) never runs """
+    body = '\n'.join(['        x = x + 1;'] * size)
+    return f'var i int = 0;\nvar x int = 0;\nwhile i < {iterations} {{\n    if i < 0 {{\n{body}\n    }}\n' \
+           f'    i = i + 1;\n}}\nprint x;\n'
+
+
+@benchmark
+def bench_branches():
+    """ Branches in the IR interpreter with the targets from cfg.py, and building a ControlFlow """
+    print(f'{"skipped statements":>18}{"run ms":>9}')
+    for size in (1, 10, 100, 1000):
+        code = encode(compile_ircode(skipping_program(2000, size)))
+        seconds, _ = best_time(lambda: Interpreter(out=lambda *args, **kwargs: None).run(code))
+        print(f'{size:>18}{seconds * 1000:>9.1f}')
+    print()
+    print(f'{"program":<16}{"words":>9}{"blocks":>8}{"loops":>7}{"targets ms":>12}{"loops ms":>10}')
+    programs = [('mandel_loop.wb', load_tests()['mandel_loop.wb']), ('synthetic 1MB', synthetic_program(1_000_000))]
+    for name, text in programs:
+        statements = parse_text(text)
+        check_quietly(statements)
+        code = encode(generate_ircode(statements))
+        flow_seconds, flow = best_time(ControlFlow, code)
+        loops_seconds, loops = best_time(lambda: ControlFlow(code).loops())
+        print(f'{name:<16}{len(code):>9,}{len(flow.blocks):>8}{len(loops):>7}{flow_seconds * 1000:>12.1f}'
+              f'{(loops_seconds - flow_seconds) * 1000:>10.1f}')
+
+
+SMALL_FUNCTIONS = '''\
+func sq(x int) int {{
+    return x * x;
+}}
+
+func clamp(x int, limit int) int {{
+    if x > limit {{
+        return limit;
+    }}
+    return x;
+}}
+
+func main() int {{
+    var i int = 0;
+    var total int = 0;
+    while i < {iterations} {{
+        total = clamp(total + sq(i), 1000000);
+        i = i + 1;
+    }}
+    print total;
+    return 0;
+}}
+'''
+
+
+def compile_module(text, inline):
+    """ The IRModule for a program, and the calls inlined (inline.py) if inline """
+    statements = parse_text(text)
+    check_quietly(statements)
+    inlined = inline_functions(statements).inlined if inline else {}
+    return generate_module(statements), inlined
+
+
+def run_module(module):
+    interpreter = Interpreter(out=lambda *args, **kwargs: None, functions=module.functions)
+    interpreter.run(module.code)
+    if 'main' in module.functions:
+        interpreter.call('main')
+
+
+@benchmark
+def bench_inline():
+    """ Programs in the IR interpreter with and without small functions inlined into their callers """
+    print(f'{"program":<22}{"inlined":>8}{"run ms":>9}{"inlined ms":>12}{"speedup":>9}')
+    tests = load_tests()
+    programs = [('mandel.wb (n=100)', tests['mandel.wb'].replace('threshhold = 1000', 'threshhold = 100')),
+                ('small functions', SMALL_FUNCTIONS.format(iterations=20000))]  # Programs with calls to inline
+    for name, text in programs:
+        times = []
+        for inline in (False, True):
+            module, inlined = compile_module(text, inline)
+            seconds, _ = best_time(run_module, module)
+            times.append(seconds)
+        print(f'{name:<22}{sum(inlined.values()):>8}{times[0] * 1000:>9.1f}{times[1] * 1000:>12.1f}'
+              f'{times[0] / times[1]:>9.2f}')
+
+
+def main(argv):
+    names = argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f'== {name}')
+        BENCHMARKS[name]()
+        print()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
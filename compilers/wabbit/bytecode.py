@@ -0,0 +1,196 @@
+# bytecode.py
+#
+# A compact encoding of IR code (see ircode.py).  IRModule produces a
+# list of tuples, ('CONSTI', 4), ('LOAD', 'x', 0, 2), ...  which every
+# consumer takes apart again, usually by formatting the opcode into a
+# method name and calling getattr().  A Bytecode is the same code as
+# one array('i') of integers plus two pools:
+#
+#     code        for each instruction, a header word followed by its
+#                 operands.  The header is the opcode (an index into
+#                 OPCODES) in the low 8 bits and the number of operands
+#                 above that, so code can be walked without knowing
+#                 the opcodes
+#     constants   the values of CONSTI/CONSTF, an operand is an index
+#     names       variable and function names, an operand is an index
+#
+# Depths and slots are stored as they are (-1 for None).  Which operands
+# an opcode has is in OPERANDS:
+#
+#     c   index into constants
+#     n   index into names
+#     i   a small integer
+#
+# encode() and decode() convert between the two forms without losing
+# anything: decode(encode(code)) == code, including instructions with
+# fewer operands than OPERANDS allows (('STORE', 'x') is fine).
+#
+# The consumers (ir_code_interpreter.py, wasm.py, ...) keep a list of
+# handlers indexed by opcode (see handler_table()) instead of looking a
+# method up by name for every instruction, and the handlers get the
+# operand words as they are: a handler looks a constant or a name up in
+# its pool only if it needs the value.  Decoding every operand back into
+# a Python object would cost more than unpacking the tuples did.
+from array import array
+
+OPERANDS = {
+    # Integer operations
+    'CONSTI': 'c', 'GLOBALI': 'ni', 'LOCALI': 'ni',
+    'ADDI': '', 'SUBI': '', 'MULI': '', 'DIVI': '', 'ANDI': '', 'ORI': '',
+    'LTI': '', 'LEI': '', 'GTI': '', 'GEI': '', 'EQI': '', 'NEI': '',
+    'PRINTI': '', 'PEEKI': '', 'POKEI': '', 'ITOF': '',
+    # Floating point operations
+    'CONSTF': 'c', 'GLOBALF': 'ni', 'LOCALF': 'ni',
+    'ADDF': '', 'SUBF': '', 'MULF': '', 'DIVF': '',
+    'LTF': '', 'LEF': '', 'GTF': '', 'GEF': '', 'EQF': '', 'NEF': '',
+    'PRINTF': '', 'PEEKF': '', 'POKEF': '', 'FTOI': '',
+    # Byte-oriented operations
+    'PRINTB': '', 'PEEKB': '', 'POKEB': '',
+    # Variable load/store
+    'LOAD': 'nii', 'STORE': 'nii',
+    # Function call and return
+    'CALL': 'n', 'RET': '',
+    # Structured control flow
+    'IF': '', 'ELSE': '', 'ENDIF': '',
+    'LOOP': '', 'CBREAK': '', 'CONTINUE': '', 'ENDLOOP': '',
+    # Memory
+    'GROW': '',
+}
+
+OPCODES = tuple(OPERANDS)
+OPCODE_IDS = {name: code for code, name in enumerate(OPCODES)}
+OPERAND_KINDS = [OPERANDS[name] for name in OPCODES]  # By opcode
+
+OPCODE_BITS = 8
+OPCODE_MASK = (1 << OPCODE_BITS) - 1
+assert len(OPCODES) <= OPCODE_MASK + 1
+
+
+class Bytecode:
+    __slots__ = ('code', 'constants', 'names')
+
+    def __init__(self, code=None, constants=None, names=None):
+        self.code = array('i') if code is None else code
+        self.constants = [] if constants is None else constants
+        self.names = [] if names is None else names
+
+    def __len__(self):
+        """ The number of words (not instructions) """
+        return len(self.code)
+
+    def __iter__(self):
+        """ (opcode, operands) for each instruction, operands still encoded """
+        code = self.code
+        pc = 0
+        while pc < len(code):
+            header = code[pc]
+            count = header >> OPCODE_BITS
+            yield header & OPCODE_MASK, code[pc + 1:pc + 1 + count]
+            pc += 1 + count
+
+
+def _constant_key(value):
+    # 1, 1.0 and True are equal (and so are 0.0 and -0.0), but must stay apart in the pool
+    return type(value), value.hex() if isinstance(value, float) else value
+
+
+class Encoder:
+    def __init__(self):
+        self.bytecode = Bytecode()
+        self._constants = {}  # _constant_key(value) -> index
+        self._names = {}      # name -> index
+
+    def constant(self, value):
+        key = _constant_key(value)
+        index = self._constants.get(key)
+        if index is None:
+            index = self._constants[key] = len(self.bytecode.constants)
+            self.bytecode.constants.append(value)
+        return index
+
+    def name(self, name):
+        index = self._names.get(name)
+        if index is None:
+            index = self._names[name] = len(self.bytecode.names)
+            self.bytecode.names.append(name)
+        return index
+
+    def append(self, instruction):
+        opcode, *operands = instruction
+        code = OPCODE_IDS.get(opcode)
+        if code is None:
+            raise ValueError(f'Unknown opcode {opcode!r}')
+        kinds = OPERAND_KINDS[code]
+        if len(operands) > len(kinds):
+            raise ValueError(f'Too many operands for {opcode}: {instruction}')
+        words = self.bytecode.code
+        words.append(code | len(operands) << OPCODE_BITS)
+        for kind, operand in zip(kinds, operands):
+            if kind == 'c':
+                words.append(self.constant(operand))
+            elif kind == 'n':
+                words.append(self.name(operand))
+            else:
+                words.append(-1 if operand is None else operand)
+
+
+def encode(instructions):
+    """ Bytecode for a list of IR instructions (tuples) """
+    encoder = Encoder()
+    for instruction in instructions:
+        encoder.append(instruction)
+    return encoder.bytecode
+
+
+def decode_operands(bytecode, opcode, operands):
+    """ The operands of one instruction as they are in the tuple form """
+    values = []
+    for kind, operand in zip(OPERAND_KINDS[opcode], operands):
+        if kind == 'c':
+            values.append(bytecode.constants[operand])
+        elif kind == 'n':
+            values.append(bytecode.names[operand])
+        else:
+            values.append(None if operand == -1 else operand)
+    return values
+
+
+def decode(bytecode):
+    """ The list of IR instructions (tuples) in a Bytecode """
+    return [(OPCODES[opcode], *decode_operands(bytecode, opcode, operands)) for opcode, operands in bytecode]
+
+
+def as_bytecode(code):
+    """ code if it's Bytecode already, else the encoded list of instructions """
+    return code if isinstance(code, Bytecode) else encode(code)
+
+
+def _unsupported(name):
+    def handler(*operands):
+        raise ValueError(f'Opcode {name} not supported')
+    return handler
+
+
+def handler_table(obj, prefix):
+    """ [obj.<prefix><opcode name> for each opcode], to index with an opcode """
+    return [getattr(obj, prefix + name, None) or _unsupported(name) for name in OPCODES]
+
+
+def dispatch(bytecode, handlers, machine=None):
+    """ handlers[opcode](*operand words) for each instruction, in order.  If machine
+        is given, machine.pc is the word of the instruction while its handler runs """
+    code = bytecode.code
+    pc = 0
+    end = len(code)
+    while pc < end:
+        header = code[pc]
+        count = header >> OPCODE_BITS
+        if machine is not None:
+            machine.pc = pc
+        if count == 0:
+            handlers[header & OPCODE_MASK]()
+        elif count == 1:
+            handlers[header & OPCODE_MASK](code[pc + 1])
+        else:
+            handlers[header & OPCODE_MASK](*code[pc + 1:pc + 1 + count])
+        pc += 1 + count
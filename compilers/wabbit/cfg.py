@@ -0,0 +1,282 @@
+# cfg.py
+#
+# Control flow of IR code (see ircode.py).  The IR has structured
+# markers (IF/ELSE/ENDIF, LOOP/CBREAK/CONTINUE/ENDLOOP) instead of jumps,
+# so where a branch goes depends on the markers around it.  Finding the
+# matching ELSE or ENDLOOP by scanning forward every time a branch is
+# taken makes every branch cost as much as the code it skips.
+#
+# ControlFlow resolves the markers once, in one pass over the Bytecode
+# (see bytecode.py) with a stack of the blocks that are open:
+#
+#     targets[pc]   for the branch at word pc, the word it goes to (-1
+#                   for everything else):
+#                       IF        the alternative (after ELSE), or after ENDIF
+#                       ELSE      after ENDIF
+#                       LOOP      after ENDLOOP
+#                       CBREAK    after ENDLOOP of its loop
+#                       CONTINUE  the first instruction in its loop
+#                       ENDLOOP   the first instruction in its loop
+#     labels[pc]    for CBREAK and CONTINUE, the number of IFs between
+#                   them and their loop.  A backend with structured
+#                   control flow (Wasm) needs that to name the loop
+#
+# A CBREAK is resolved when its ENDLOOP is found, so each marker is
+# patched once.  Every instruction after a branch and every target
+# starts a basic block, and the blocks (BasicBlock) are linked to their
+# successors and predecessors.  The dominators (Cooper, Harvey and
+# Kennedy, "A Simple, Fast Dominance Algorithm") and the loops (a back
+# edge goes to a block that dominates it, its loop is what reaches the
+# edge without going through the header) are worked out the first time
+# they're asked for, most users only want the targets.
+from array import array
+
+from compilers.wabbit.bytecode import as_bytecode, OPCODE_IDS, OPCODE_BITS, OPCODE_MASK
+
+IF, ELSE, ENDIF = OPCODE_IDS['IF'], OPCODE_IDS['ELSE'], OPCODE_IDS['ENDIF']
+LOOP, CBREAK, CONTINUE, ENDLOOP = OPCODE_IDS['LOOP'], OPCODE_IDS['CBREAK'], OPCODE_IDS['CONTINUE'], OPCODE_IDS['ENDLOOP']
+RET = OPCODE_IDS['RET']
+
+# Instructions after which the next one starts a block
+BLOCK_ENDS = {IF, ELSE, CBREAK, CONTINUE, ENDLOOP, RET}
+
+
+class BasicBlock:
+    __slots__ = ('index', 'start', 'end', 'successors', 'predecessors', 'loop')
+
+    def __init__(self, index, start, end):
+        self.index = index
+        self.start = start        # Word of the first instruction
+        self.end = end            # Word after the last instruction
+        self.successors = []      # BasicBlocks, for a conditional branch the fall-through first
+        self.predecessors = []
+        self.loop = None          # The innermost Loop it is in
+
+    def __repr__(self):
+        return f'BasicBlock({self.index}, {self.start}, {self.end})'
+
+
+class Loop:
+    __slots__ = ('header', 'blocks', 'parent', 'depth')
+
+    def __init__(self, header):
+        self.header = header      # The BasicBlock back edges go to
+        self.blocks = {header}
+        self.parent = None        # The Loop it is in
+        self.depth = 1            # 1 for a loop that isn't in another loop
+
+
+class ControlFlow:
+    def __init__(self, code):
+        self.bytecode = as_bytecode(code)
+        words = self.bytecode.code
+        self.targets = array('i', [-1]) * len(words)
+        self.labels = {}
+        self.resolve()
+        self.split()
+        self._dominators = None
+        self._loops = None
+
+    def resolve(self):
+        """ Fill in self.targets and self.labels """
+        words = self.bytecode.code
+        targets = self.targets
+        open = []       # [opcode, pc, ...] of the IFs and LOOPs we're in
+        loops = []      # Index in open of the loops
+        pc = 0
+        end = len(words)
+        while pc < end:
+            header = words[pc]
+            opcode = header & OPCODE_MASK
+            following = pc + 1 + (header >> OPCODE_BITS)
+            if opcode == IF:
+                open.append([IF, pc, -1])         # The ELSE, if there is one
+            elif opcode == ELSE:
+                block = self.innermost(open, IF, 'ELSE', pc)
+                targets[block[1]] = following
+                block[2] = pc
+            elif opcode == ENDIF:
+                block = self.innermost(open, IF, 'ENDIF', pc)
+                open.pop()
+                targets[block[1] if block[2] == -1 else block[2]] = following
+            elif opcode == LOOP:
+                loops.append(len(open))
+                open.append([LOOP, pc, following, []])  # The first instruction, the CBREAKs
+            elif opcode == CBREAK or opcode == CONTINUE:
+                if not loops:
+                    raise ValueError(f'{"CBREAK" if opcode == CBREAK else "CONTINUE"} outside of a loop at {pc}')
+                loop = open[loops[-1]]
+                self.labels[pc] = len(open) - 1 - loops[-1]
+                if opcode == CBREAK:
+                    loop[3].append(pc)
+                else:
+                    targets[pc] = loop[2]
+            elif opcode == ENDLOOP:
+                block = self.innermost(open, LOOP, 'ENDLOOP', pc)
+                open.pop()
+                loops.pop()
+                targets[pc] = block[2]
+                targets[block[1]] = following
+                for branch in block[3]:
+                    targets[branch] = following
+            pc = following
+        if open:
+            raise ValueError(f'{"IF" if open[-1][0] == IF else "LOOP"} at {open[-1][1]} has no end')
+
+    @staticmethod
+    def innermost(open, opcode, name, pc):
+        if not open or open[-1][0] != opcode:
+            raise ValueError(f'{name} at {pc} does not match')
+        return open[-1]
+
+    def split(self):
+        """ Make self.blocks, in the order of the code """
+        words = self.bytecode.code
+        targets = self.targets
+        end = len(words)
+        starts = bytearray(end + 1)  # 1 where a block starts
+        starts[0] = 1
+        pc = 0
+        while pc < end:
+            header = words[pc]
+            following = pc + 1 + (header >> OPCODE_BITS)
+            if header & OPCODE_MASK in BLOCK_ENDS:
+                starts[following] = 1
+            if targets[pc] != -1:
+                starts[targets[pc]] = 1
+            pc = following
+        starts = [pc for pc in range(end) if starts[pc]] + [end]
+        self.blocks = [BasicBlock(index, start, starts[index + 1]) for index, start in enumerate(starts[:-1])]
+        self.block_at = {block.start: block for block in self.blocks}
+        for block in self.blocks:
+            pc = last = block.start
+            while pc < block.end:
+                last = pc
+                pc += 1 + (words[pc] >> OPCODE_BITS)
+            opcode = words[last] & OPCODE_MASK if block.end > block.start else None
+            if opcode == IF or opcode == CBREAK:
+                successors = [block.end, targets[last]]
+            elif opcode == ELSE or opcode == CONTINUE or opcode == ENDLOOP:
+                successors = [targets[last]]
+            elif opcode == RET:
+                successors = []
+            else:
+                successors = [block.end]
+            for start in successors:
+                successor = self.block_at.get(start)
+                if successor is not None and successor not in block.successors:  # Not the end of the code
+                    block.successors.append(successor)
+                    successor.predecessors.append(block)
+
+    # Dominators
+
+    def postorder(self):
+        """ The blocks reachable from the first one, each after its successors (back edges aside) """
+        order = []
+        seen = set()
+        if not self.blocks:
+            return order
+        stack = [(self.blocks[0], iter(self.blocks[0].successors))]
+        seen.add(self.blocks[0])
+        while stack:
+            block, successors = stack[-1]
+            for successor in successors:
+                if successor not in seen:
+                    seen.add(successor)
+                    stack.append((successor, iter(successor.successors)))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        return order
+
+    def dominators(self):
+        """ The immediate dominator of each block, by index (None for the first and unreachable ones) """
+        if self._dominators is None:
+            order = self.postorder()
+            number = {block: n for n, block in enumerate(order)}
+            idom = {order[-1]: order[-1]} if order else {}
+            changed = True
+            while changed:
+                changed = False
+                for block in reversed(order[:-1]):
+                    new = None
+                    for predecessor in block.predecessors:
+                        if predecessor in idom:
+                            new = predecessor if new is None else self.intersect(idom, number, predecessor, new)
+                    if idom.get(block) is not new:
+                        idom[block] = new
+                        changed = True
+            self._dominators = [None if block not in idom or idom[block] is block else idom[block]
+                                for block in self.blocks]
+            self.number_dominator_tree()
+        return self._dominators
+
+    def number_dominator_tree(self):
+        # When a walk of the dominator tree enters and leaves each block, so that a
+        # dominates b if the walk is in a when it gets to b.  Walking up the tree
+        # instead would cost as much as the blocks in a row there are
+        children = [[] for _ in self.blocks]
+        for block, dominator in zip(self.blocks, self._dominators):
+            if dominator is not None:
+                children[dominator.index].append(block)
+        self._entered = [-1] * len(self.blocks)  # -1 for the unreachable blocks
+        self._left = [-1] * len(self.blocks)
+        if not self.blocks:
+            return
+        count = 0
+        stack = [(self.blocks[0], iter(children[0]))]
+        self._entered[0] = count
+        while stack:
+            block, rest = stack[-1]
+            child = next(rest, None)
+            count += 1
+            if child is None:
+                stack.pop()
+                self._left[block.index] = count
+            else:
+                self._entered[child.index] = count
+                stack.append((child, iter(children[child.index])))
+
+    @staticmethod
+    def intersect(idom, number, a, b):
+        while a is not b:
+            while number[a] < number[b]:
+                a = idom[a]
+            while number[b] < number[a]:
+                b = idom[b]
+        return a
+
+    def dominates(self, a, b):
+        """ Does every path from the start to block b go through block a? """
+        self.dominators()
+        return self._entered[b.index] != -1 and \
+            self._entered[a.index] <= self._entered[b.index] and self._left[b.index] <= self._left[a.index]
+
+    # Loops
+
+    def loops(self):
+        """ The natural loops, outer loops before the loops in them """
+        if self._loops is None:
+            loops = {}
+            for block in self.blocks:
+                for successor in block.successors:
+                    if self.dominates(successor, block):  # A back edge
+                        loop = loops.get(successor) or loops.setdefault(successor, Loop(successor))
+                        work = [block]
+                        while work:
+                            member = work.pop()
+                            if member not in loop.blocks and self.dominates(successor, member):  # Reachable
+                                loop.blocks.add(member)
+                                work.extend(member.predecessors)
+            # Bigger loops first: the loop a header is in when its own loop comes up
+            # is the innermost loop around that one
+            ordered = sorted(loops.values(), key=lambda loop: -len(loop.blocks))
+            for loop in ordered:
+                loop.parent = loop.header.loop
+                if loop.parent is not None:
+                    loop.depth = loop.parent.depth + 1
+                for block in loop.blocks:
+                    block.loop = loop
+            self._loops = ordered
+        return self._loops
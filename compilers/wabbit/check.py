@@ -9,59 +9,57 @@
 #
 # A key to this part of the project is going to be test coverage.
 # As you add code, think about how to add unit tests.
-from compilers.wabbit.errors import error
+from compilers.wabbit.errors import error, get_diagnostics, set_diagnostics, Diagnostic, Diagnostics, TooManyErrors, ERROR
+from compilers.wabbit.flat import FlatTree, KIND_CODES, kind_handlers
 from compilers.wabbit.model import *
+from compilers.wabbit.resolve import Resolver, Frame, GLOBAL, LOCAL
 from collections import ChainMap
 
 # in each function:
 # * the node is the instance of the class
 # * the env is the environment / symbol table
-from compilers.wabbit.typesys import check_binop, check_unop, check_typecast
+from compilers.wabbit.typesys import check_binop, check_unop, check_typecast, BINARY_OPS, UNARY_OPS, TYPE_CASTS, \
+    TYPES, TYPE_IDS, BOOL, type_id
+from compilers.wabbit.visitor import functions
 
 
 def check_program(top, get_env=ChainMap):
-    """The top level function that checks everything (creates the initial)"""
-    env = get_env()
-    check(top, env)
+    """
+    The top level function that checks everything (creates the initial env).
+    Returns True if no errors were found.  Errors go to the current
+    Diagnostics (see errors.py), checking stops early if it has a max_errors.
+    """
+    diagnostics = get_diagnostics()
+    errors_before = diagnostics.error_count
+    try:
+        if isinstance(top, FlatTree):
+            FlatChecker(top).check(top.root)  # Straight from the arrays, see below
+        else:
+            env = get_env()
+            resolver = Resolver()  # Binds names to declarations, so check_NamedLocation doesn't look them up
+            for statement in top:  # A statement at a time, so stopping early skips resolving the rest too
+                resolver.resolve(statement)
+                check(statement, env)
+    except TooManyErrors:
+        pass  # Already recorded (diagnostics.aborted), the rest isn't worth checking
+    return diagnostics.error_count == errors_before
 
 
 def check(node, env):
     """Check individual nodes/lists by dispatching the relevant check_<> method. """
-    if isinstance(node, list):
-        for n in node:
-            check(n, env)
-    elif isinstance(node, Expression):  # 3. Expression -> Node
-                                        # 4. Location -> Expression -> Node
-        check_expression(node, env)
-    elif isinstance(node, Definition):  # 2. Definition -> Statement -> Node
-        check_definition(node, env)
-    elif isinstance(node, Statement):   # 1. Statement -> Node
-        assert not isinstance(node, Definition), 'Definitions should be checked separately'
-        check_statement(node, env)
-    else:
-        raise RuntimeError(f'{node} not checked!')  # should always do this
+    CHECKERS[type(node)](node, env)  # check_<class name>, or the one of the closest parent class
 
-# Expression Checks
-# =================
 
+def check_list(node, env):
+    for n in node:
+        check(n, env)
 
-def check_expression(node, env):
-    if isinstance(node, BinaryOperator):
-        check_BinaryOperator(node, env)
-    elif isinstance(node, UnaryOperator):
-        check_UnaryOperator(node, env)
-    elif isinstance(node, FunctionCall):
-        check_FunctionCall(node, env)
-    elif isinstance(node, TypeCast):
-        check_TypeCast(node, env)
-    elif isinstance(node, Location):  # covers multiple sub-types
-        check_Location(node, env)
-    elif isinstance(node, Literal):  # covers multiple sub-types
-        check_Literal(node, env)
-    elif isinstance(node, Fetch):
-        check_Fetch(node, env)
-    else:
-        raise RuntimeError(f"Expression {node} not checked.")
+
+def check_object(node, env):
+    raise RuntimeError(f'{node} not checked!')  # should always do this
+
+# Expression Checks
+# =================
 
 
 def check_BinaryOperator(node, env):
@@ -70,19 +68,23 @@ def check_BinaryOperator(node, env):
     node.type = check_binop(node.left.type, node.operator, node.right.type)
     if node.type is None and (node.left.type and node.right.type):
         # if left and right have types then we are *not* in a cascading case
-        error(f'Invalid binop: {node.left.type} {node.operator} {node.right.type}')
+        error(f'Invalid binop: {node.left.type} {node.operator} {node.right.type}', node.offset, 'binop')
 
 
 def check_UnaryOperator(node, env):
     check(node.operand, env)
     node.type = check_unop(node.operator, node.operand.type)
-    if node.type is None:
-        error(f'Invalid unary operation: {node.operator}{node.operand}')
+    if node.operator == '^':
+        error('Growing memory is not supported yet', node.offset, 'unsupported')
+    elif node.type is None and node.operand.type:
+        error(f'Invalid unary operation: {node.operator}{node.operand}', node.offset, 'unop')
 
 
 def check_TypeCast(node, env):
     check(node.value, env)
     node.type = check_typecast(node.value.type, node.target_type)
+    if node.type is None and node.value.type:
+        error(f'Invalid type-cast: {node.value.type} to {node.target_type}', node.offset, 'typecast')
 
 
 def check_FunctionCall(node, env):
@@ -90,76 +92,78 @@ def check_FunctionCall(node, env):
     check(node.args, env)
 
     # Check that the function is defined
+    node.type = None  # Until we know (it may have been checked before, see IncrementalChecker)
     func = env.get(node.function_name)
     if func is None:
-        error(f'Function {node.function_name} is not defined.')
+        error(f'Function {node.function_name} is not defined.', node.offset, 'undefined')
+        return  # ... and no further checking is possible
 
     # Check that the function is a function
     if not isinstance(func, Function):
-        error(f'Cannot call {node.name} as a function')
-        return  # ... and no further checking is possible
+        error(f'Cannot call {node.function_name} as a function', node.offset, 'not-callable')
+        return
 
     # Check that the function has all of the arguments that it needs
     if len(func.parameters) != len(node.args):
-        error(f'Function is missing required arguments. Needs {func.parameters} got {node.args}')
+        error(f'Function {func.name} takes {len(func.parameters)} arguments ({", ".join(map(str, func.parameters))}), '
+              f'got {len(node.args)}', node.offset, 'arguments')
 
     # Check that the function parameter types match the supplied argument types
     for n, (arg, param) in enumerate(zip(node.args, func.parameters), 1):
         if param.type != arg.type:
-            error(f'Type error in argument {n}: {param.type} != {arg.type}')
+            error(f'Type error in argument {n}: {param.type} != {arg.type}', arg.offset, 'argument-type')
 
     node.type = func.return_type
 
 
 def check_Location(node, env):
-    if isinstance(node, NamedLocation):
-        check_NamedLocation(node, env)
-    else:
-        raise RuntimeError(f"Location {node} not checked.")
+    # Only called for locations without a check of their own (NamedLocation has one)
+    raise RuntimeError(f"Location {node} not checked.")
 
-    # Assignment checks require that location checks add a mutability attribute
-    assert hasattr(node, 'mutable')
+
+def check_MemoryAddress(node, env):
+    check(node.address, env)
+    error(f'Memory addresses are not supported yet: {node}', node.offset, 'unsupported')
+    node.type = None
+    node.mutable = True  # Only the error above, not one about assigning to it
 
 
 def check_NamedLocation(node, env):
-    declaration = env.get(node.name)
+    # Assignment checks require that location checks add a mutability attribute
+    declaration = node.declaration  # See resolve.py
+    if declaration is None:
+        declaration = env.get(node.name)  # Not resolved (checking a piece of a program) or not declared
     if declaration is None:
-        error(f'Location {node} was not declared')
+        error(f'Location {node} was not declared', node.offset, 'undefined')
+        node.type = node.mutable = None  # In case it was checked before, see IncrementalChecker
         return  # cannot do further checking
 
+    if isinstance(declaration, Function):
+        error(f'{node.name} is a function, not a value', node.offset, 'not-a-value')
+        node.type = None
+        node.mutable = True  # Only the error above, not one about assigning to it
+        return
+
     node.type = declaration.type
-    node.mutable = not isinstance(declaration, (Constant, Function))
+    node.mutable = not isinstance(declaration, Constant)
 
 
 # Definition / Declaration Checks
 # ===============================
 
-def check_definition(node, env):
-    if isinstance(node, Variable):
-        check_Variable(node, env)
-    elif isinstance(node, Constant):
-        check_Constant(node, env)
-    elif isinstance(node, Function):
-        check_Function(node, env)
-    elif isinstance(node, FunctionParameter):
-        check_FunctionParameter(node, env)
-    else:
-        raise RuntimeError(f"Definition {node} not checked.")
-
-
 def _checkVariableOrConst(node, env):
     if node.value is not None:
         check(node.value, env)
 
         if node.type_specified_when_declared:
             if node.value.type != node.type:
-                error(f'Variable defined as type {node.type} does not match {node.value.type}')
+                error(f'Variable defined as type {node.type} does not match {node.value.type}', node.offset, 'declared-type')
         else:
             # infer type from value
             node.type = node.value.type
 
     if node.name in env:
-        error(f'Duplicate definition of {node.name}')
+        error(f'Duplicate definition of {node.name}', node.offset, 'duplicate')
     env[node.name] = node
 
 
@@ -172,12 +176,20 @@ def check_Constant(node, env):
 
 
 def check_Function(node, env):
+    declare_function(node, env)
+    check_function_body(node, env)
+
+
+def declare_function(node, env):
     if node.name in env.maps[0]:
-        error(f'Duplicate definition of {node.name}.')
+        error(f'Duplicate definition of {node.name}.', node.offset, 'duplicate')
         # and do NOT overwrite it ... originally defined function stays
     else:
         env[node.name] = node
 
+
+def check_function_body(node, env):
+    # Only reads env (see parallel.py, which checks bodies in other processes)
     local_env = env.new_child()
     check(node.parameters, local_env)
     check(node.statements, local_env)
@@ -185,43 +197,24 @@ def check_Function(node, env):
 
 def check_FunctionParameter(node, env):
     if node.name in env.maps[0]:
-        error(f'Duplicate definition of {node.name}')
+        error(f'Duplicate definition of {node.name}', node.offset, 'duplicate')
     env[node.name] = node
 
 
 # Statement Checks
 # ================
 
-def check_statement(node, env):
-    if isinstance(node, Assignment):
-        check_Assignment(node, env)
-    elif isinstance(node, Print):
-        check_Print(node, env)
-    elif isinstance(node, If):
-        check_If(node, env)
-    elif isinstance(node, While):
-        check_While(node, env)
-    elif isinstance(node, Break):
-        check_Break(node, env)
-    elif isinstance(node, Continue):
-        check_Continue(node, env)
-    elif isinstance(node, Return):
-        check_Return(node, env)
-    else:
-        raise RuntimeError(f"Statement {node} not checked.")
-
-
 def check_Assignment(node, env):
     check(node.location, env)
     check(node.expression, env)
 
-    # What I expect
-    if node.location.type != node.expression.type:
-        error(f'Type error on assignment: {node.location.type} != {node.expression.type}')
+    # What I expect (if either has no type, there has been an error about it already)
+    if node.location.type and node.expression.type and node.location.type != node.expression.type:
+        error(f'Type error on assignment: {node.location.type} != {node.expression.type}', node.offset, 'assignment-type')
 
     # Mutability: let's make assignment responsible for this
     if not node.location.mutable:  # Wishful Thinking Programming!
-        error(f"Cannot assign to immutable location: {node.location}")
+        error(f"Cannot assign to immutable location: {node.location}", node.offset, 'immutable')
 
 
 def check_Print(node, env):
@@ -231,7 +224,7 @@ def check_Print(node, env):
 def check_If(node, env):
     check(node.test, env)
     if node.test.type != Bool.type:
-        error('If test did not evaluate to a Boolean!')
+        error('If test did not evaluate to a Boolean!', node.test.offset, 'test-type')
     check(node.consequence, env.new_child())  # Make a new scope (from ChainMap)
     check(node.alternative, env.new_child())
 
@@ -239,7 +232,7 @@ def check_If(node, env):
 def check_While(node, env):
     check(node.test, env)
     if node.test.type != Bool.type:
-        error('If test did not evaluate to a Boolean!')
+        error('If test did not evaluate to a Boolean!', node.test.offset, 'test-type')
     check(node.consequence, env.new_child())
 
 
@@ -264,3 +257,442 @@ def check_Literal(node, env):
 
 def check_Fetch(node, env):
     pass
+
+
+CHECKERS = functions(globals(), 'check_')
+
+
+# Checking a FlatTree
+# ===================
+# check_program() on a FlatTree (see flat.py) doesn't go through model
+# objects or views of them.  FlatChecker walks the arrays: a node is an
+# id, its handler is picked by its kind, and types, names and the other
+# annotations are read from and written to the arrays.  It resolves the
+# names as it goes (like resolve.py, which check_program() runs on a
+# statement before checking it), with a single dict of what each name
+# means here and the names declared in the innermost scope.  That is
+# also all the checks above need to know of the env, so the annotations
+# and diagnostics are the same as for the model.  Views are only made
+# to format the few messages that show a piece of the program.
+#
+# The rules are written twice, once per store: going through accessors
+# that both stores implement would cost the model a call for every
+# attribute it reads.  test_flat.py checks that both give the same
+# diagnostics and annotations (and IR, see FlatTranspiler), so a rule
+# changed in one place and not the other fails there.
+
+LIST_KIND, FUNCTION_KIND = KIND_CODES[list], KIND_CODES[Function]
+CONSTANT_KIND, VARIABLE_KIND = KIND_CODES[Constant], KIND_CODES[Variable]
+
+
+class FlatChecker:
+    def __init__(self, tree):
+        self.tree = tree
+        self.kind, self.first, self.edges = tree.kind, tree.first, tree.edges
+        self.pool, self.pool_index = tree.pool, tree.pool_index
+        self.type, self.mutable, self.declaration = tree.type, tree.mutable, tree.declaration
+        self.names = {}  # name -> id of the declaration it refers to here
+        self.scope = {}  # Names declared in the innermost scope -> what they referred to outside of it
+        self.frame = self.globals = Frame(GLOBAL)
+
+    def check(self, id):
+        if id >= 0:
+            FLAT_CHECKERS[self.kind[id]](self, id)
+
+    def child(self, id, position):
+        return self.edges[self.first[id] + position]
+
+    def value(self, id, position):
+        return self.pool[self.pool_index[id]][position + 1]
+
+    def type_of(self, id):
+        type_id = self.type[id]
+        return None if type_id < 0 else TYPES[type_id]
+
+    def offset(self, id):
+        offset = self.tree.offset[id]
+        return None if offset < 0 else offset
+
+    def view(self, id):
+        return self.tree.node(id)
+
+    # Names (see resolve.py)
+
+    def bind(self, name, id):
+        if name not in self.scope:
+            self.scope[name] = self.names.get(name)
+        self.names[name] = id
+
+    def declare(self, id, name):
+        self.tree.depth[id] = self.frame.depth
+        self.tree.slot[id] = self.frame.size
+        self.frame.size += 1
+        self.bind(name, id)
+
+    def in_scope(self, id):
+        outer = self.scope
+        self.scope = {}
+        self.check(id)
+        self.leave_scope(outer)
+
+    def leave_scope(self, outer):
+        for name, previous in self.scope.items():
+            if previous is None:
+                del self.names[name]
+            else:
+                self.names[name] = previous
+        self.scope = outer
+
+    # Expressions
+
+    def check_list(self, id):
+        for child in self.edges[self.first[id]:self.first[id + 1]]:
+            self.check(child)
+
+    def check_BinaryOperator(self, id):
+        left, right = self.child(id, 0), self.child(id, 1)
+        self.check(left)
+        self.check(right)
+        operator = self.value(id, 0)
+        left_type, right_type = self.type[left], self.type[right]
+        table = BINARY_OPS.get(operator)
+        result = None if table is None or left_type < 0 or right_type < 0 else table[left_type][right_type]
+        self.type[id] = -1 if result is None else result.id
+        if result is None and left_type >= 0 and right_type >= 0:
+            error(f'Invalid binop: {self.type_of(left)} {operator} {self.type_of(right)}', self.offset(id), 'binop')
+
+    def check_UnaryOperator(self, id):
+        operand = self.child(id, 0)
+        self.check(operand)
+        operator = self.value(id, 0)
+        table = UNARY_OPS.get(operator)
+        result = None if table is None or self.type[operand] < 0 else table[self.type[operand]]
+        self.type[id] = -1 if result is None else result.id
+        if operator == '^':
+            error('Growing memory is not supported yet', self.offset(id), 'unsupported')
+        elif result is None and self.type[operand] >= 0:
+            error(f'Invalid unary operation: {operator}{self.view(operand)}', self.offset(id), 'unop')
+
+    def check_TypeCast(self, id):
+        value = self.child(id, 0)
+        self.check(value)
+        target = self.value(id, 0)
+        result = None if self.type[value] < 0 else TYPE_CASTS[self.type[value]][type_id(target)]
+        self.type[id] = -1 if result is None else result.id
+        if result is None and self.type[value] >= 0:
+            error(f'Invalid type-cast: {self.type_of(value)} to {target}', self.offset(id), 'typecast')
+
+    def check_FunctionCall(self, id):
+        args = self.child(id, 0)
+        self.check(args)
+        self.type[id] = -1
+        name = self.value(id, 0)
+        function = self.names.get(name)
+        if function is None:
+            error(f'Function {name} is not defined.', self.offset(id), 'undefined')
+            return
+        if self.kind[function] != FUNCTION_KIND:
+            error(f'Cannot call {name} as a function', self.offset(id), 'not-callable')
+            return
+        parameters = self.child(function, 0)
+        parameter_ids = self.tree.children(parameters)
+        arg_ids = self.tree.children(args)
+        if len(parameter_ids) != len(arg_ids):
+            error(f'Function {name} takes {len(parameter_ids)} arguments ({", ".join(map(str, self.view(parameters)))}), '
+                  f'got {len(arg_ids)}', self.offset(id), 'arguments')
+        for n, (arg, parameter) in enumerate(zip(arg_ids, parameter_ids), 1):
+            if self.type[parameter] != self.type[arg]:
+                error(f'Type error in argument {n}: {self.type_of(parameter)} != {self.type_of(arg)}',
+                      self.offset(arg), 'argument-type')
+        return_type = self.value(function, 1)
+        self.type[id] = TYPE_IDS.get(return_type, -1)
+
+    def check_MemoryAddress(self, id):
+        self.check(self.child(id, 0))
+        error(f'Memory addresses are not supported yet: {self.view(id)}', self.offset(id), 'unsupported')
+        self.type[id] = -1
+        self.mutable[id] = 1
+
+    def check_NamedLocation(self, id):
+        declaration = self.names.get(self.value(id, 0))
+        tree = self.tree
+        if declaration is None:
+            self.declaration[id] = tree.depth[id] = tree.slot[id] = -1
+            error(f'Location {self.view(id)} was not declared', self.offset(id), 'undefined')
+            self.type[id] = self.mutable[id] = -1
+            return
+        self.declaration[id] = declaration
+        tree.depth[id] = tree.depth[declaration]  # -1 for functions
+        tree.slot[id] = tree.slot[declaration]
+        if self.kind[declaration] == FUNCTION_KIND:
+            error(f'{self.value(id, 0)} is a function, not a value', self.offset(id), 'not-a-value')
+            self.type[id] = -1
+            self.mutable[id] = 1
+            return
+        self.type[id] = self.type[declaration]
+        self.mutable[id] = self.kind[declaration] != CONSTANT_KIND
+
+    def check_Literal(self, id):
+        pass
+
+    check_Fetch = check_Break = check_Continue = check_Literal
+
+    # Definitions
+
+    def check_Variable(self, id):
+        value = self.child(id, 0)
+        name = self.value(id, 0)
+        if value >= 0:
+            self.check(value)
+            if self.value(id, 1):  # type_specified_when_declared
+                if self.type[value] != self.type[id]:
+                    error(f'Variable defined as type {self.type_of(id)} does not match {self.type_of(value)}',
+                          self.offset(id), 'declared-type')
+            else:
+                self.type[id] = self.type[value]
+        if name in self.names:
+            error(f'Duplicate definition of {name}', self.offset(id), 'duplicate')
+        self.declare(id, name)
+
+    check_Constant = check_Variable
+
+    def check_Function(self, id):
+        self.declare_function(id)
+        self.check_function_body(id)
+
+    def declare_function(self, id):
+        name = self.value(id, 0)
+        if name in self.scope:
+            error(f'Duplicate definition of {name}.', self.offset(id), 'duplicate')
+        else:
+            self.bind(name, id)
+
+    def check_function_body(self, id):
+        outer_frame = self.frame
+        self.frame = Frame(LOCAL)
+        outer = self.scope
+        self.scope = {}
+        self.check(self.child(id, 0))
+        self.check(self.child(id, 1))
+        self.leave_scope(outer)
+        self.frame = outer_frame
+
+    def check_FunctionParameter(self, id):
+        name = self.value(id, 0)
+        if name in self.scope:
+            error(f'Duplicate definition of {name}', self.offset(id), 'duplicate')
+        self.declare(id, name)
+
+    # Statements
+
+    def check_Assignment(self, id):
+        location, expression = self.child(id, 0), self.child(id, 1)
+        self.check(location)
+        self.check(expression)
+        if self.type[location] >= 0 and self.type[expression] >= 0 and self.type[location] != self.type[expression]:
+            error(f'Type error on assignment: {self.type_of(location)} != {self.type_of(expression)}',
+                  self.offset(id), 'assignment-type')
+        if self.mutable[location] <= 0:
+            error(f'Cannot assign to immutable location: {self.view(location)}', self.offset(id), 'immutable')
+
+    def check_Print(self, id):
+        self.check(self.child(id, 0))
+
+    check_Return = check_Print
+
+    def check_If(self, id):
+        test = self.child(id, 0)
+        self.check(test)
+        if self.type[test] != BOOL.id:
+            error('If test did not evaluate to a Boolean!', self.offset(test), 'test-type')
+        self.in_scope(self.child(id, 1))
+        self.in_scope(self.child(id, 2))
+
+    def check_While(self, id):
+        test = self.child(id, 0)
+        self.check(test)
+        if self.type[test] != BOOL.id:
+            error('If test did not evaluate to a Boolean!', self.offset(test), 'test-type')
+        self.in_scope(self.child(id, 1))
+
+
+FLAT_CHECKERS = kind_handlers(FlatChecker, 'check_')
+
+
+# Incremental Checking
+# ====================
+# An IncrementalChecker keeps a checked program around and, when it is
+# given the program again after an edit, only checks the top-level
+# statements that may have a different outcome.  A statement is reused
+# (annotations, slots and errors) if it is the same object as last time
+# (e.g. an unchanged segment of an IncrementalProgram) and every name it
+# looked up outside of itself still refers to the same declaration, with
+# the same type.  Those names are recorded while it is checked: names it
+# uses, functions it calls and the names it declares (a duplicate
+# definition is an error).
+#
+# Checking still goes through the statements in order to know what each
+# global name means at each point, but reusing a statement costs a few
+# dict operations.  Statements are assumed to stay in the same order.
+# Global slots of reused declarations stay as they are and new ones get
+# the next free slot, so after a few updates there may be unused slots
+# (check_program numbers them from scratch).
+#
+# The nodes of a statement an IncrementalProgram reuses keep the offsets
+# they were parsed at.  Given the program's shift(), update() reports
+# errors where the statement is now, and diagnostics() moves the errors
+# it kept for a statement by as much as the statement moved since.
+
+class RecordingResolver(Resolver):
+    """ Resolver that records what each name it looks up referred to """
+    def __init__(self, globals_frame):
+        super().__init__()
+        self.frame = self.globals = globals_frame
+        self.reads = []  # (name, declaration or None)
+
+    def lookup(self, name):
+        declaration = self.names.get(name)
+        self.reads.append((name, declaration))
+        return declaration
+
+    def declare(self, node):
+        self.reads.append((node.name, self.names.get(node.name)))
+        if self.frame is self.globals and node.slot is not None:
+            self.bind(node.name, node)  # Checked before. Other statements may have its slot
+        else:
+            super().declare(node)
+
+    def resolve_Function(self, node):
+        self.reads.append((node.name, self.names.get(node.name)))
+        super().resolve_Function(node)
+
+    def resolve_FunctionCall(self, node):
+        self.lookup(node.function_name)  # check_FunctionCall looks it up in the env
+        super().resolve_FunctionCall(node)
+
+
+class CheckedStatement:
+    __slots__ = ('name', 'function', 'reads', 'names', 'type', 'errors', 'error_count', 'shift')
+
+    def __init__(self, statement, reads, errors, shift):
+        declaration = isinstance(statement, (Function, Variable, Constant))
+        self.name = statement.name if declaration else None  # The global it declares
+        self.function = isinstance(statement, Function)
+        self.reads = reads            # {name: declaration (or None) it referred to from outside the statement}
+        self.names = frozenset(reads)
+        self.type = statement.type if declaration and not self.function else None  # To tell if it changed
+        self.errors = errors          # The diagnostics it produced
+        self.error_count = sum(1 for d in errors if d.severity == ERROR)
+        self.shift = shift            # Of the statement when the errors were reported, see above
+
+
+class IncrementalChecker:
+    def __init__(self, max_errors=None, echo=False):
+        self.checked = {}              # statement -> CheckedStatement
+        self.globals = Frame(GLOBAL)   # Kept between updates, see above
+        self.statements = []
+        self.rechecked = []            # The statements checked by the last update()
+        self.error_count = 0
+        self.max_errors = max_errors   # For each update (only the statements it checks count)
+        self.echo = echo
+        self.last = Diagnostics(max_errors, echo)  # What the last update() reported
+        self.shift = None              # The shift() given to the last update()
+
+    def update(self, statements, shift=None):
+        """
+        Check a program (a list of statements) reusing what still holds from
+        the previous update.  Returns True if the program has no errors.
+        Diagnostics go to a new collector for each update (self.last), the
+        ones of the whole program are in diagnostics().  shift(statement) is
+        how far a statement moved since it was parsed (IncrementalProgram.shift).
+        """
+        self.last = Diagnostics(self.max_errors, self.echo)
+        self.shift = shift
+        previous = set_diagnostics(self.last)
+        try:
+            return self._update(statements, self.last, shift)
+        finally:
+            set_diagnostics(previous)
+
+    def _update(self, statements, diagnostics, shift):
+        checked = self.checked
+        self.statements = statements
+        self.rechecked = rechecked = []
+        resolver = RecordingResolver(self.globals)
+        names = resolver.names
+        scope = resolver.scope
+        env = ChainMap()
+        top = env.maps[0]  # The checker's global scope (the resolver has its own)
+
+        # Names that may refer to something else than last time at some point in the program
+        removed = checked.keys() - set(statements)
+        rebound = set()
+        for statement in removed:
+            entry = checked.pop(statement)
+            self.error_count -= entry.error_count
+            if entry.name is not None:
+                rebound.add(entry.name)
+        changed = set()  # Declarations whose type changed
+
+        for statement in statements:
+            entry = checked.get(statement)
+            if entry is not None and (rebound.isdisjoint(entry.names) or self.still_valid(entry, names, changed)):
+                # Do to the global scopes what checking it would do.  At the top level
+                # only the keys of the resolver's scope matter (it is never left).
+                name = entry.name
+                if name is not None and not (entry.function and name in top):
+                    names[name] = top[name] = statement
+                    scope[name] = None
+                continue
+
+            name = statement.name if isinstance(statement, (Function, Variable, Constant)) else None
+            before = names.get(name)
+            resolver.reads = []
+            start = len(diagnostics.records)
+            diagnostics.shift = 0 if shift is None else shift(statement)
+            try:
+                resolver.resolve(statement)
+                check(statement, env)
+            except TooManyErrors:
+                for statement in statements[statements.index(statement):]:
+                    entry = checked.pop(statement, None)  # Checked by the next update
+                    if entry is not None:
+                        self.error_count -= entry.error_count
+                break
+            reads = {}
+            for read, declaration in resolver.reads:
+                if declaration is (before if read == name else names.get(read)):
+                    reads[read] = declaration  # Not something declared inside the statement
+            checked[statement] = new_entry = CheckedStatement(statement, reads, diagnostics.records[start:], diagnostics.shift)
+            rechecked.append(statement)
+            self.error_count += new_entry.error_count - (entry.error_count if entry is not None else 0)
+            if name is not None:
+                rebound.add(name)
+                if entry is not None and not entry.function and entry.type != statement.type:
+                    changed.add(statement)
+        return not self.has_errors
+
+    @staticmethod
+    def still_valid(entry, names, changed):
+        for name, declaration in entry.reads.items():
+            if names.get(name) is not declaration or declaration in changed:
+                return False
+        return True
+
+    @property
+    def has_errors(self):
+        return self.error_count > 0
+
+    def diagnostics(self):
+        """ The errors and warnings of the whole program, reused or not, where they are now (see above) """
+        checked, shift = self.checked, self.shift
+        for statement in self.statements:
+            entry = checked.get(statement)
+            if entry is None or not entry.errors:
+                continue
+            moved = 0 if shift is None else shift(statement) - entry.shift
+            if moved:
+                for d in entry.errors:
+                    yield Diagnostic(d.severity, d.code, d.message, d.offset if d.offset is None else d.offset + moved)
+            else:
+                yield from entry.errors
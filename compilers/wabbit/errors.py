@@ -8,8 +8,168 @@
 # place.  Make it easy to report errors.  Make it easy to find out
 # if errors have occurred.
 #
+# Errors are reported against an integer offset into the source.  The
+# source being compiled is registered with set_source() (the tokenizer
+# does this) and offsets are only turned into line:column when a
+# message is actually produced.
+#
+# Errors and warnings go to a Diagnostics collector.  Each one is kept
+# as a record (severity, code, message, offset) and, by default, printed
+# as it comes in.  The collector knows if there were any errors, so a
+# driver can stop before generating code for a program that doesn't
+# compile, and it can be given a maximum number of errors.  Reaching it
+# raises TooManyErrors: check_program() catches that and stops checking
+# (tokenizer errors raise it out of the parser).  A batch or watch mode
+# collects each program separately:
+#
+#     with errors.collecting(max_errors=20) as diagnostics:
+#         program = Parser(tokenize(text)).parse_statements()
+#         check_program(program)
+#     if not diagnostics.has_errors:
+#         code = generate_ircode(program)
+#
+# Outside of collecting(), diagnostics go to a process-wide default
+# collector.  It prints and counts them but doesn't keep the records, so
+# a long-running process doesn't hold on to every message it ever
+# reported.
+from contextlib import contextmanager
+
+from compilers.wabbit.source import SourceIndex
+
+ERROR = 'error'
+WARNING = 'warning'
+
+_source = None
+
+
+def set_source(source):
+    """ Register the text (or a SourceIndex) that error offsets refer to """
+    global _source
+    _source = source if isinstance(source, SourceIndex) else SourceIndex(source)
+
+
+def get_source():
+    return _source
+
+
+def format_message(message, offset=None):
+    if offset is None:
+        return message
+    if _source is None:
+        return f'offset {offset}: {message}'
+    return f'{_source.describe(offset)}: {message}'
+
+
 class ParseError(Exception):
-    pass
+    def __init__(self, message, offset=None):
+        super().__init__(format_message(message, offset))
+        self.message = message
+        self.offset = offset
+
+    def __reduce__(self):
+        # Keep the offset when the error is pickled (e.g. raised in a worker process)
+        return ParseError, (self.message, self.offset)
+
+
+class TooManyErrors(Exception):
+    def __init__(self, count):
+        super().__init__(f'Stopped after {count} errors')
+        self.count = count
+
+    def __reduce__(self):
+        return TooManyErrors, (self.count,)
+
+
+class Diagnostic:
+    __slots__ = ('severity', 'code', 'message', 'offset')
+
+    def __init__(self, severity, code, message, offset=None):
+        self.severity = severity
+        self.code = code        # Short name for the kind of problem, e.g. 'duplicate' (may be None)
+        self.message = message
+        self.offset = offset
+
+    def __repr__(self):
+        return f'Diagnostic({self.severity!r}, {self.code!r}, {self.message!r}, {self.offset!r})'
+
+    def __str__(self):
+        message = self.message if self.severity == ERROR else f'{self.severity}: {self.message}'
+        return format_message(message, self.offset)
+
+
+class Diagnostics:
+    def __init__(self, max_errors=None, echo=True, keep=True):
+        self.records = []        # Only if keep
+        self.error_count = 0
+        self.has_errors = False  # A plain attribute, so checking it costs nothing
+        self.aborted = False     # Stopped at max_errors
+        self.max_errors = max_errors
+        self.echo = echo         # Print each diagnostic when it is reported
+        self.keep = keep
+        self.shift = 0           # Added to the offsets reported, for code that moved since it was parsed
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    @property
+    def errors(self):
+        return [d for d in self.records if d.severity == ERROR]
+
+    @property
+    def warnings(self):
+        return [d for d in self.records if d.severity == WARNING]
+
+    def report(self, severity, message, offset=None, code=None):
+        diagnostic = Diagnostic(severity, code, message, offset if offset is None else offset + self.shift)
+        if self.keep:
+            self.records.append(diagnostic)
+        if self.echo:
+            print(diagnostic)
+        if severity == ERROR:
+            self.error_count += 1
+            self.has_errors = True
+            if self.max_errors is not None and self.error_count >= self.max_errors:
+                self.aborted = True
+                raise TooManyErrors(self.error_count)
+
+    def error(self, message, offset=None, code=None):
+        self.report(ERROR, message, offset, code)
+
+    def warning(self, message, offset=None, code=None):
+        self.report(WARNING, message, offset, code)
+
+
+_diagnostics = Diagnostics(keep=False)
+
+
+def get_diagnostics():
+    return _diagnostics
+
+
+def set_diagnostics(diagnostics):
+    """ Make diagnostics the collector that error() and warning() report to. Returns the previous one """
+    global _diagnostics
+    previous, _diagnostics = _diagnostics, diagnostics
+    return previous
+
+
+@contextmanager
+def collecting(max_errors=None, echo=True):
+    """ Report to a new Diagnostics for the duration of the with block """
+    diagnostics = Diagnostics(max_errors, echo)
+    previous = set_diagnostics(diagnostics)
+    try:
+        yield diagnostics
+    finally:
+        set_diagnostics(previous)
+
+
+def error(message, offset=None, code=None):
+    _diagnostics.error(message, offset, code)
+
 
-def error(message):
-    print(message)
+def warning(message, offset=None, code=None):
+    _diagnostics.warning(message, offset, code)
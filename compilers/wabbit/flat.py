@@ -0,0 +1,277 @@
+# flat.py
+#
+# A flat store for the model.  Instead of one Python object per node,
+# a FlatTree keeps the whole program in a handful of parallel arrays
+# (struct-of-arrays) and a node is just an integer id into them:
+#
+#     kind[id]          which model class (index into KINDS)
+#     edges[first[id]:first[id + 1]]
+#                       ids of the children (-1 for a missing one)
+#     pool_index[id]    the node's other values (names, operators,
+#                       literal values, ...) as a tuple in the pool,
+#                       after the kind
+#     type[id]          type id (see typesys.py), filled in by the checker
+#     offset[id]        position in the source
+#     mutable[id], declaration[id]
+#                       also filled in by the checker
+#     depth[id], slot[id]
+#                       filled in by resolve.py
+#
+# Lists of statements/arguments/parameters are nodes too (kind LIST).
+# Children always come before their parent, so a tree is built bottom up
+# by appending and the top-level list is the last node.  The pool only
+# keeps one copy of equal tuples, so e.g. every 'x' or '+' is stored once.
+#
+# check_program() and IRModule walk a FlatTree's arrays directly, with a
+# handler for each kind of node (FlatChecker in check.py and
+# FlatTranspiler in ircode.py, see kind_handlers()).  Code that wants
+# model nodes can use tree.node(id), a view: an instance of a subclass
+# of the model class (FlatBinaryOperator is a BinaryOperator, ...) that
+# only holds (tree, id) and reads and writes its attributes straight
+# from the arrays.  There is one view per id, made the first time it's
+# asked for, so views can be compared with 'is' and used as dict keys
+# (e.g. a declaration).  Lists are new lists of views every time.
+from array import array
+
+from compilers.wabbit.model import Assignment, Print, If, While, Break, Continue, Return, Variable, Constant, \
+    Function, FunctionParameter, Integer, Float, Bool, Char, BinaryOperator, UnaryOperator, Fetch, TypeCast, \
+    FunctionCall, NamedLocation, MemoryAddress, OPTIONAL_FIELDS
+from compilers.wabbit.typesys import TYPES, TYPE_IDS
+
+KINDS = (list, Assignment, Print, If, While, Break, Continue, Return, Variable, Constant, Function,
+         FunctionParameter, Integer, Float, Bool, Char, BinaryOperator, UnaryOperator, Fetch, TypeCast,
+         FunctionCall, NamedLocation, MemoryAddress)
+LIST = 0
+
+KIND_CODES = {cls: code for code, cls in enumerate(KINDS)}
+
+def kind_handlers(cls, prefix, default=None):
+    """
+    [handler for each kind] for a pass over the arrays: the method of cls
+    named prefix + class name, or the one of the closest parent class
+    (like visitor.py does for the model)
+    """
+    handlers = []
+    for kind in KINDS:
+        names = (prefix + klass.__name__ for klass in kind.__mro__)
+        handlers.append(next((getattr(cls, name) for name in names if hasattr(cls, name)), default))
+    return handlers
+
+
+# The attributes of each class that hold other nodes (or lists of nodes)
+CHILD_FIELDS = {
+    Assignment: ('location', 'expression'),
+    Print: ('expression',),
+    If: ('test', 'consequence', 'alternative'),
+    While: ('test', 'consequence'),
+    Return: ('value',),
+    Variable: ('value',),
+    Constant: ('value',),
+    Function: ('parameters', 'statements'),
+    BinaryOperator: ('left', 'right'),
+    UnaryOperator: ('operand',),
+    Fetch: ('location',),
+    TypeCast: ('value',),
+    FunctionCall: ('args',),
+    MemoryAddress: ('address',),
+}
+
+
+def value_fields(cls):
+    """ The attributes of a class that are kept in the pool (offset, type, ... have arrays of their own) """
+    return tuple(name for name in cls._fields if name not in OPTIONAL_FIELDS and name not in CHILD_FIELDS.get(cls, ()))
+
+
+VALUE_FIELDS = {cls: value_fields(cls) for cls in KINDS[1:]}
+
+
+class FlatTree:
+    def __init__(self):
+        self.kind = array('B')
+        self.first = array('i', [0])
+        self.edges = array('i')
+        self.pool_index = array('i')
+        self.type = array('b')
+        self.offset = array('q')
+        self.mutable = array('b')
+        self.declaration = array('i')
+        self.depth = array('b')
+        self.slot = array('i')
+        self.pool = []
+        self._pool_ids = {}  # pool entry -> its index. Only needed while adding nodes
+        self.root = -1       # Id of the list of top-level statements
+        self._views = {}     # id -> its view, see node()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_views'] = {}  # The view classes are made at runtime and can't be pickled
+        return state
+
+    @classmethod
+    def from_model(cls, statements):
+        """ Flat copy of a list of model statements (declarations, depths and slots are not kept) """
+        tree = cls()
+        tree.root = tree.append(statements)
+        tree.done()
+        return tree
+
+    def done(self):
+        """ Drop what is only needed while adding nodes (add() still works, it's just slower the first time) """
+        self._pool_ids = None
+
+    def __len__(self):
+        return len(self.kind)
+
+    def add(self, kind, children=(), values=None, type=None, offset=None, mutable=None):
+        """ Add a single node whose children are already in the tree. Returns its id """
+        self.kind.append(kind)
+        self.edges.extend(children)
+        self.first.append(len(self.edges))
+        if values is None:
+            self.pool_index.append(-1)
+        else:
+            values = (kind,) + values  # So the tuple is its own key in _pool_ids
+            if self._pool_ids is None:
+                self._pool_ids = {values: index for index, values in enumerate(self.pool)}
+            index = self._pool_ids.get(values)
+            if index is None:
+                index = self._pool_ids[values] = len(self.pool)
+                self.pool.append(values)
+            self.pool_index.append(index)
+        self.type.append(TYPE_IDS.get(type, -1))
+        self.offset.append(-1 if offset is None else offset)
+        self.mutable.append(-1 if mutable is None else mutable)
+        self.declaration.append(-1)
+        self.depth.append(-1)
+        self.slot.append(-1)
+        return len(self.kind) - 1
+
+    def append(self, node):
+        """ Add a model node (or list of nodes) and everything below it. Returns its id """
+        # Post-order with an explicit stack, so deeply nested programs (see StackParser) are fine
+        ids = []
+        stack = [(node, False)]
+        while stack:
+            node, done = stack.pop()
+            if node is None:
+                ids.append(-1)
+                continue
+            if isinstance(node, list):
+                children = node
+            else:
+                children = [getattr(node, name) for name in CHILD_FIELDS.get(type(node), ())]
+            if not done:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(children))
+                continue
+            if children:
+                child_ids = ids[-len(children):]
+                del ids[-len(children):]
+            else:
+                child_ids = ()
+            if isinstance(node, list):
+                ids.append(self.add(LIST, child_ids))
+            else:
+                cls = type(node)
+                ids.append(self.add(KIND_CODES[cls], child_ids, tuple(getattr(node, name) for name in VALUE_FIELDS[cls]),
+                                    getattr(node, 'type', None), node.offset, getattr(node, 'mutable', None)))
+        return ids[0]
+
+    def children(self, id):
+        return self.edges[self.first[id]:self.first[id + 1]]
+
+    def node(self, id):
+        """ A view of node id that looks like a model node (a list for LIST nodes, None for -1) """
+        if id < 0:
+            return None
+        kind = self.kind[id]
+        if kind == LIST:
+            return [self.node(child) for child in self.children(id)]
+        view = self._views.get(id)
+        if view is None:
+            view = self._views[id] = VIEWS[kind](self, id)
+        return view
+
+    def statements(self):
+        """ Views of the top-level statements """
+        return self.node(self.root)
+
+
+# View classes.  One per model class, with a property for each attribute
+
+def _child(position):
+    def get(self):
+        tree = self.tree
+        return tree.node(tree.edges[tree.first[self.id] + position])
+    return property(get)
+
+
+def _value(position):
+    def get(self):
+        tree = self.tree
+        return tree.pool[tree.pool_index[self.id]][position + 1]
+    return property(get)
+
+
+def _get_type(self):
+    type_id = self.tree.type[self.id]
+    return None if type_id < 0 else TYPES[type_id]
+
+
+def _set_type(self, value):
+    self.tree.type[self.id] = TYPE_IDS.get(value, -1)
+
+
+def _column(name):
+    """ Property for an array of numbers that uses -1 for None """
+    def get(self):
+        value = getattr(self.tree, name)[self.id]
+        return None if value < 0 else value
+
+    def set(self, value):
+        getattr(self.tree, name)[self.id] = -1 if value is None else value
+    return property(get, set)
+
+
+def _get_mutable(self):
+    mutable = self.tree.mutable[self.id]
+    return None if mutable < 0 else bool(mutable)
+
+
+def _set_mutable(self, value):
+    self.tree.mutable[self.id] = -1 if value is None else value
+
+
+def _get_declaration(self):
+    return self.tree.node(self.tree.declaration[self.id])
+
+
+def _set_declaration(self, value):
+    # Only views of the same tree can be recorded
+    self.tree.declaration[self.id] = -1 if value is None else value.id
+
+
+def _init_view(self, tree, id):
+    self.tree = tree
+    self.id = id
+
+
+def _view_class(cls):
+    namespace = {
+        '__slots__': ('tree', 'id'),
+        '__init__': _init_view,
+        'type': property(_get_type, _set_type),
+        'offset': _column('offset'),
+        'depth': _column('depth'),
+        'slot': _column('slot'),
+        'mutable': property(_get_mutable, _set_mutable),
+        'declaration': property(_get_declaration, _set_declaration),
+    }
+    for position, name in enumerate(CHILD_FIELDS.get(cls, ())):
+        namespace[name] = _child(position)
+    for position, name in enumerate(VALUE_FIELDS[cls]):
+        namespace[name] = _value(position)
+    return type(f'Flat{cls.__name__}', (cls,), namespace)
+
+
+VIEWS = [None] + [_view_class(cls) for cls in KINDS[1:]]
@@ -0,0 +1,81 @@
+# hashcons.py
+#
+# Sharing identical expressions ("hash-consing").
+#
+# Programs repeat the same small expressions all the time: 0, 1.0,
+# '\n', x*x, y*y, n - 1, ...  An Interner hands out a single node for
+# all the structurally identical copies of a pure expression, so later
+# passes can tell that two subtrees are the same with 'is' and use
+# them as dictionary keys without walking them.  Every shared node also
+# gets a structural_hash, computed once from the hashes of its children.
+#
+# It's opt-in: pass an Interner to the Parser
+#
+#     parser = Parser(tokens, Interner())
+#
+# Things to keep in mind:
+#
+#  - Only pure expressions are shared: literals, names, unary and binary
+#    operators and type-casts whose operands are shared too.  Calls,
+#    memory addresses and ^ (grow memory) are always new nodes, and so
+#    is anything that contains one of them.
+#
+#  - A name means different things in different places (x can be a
+#    global in one function and a float parameter in the next), and the
+#    checker records what it means on the node.  So names are only
+#    shared within a "region": the parser starts a new one after every
+#    declaration and at the end of every block.  Two shared nodes are
+#    the same object only if their names are resolved the same way.
+#    Being the same object says nothing about values at run time
+#    (x*x before and after x = xtemp; is one node).
+#
+#  - A shared node has the offset of its first occurrence, so errors
+#    about it are reported there.
+#
+#  - structural_hash is computed with hash(), so it is only stable
+#    within one process.
+from compilers.wabbit.model import Node, Literal, NamedLocation, BinaryOperator, UnaryOperator, TypeCast
+
+PURE_EXPRESSIONS = (Literal, NamedLocation, BinaryOperator, UnaryOperator, TypeCast)
+
+IMPURE_OPERATORS = {'^'}
+
+
+def structural_hash(cls, args):
+    return hash((cls.__name__,) + tuple(a.structural_hash if isinstance(a, Node) else a for a in args))
+
+
+class Interner:
+    def __init__(self):
+        self.nodes = {}  # (class, [region,] constructor arguments) -> shared node
+        self.region = 0
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def new_region(self):
+        """ Names after this point may mean something else (a declaration or the end of a block) """
+        self.region += 1
+
+    def make(self, cls, offset, *args):
+        """ cls(*args) at offset, or the shared node that's identical to it """
+        if not self.is_pure(cls, args):
+            node = cls(*args)
+            node.offset = offset
+            return node
+        # Children are shared nodes, so they are compared by identity in the key
+        key = (cls, self.region) + args if cls is NamedLocation else (cls,) + args
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = cls(*args)
+            node.offset = offset
+            node.structural_hash = structural_hash(cls, args)
+        return node
+
+    @staticmethod
+    def is_pure(cls, args):
+        if not issubclass(cls, PURE_EXPRESSIONS):
+            return False
+        if cls is UnaryOperator and args[0] in IMPURE_OPERATORS:
+            return False
+        return all(a.structural_hash is not None for a in args if isinstance(a, Node))
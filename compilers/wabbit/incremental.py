@@ -0,0 +1,187 @@
+# incremental.py
+#
+# Incremental re-tokenizing and re-parsing for programs that are being
+# edited (an editor, a watch mode, ...).
+#
+# A program is kept as a list of segments, one per top-level statement.
+# A segment covers the text from the first token of its statement up to
+# the first token of the next statement (so trailing whitespace and
+# comments belong to the statement before them).  Each segment keeps its
+# own tokens and its model node.
+#
+# After an edit, only the segments touched by the edit are re-tokenized
+# and re-parsed.  Scanning starts at the first damaged segment and stops
+# as soon as a token lands exactly on the start of an undamaged segment.
+# From there on the text is the same as before, so the tokens and the
+# statements must be too.  If the damaged statements don't parse on their
+# own (a '}' was deleted, a comment was opened, ...) the damaged region
+# is grown forward until they do.
+#
+# Segments after an edit are reused as-is, including their tokens and
+# nodes, and so are their offsets: rewriting them would touch every token
+# and node following the edit.  Where they are now goes through the
+# segment, which knows how far it has moved since it was parsed:
+#
+#     current offset = token.offset + program.shift(statement)
+#
+# (IncrementalChecker.update() takes program.shift, so the errors of a
+# statement that moved are reported where it is now.)  The shifts are
+# kept like the text of a gap buffer.  The segments before the gap know
+# their own shift, the ones after it are short of self.tail_shift, and
+# an edit at the gap moves all of those at once by adding to it.  The gap
+# follows the edits, so an edit costs what it re-scans and re-parses plus
+# moving the gap from the previous edit, and not a pass over every
+# segment after it.
+from bisect import bisect_right
+
+from compilers.wabbit import errors
+from compilers.wabbit.errors import ParseError
+from compilers.wabbit.parse import Parser, K
+from compilers.wabbit.tokenizer import tokenize, _scan
+
+
+class Segment:
+    __slots__ = ('start', 'shift', 'tail', 'tokens', 'statement')
+
+    def __init__(self, start, tokens, statement):
+        self.start = start          # Offset of the segment in the text it was parsed from
+        self.shift = 0              # How far it has moved since, see above
+        self.tail = False           # After the gap: its shift is short of IncrementalProgram.tail_shift
+        self.tokens = tokens
+        self.statement = statement  # None if the program has no statements at all
+
+
+class IncrementalProgram:
+    def __init__(self, text):
+        self.text = text
+        tokens = list(tokenize(text))
+        self.segments = make_segments(Parser(tokens).parse_statements(), tokens, 0) or [Segment(0, [], None)]
+        self.owners = {seg.statement: seg for seg in self.segments}  # statement -> its segment
+        self.gap = len(self.segments)  # Index of the first segment after the gap
+        self.tail_shift = 0
+
+    @property
+    def statements(self):
+        return [seg.statement for seg in self.segments if seg.statement is not None]
+
+    @property
+    def tokens(self):
+        """ The tokens, with the offsets they were parsed at (see shift()) """
+        for seg in self.segments:
+            yield from seg.tokens
+
+    def shift(self, statement):
+        """ How far statement has moved since it was parsed: add it to the offsets of its tokens and nodes """
+        seg = self.owners[statement]
+        return seg.shift + self.tail_shift if seg.tail else seg.shift
+
+    def start(self, index):
+        """ Current offset of segment index """
+        seg = self.segments[index]
+        return seg.start + (seg.shift + self.tail_shift if seg.tail else seg.shift)
+
+    def find(self, offset):
+        """ Index of the last segment that starts at or before offset (0 if there is none) """
+        low, high = 0, len(self.segments)
+        while low < high:
+            middle = (low + high) // 2
+            if self.start(middle) <= offset:
+                low = middle + 1
+            else:
+                high = middle
+        return max(low - 1, 0)
+
+    def move_gap(self, index):
+        segments, tail_shift = self.segments, self.tail_shift
+        while self.gap < index:
+            seg = segments[self.gap]
+            seg.shift += tail_shift
+            seg.tail = False
+            self.gap += 1
+        while self.gap > index:
+            self.gap -= 1
+            seg = segments[self.gap]
+            seg.shift -= tail_shift
+            seg.tail = True
+
+    def edit(self, offset, removed, inserted):
+        """
+        Replace removed characters at offset with the inserted text.  Returns
+        the new segments.  On a syntax error, ParseError is raised and the
+        program is left as it was before the edit.
+        """
+        text = self.text[:offset] + inserted + self.text[offset + removed:]
+        delta = len(inserted) - removed
+        segments = self.segments
+
+        # An edit right at the start of a statement may also belong to the statement
+        # before it (e.g. inserting 'else {...}' after an 'if'), hence the - 1.
+        first = self.find(offset - 1)
+        last = max(self.find(offset + removed - 1), first)
+        errors.set_source(text)
+
+        grow = 1
+        while True:
+            stop, tokens = rescan(text, self.start, len(segments), delta, first, last + 1)
+            try:
+                parser = Parser(tokens)
+                statements = parser.parse_statements()
+                if not parser.peek(K.EOF):
+                    raise ParseError(f'Unexpected {parser.next_token}', parser.next_token.offset)
+                break
+            except ParseError:
+                if stop == len(segments):
+                    raise
+                last = stop - 1 + grow
+                grow *= 2
+
+        new_segments = make_segments(statements, tokens, 0 if first == 0 else None)
+        self.move_gap(stop)  # The segments from stop on move by delta
+        for seg in segments[first:stop]:
+            del self.owners[seg.statement]
+        segments[first:stop] = new_segments
+        self.gap = first + len(new_segments)
+        self.tail_shift += delta
+        for seg in new_segments:
+            self.owners[seg.statement] = seg
+        if not segments:
+            segments.append(Segment(0, [], None))
+            self.owners[None] = segments[0]
+            self.gap = 1
+        segments[0].start -= self.start(0)  # In case the old first statement was deleted
+        self.text = text
+        return new_segments
+
+
+def rescan(text, start, count, delta, first, stop):
+    """
+    Tokenize text starting at the (unchanged) start of segment first until a
+    token lines up with the start of a following segment (start(n) is where
+    segment n started before the edit, there are count of them).  Returns
+    the index of that segment (count if scanning ran to the end) and the
+    tokens.
+    """
+    tokens = []
+    for tok in _scan(text, start(first), True):
+        while stop < count and tok.offset > start(stop) + delta:
+            stop += 1   # The edit ran over the start of this segment
+        if stop < count and tok.offset == start(stop) + delta:
+            return stop, tokens
+        tokens.append(tok)
+    return count, tokens
+
+
+def make_segments(statements, tokens, first_start):
+    """
+    Split tokens up by statement.  first_start is the start of the first
+    segment if it is the first segment of the program (so it includes any
+    comments at the very top), otherwise None.
+    """
+    offsets = [tok.offset for tok in tokens]
+    segments = []
+    for n, stmt in enumerate(statements):
+        begin = bisect_right(offsets, stmt.offset - 1)
+        end = bisect_right(offsets, statements[n + 1].offset - 1) if n + 1 < len(statements) else len(tokens)
+        start = first_start if n == 0 and first_start is not None else stmt.offset
+        segments.append(Segment(start, tokens[begin:end], stmt))
+    return segments
@@ -0,0 +1,513 @@
+# inline.py
+#
+# Inlining small functions into their callers, in the model (see
+# model.py).  A call costs a new frame, moving the arguments and a
+# return in the IR interpreter, which adds up for a small function
+# called in a loop.  Inlined, the caller's code runs straight through
+# (and later passes see the function's code where it is used).
+#
+# Which functions: ones that don't call anything (leaves, so nothing
+# recursive) and whose bodies have at most max_size nodes.  Functions
+# are done callees first, so a function whose calls have all been
+# inlined is a leaf from then on and can be inlined in turn.  Imported
+# functions are never inlined.
+#
+# A call is an expression, but the function body is statements.  So the
+# body goes in front of the statement with the call, its variables
+# renamed, and the call is replaced by a variable with the result:
+#
+#     if in_mandelbrot(x, y, threshhold) { ... }
+#
+# becomes
+#
+#     var n__in_mandelbrot_1 int = threshhold;   // Assigned in the body
+#     var result__in_mandelbrot_1 bool = true;
+#     var x__in_mandelbrot_1 float = 0.0;
+#     ...
+#     while n__in_mandelbrot_1 > 0 {
+#         ...  x0 is x and y0 is y, they aren't assigned in the body
+#         if ... { result__in_mandelbrot_1 = false; break; }
+#     }
+#     if result__in_mandelbrot_1 { ... }
+#
+# There is no goto, so what a return turns into depends on where it is:
+#   - the only return is at the end: var result = e;
+#   - every return is the last thing done on its way through the body
+#     (after moving what follows an if that returns into its else):
+#     result = e;
+#   - the body is a loop with returns in it and return <literal>; after
+#     it, as above: result = e; break;
+#   - anything else: the body goes in a while true { ... break; } and
+#     return e; is result = e; done = true; break;.  Every loop with a
+#     return in it is followed by if done { break; }, to break out of
+#     all of them.
+#
+# What the inlined code costs matters as much as the call it replaces:
+#   - arguments that are literals or names (of variables the function
+#     doesn't assign) are used where the parameter was, not copied
+#   - for an assignment  x = f(...);  the result goes straight to x
+#     (when the function ends with its only return, or every return is
+#     at the end of its way through the body)
+#   - when the function ends with its only return and the expression
+#     returned reads nothing that inlined code could change by the time
+#     the statement runs, the expression takes the place of the call and
+#     there is no result variable
+#   - the variables it adds in a loop are declared once, at the top of
+#     the calling function (or in front of the top-level statement), and
+#     are only assigned in the loop.  A declaration without a value is
+#     assigned the zero of its type instead, unless it is a result that
+#     every way through is sure to assign
+#
+# Calls are left alone where moving them in front of the statement would
+# change what happens:
+#   - in while tests (they run again for each iteration)
+#   - in a statement that reads a global the function assigns, or reads
+#     memory when the function writes or grows memory (the read would
+#     happen after the call instead of before it)
+#   - in a caller that declares a name the function uses for a global
+#     (the name would mean the caller's variable)
+#
+# The new names get their declarations as they're made, so that a
+# function can be copied again after calls were inlined into it.  The
+# program is checked again at the end, which gives the new variables
+# their slots and types.  A program that doesn't check after that is a
+# bug in the inliner, and raises ValueError.
+from compilers.wabbit.check import check_program
+from compilers.wabbit.model import Node, OPTIONAL_FIELDS, Assignment, Print, If, While, Break, Return, Variable, \
+    Constant, Function, FunctionParameter, FunctionCall, NamedLocation, MemoryAddress, UnaryOperator, Bool, \
+    Literal, Integer, Float, Char
+from compilers.wabbit.resolve import GLOBAL, LOCAL
+
+MAX_SIZE = 100  # Nodes in the body of a function that is inlined
+
+# What a variable declared without a value starts as, by type
+ZERO_LITERALS = {Integer.type: (Integer, 0), Float.type: (Float, 0.0), Char.type: (Char, '\x00'),
+                 Bool.type: (Bool, 'false')}
+
+
+def children(node):
+    """ The nodes and lists of nodes in a node (not the declarations its names refer to) """
+    for name in node._fields:
+        if name not in OPTIONAL_FIELDS:
+            value = getattr(node, name, None)
+            if isinstance(value, (Node, list)):
+                yield value
+
+
+def walk(node):
+    """ node and everything in it, parents first """
+    work = [node]
+    while work:
+        node = work.pop()
+        if isinstance(node, list):
+            work.extend(reversed(node))
+        else:
+            yield node
+            work.extend(reversed(list(children(node))))
+
+
+class FunctionInfo:
+    __slots__ = ('function', 'size', 'calls', 'globals_read', 'globals_written', 'memory', 'names', 'assigned')
+
+    def __init__(self, function):
+        self.function = function
+        self.update()
+
+    def update(self):
+        self.size = 0
+        self.calls = set()             # Names of the functions it calls
+        self.globals_read = set()      # Names of the globals it uses
+        self.globals_written = set()   # ... and assigns
+        self.memory = False            # Writes or grows memory
+        self.names = {parameter.name for parameter in self.function.parameters}  # Declared in it
+        self.assigned = set()          # Declarations it assigns
+        for node in walk(self.function.statements):
+            self.size += 1
+            if isinstance(node, FunctionCall):
+                self.calls.add(node.function_name)
+            elif isinstance(node, NamedLocation) and node.depth == GLOBAL:
+                self.globals_read.add(node.name)
+            elif isinstance(node, (Variable, Constant)):
+                self.names.add(node.name)
+            elif isinstance(node, Assignment):
+                if isinstance(node.location, NamedLocation):
+                    self.assigned.add(node.location.declaration)
+                    if node.location.depth == GLOBAL:
+                        self.globals_written.add(node.location.name)
+                elif isinstance(node.location, MemoryAddress):
+                    self.memory = True
+            elif isinstance(node, UnaryOperator) and node.operator == '^':
+                self.memory = True
+
+
+class Inliner:
+    def __init__(self, max_size=MAX_SIZE):
+        self.max_size = max_size
+        self.inlined = {}  # Function name -> calls inlined
+
+    def run(self, statements):
+        """ Inline calls in a checked program (changes it, and checks it again) """
+        self.functions = {statement.name: FunctionInfo(statement) for statement in statements
+                          if isinstance(statement, Function) and not statement.imported}
+        self.taken = {node.name for node in walk(statements) if isinstance(node, (NamedLocation, Variable, Constant,
+                                                                                  Function, FunctionParameter))}
+        self.count = 0
+        self.new_variables = set()   # Variables the inlined code declares
+        self.assigned_first = set()  # ... of those, results every way through assigns before they're read
+        for name in self.callees_first():
+            info = self.functions[name]
+            self.caller, self.caller_names = info, info.names
+            hoisted = []
+            body = self.hoist(self.rewrite_block(info.function.statements), hoisted, False)
+            info.function.statements = hoisted + body
+            info.update()
+        # Top-level code.  Its variables are the globals, except the ones declared in its blocks
+        self.caller = None
+        self.caller_names = {node.name for statement in statements if isinstance(statement, (If, While))
+                             for node in walk(statement) if isinstance(node, (Variable, Constant))}
+        rewritten = []
+        for statement in self.rewrite_block(statements):
+            hoisted = []
+            statement = self.hoist([statement], hoisted, False)
+            rewritten.extend(hoisted)
+            rewritten.extend(statement)
+        statements[:] = rewritten
+        if self.inlined and not check_program(statements):
+            raise ValueError('The program does not check after inlining')
+        return statements
+
+    def callees_first(self):
+        order = []
+        seen = set()
+        for name in self.functions:
+            if name in seen:
+                continue
+            stack = [(name, iter(sorted(self.functions[name].calls)))]
+            seen.add(name)
+            while stack:
+                current, calls = stack[-1]
+                for callee in calls:
+                    if callee in self.functions and callee not in seen:
+                        seen.add(callee)
+                        stack.append((callee, iter(sorted(self.functions[callee].calls))))
+                        break
+                else:
+                    stack.pop()
+                    order.append(current)
+        return order
+
+    def inlinable(self, name):
+        info = self.functions.get(name)
+        if info is None or info is self.caller or info.calls or info.size > self.max_size:
+            return False
+        # A caller's own names would hide the globals the function uses
+        return not (info.globals_read & self.caller_names)
+
+    # Statements
+
+    def rewrite_block(self, statements):
+        result = []
+        for statement in statements:
+            if isinstance(statement, Function):
+                result.append(statement)
+                continue
+            if isinstance(statement, If):
+                statement.consequence = self.rewrite_block(statement.consequence)
+                if statement.alternative is not None:
+                    statement.alternative = self.rewrite_block(statement.alternative)
+            elif isinstance(statement, While):
+                statement.consequence = self.rewrite_block(statement.consequence)
+            fields = self.expression_fields(statement)
+            if self.can_hoist(statement, fields):
+                if isinstance(statement, Assignment) and isinstance(statement.location, NamedLocation) \
+                        and isinstance(statement.expression, FunctionCall):
+                    call = statement.expression
+                    call.args = self.replace_calls(call.args, result)
+                    statement.expression = self.inline(call, result, statement.location)
+                    if statement.expression is None:
+                        continue  # The inlined code stores the result
+                else:
+                    for name in fields:
+                        setattr(statement, name, self.replace_calls(getattr(statement, name), result))
+            result.append(statement)
+        return result
+
+    def hoist(self, statements, hoisted, in_loop):
+        """ statements with the new variables declared in loops assigned instead, their declarations go to hoisted """
+        result = []
+        for statement in statements:
+            if isinstance(statement, If):
+                statement.consequence = self.hoist(statement.consequence, hoisted, in_loop)
+                if statement.alternative is not None:
+                    statement.alternative = self.hoist(statement.alternative, hoisted, in_loop)
+            elif isinstance(statement, While):
+                statement.consequence = self.hoist(statement.consequence, hoisted, True)
+            elif in_loop and statement in self.new_variables:
+                value = statement.value
+                if value is None and statement not in self.assigned_first:
+                    literal, zero = ZERO_LITERALS[statement.type]
+                    value = self.at(literal(zero), statement)
+                statement.value = None
+                statement.type_specified_when_declared = True
+                statement.value_specified_when_declared = False
+                hoisted.append(statement)
+                if value is not None:
+                    result.append(self.at(Assignment(self.location(statement, statement), value), statement))
+                continue
+            result.append(statement)
+        return result
+
+    @staticmethod
+    def expression_fields(statement):
+        """ The expressions a statement evaluates before it does anything else """
+        if isinstance(statement, Assignment):
+            return ('location', 'expression') if isinstance(statement.location, MemoryAddress) else ('expression',)
+        if isinstance(statement, Print):
+            return ('expression',)
+        if isinstance(statement, If):
+            return ('test',)
+        if isinstance(statement, (Variable, Constant, Return)):
+            return ('value',)
+        return ()  # While tests run again for each iteration
+
+    def can_hoist(self, statement, fields):
+        calls = []
+        reads = set()
+        memory = False
+        for name in fields:
+            for node in walk(getattr(statement, name) or []):
+                if isinstance(node, FunctionCall):
+                    calls.append(node.function_name)
+                elif isinstance(node, NamedLocation):
+                    reads.add(node.name)
+                elif isinstance(node, MemoryAddress) or isinstance(node, UnaryOperator) and node.operator == '^':
+                    memory = True
+        if not calls or not all(self.inlinable(name) for name in calls):
+            return False
+        for name in calls:
+            info = self.functions[name]
+            if info.globals_written & reads or info.memory and memory:
+                return False
+        return True
+
+    def replace_calls(self, node, before):
+        """ node with the calls in it replaced by their results, the inlined code appended to before """
+        if isinstance(node, list):
+            return [self.replace_calls(item, before) for item in node]
+        if not isinstance(node, Node):
+            return node
+        for name in node._fields:
+            if name not in OPTIONAL_FIELDS:
+                value = getattr(node, name, None)
+                if isinstance(value, (Node, list)):
+                    setattr(node, name, self.replace_calls(value, before))
+        if isinstance(node, FunctionCall):
+            return self.inline(node, before)
+        return node
+
+    # Inlining a call
+
+    def fresh(self, name, function):
+        new = f'{name}__{function}_{self.count}'
+        while new in self.taken:
+            new += '_'
+        self.taken.add(new)
+        return new
+
+    def new_variable(self, name, value, type, where):
+        variable = self.at(Variable(name, value, type), where)
+        self.new_variables.add(variable)
+        return variable
+
+    def stable(self, expression):
+        """ Does expression read only what no inlined code can change before the statement runs? """
+        written = set().union(*(info.globals_written for info in self.functions.values()))
+        for node in walk(expression):
+            if isinstance(node, (FunctionCall, MemoryAddress)) or isinstance(node, UnaryOperator) and node.operator == '^':
+                return False
+            if isinstance(node, NamedLocation) and node.depth == GLOBAL and node.name in written:
+                return False
+        return True
+
+    def inline(self, call, before, target=None):
+        """
+        Append the code of a call to before and return the expression to use
+        instead of the call.  If target (a NamedLocation) is given, the call
+        is all of  target = call;  and None means the result was stored in it.
+        """
+        info = self.functions[call.function_name]
+        function = info.function
+        self.inlining = function.name
+        self.count += 1
+        self.inlined[function.name] = self.inlined.get(function.name, 0) + 1
+        renames = {}  # Declaration in the function -> its new declaration, or the argument to use instead
+        for parameter, argument in zip(function.parameters, call.args):
+            if parameter not in info.assigned and (isinstance(argument, Literal) or isinstance(argument, NamedLocation)
+                                                   and argument.name not in info.globals_written):
+                renames[parameter] = argument
+            else:
+                renames[parameter] = self.new_variable(self.fresh(parameter.name, function.name), argument,
+                                                       parameter.type, call)
+                before.append(renames[parameter])
+        name = self.fresh('result', function.name)
+        body = self.returns_last(self.copy(function.statements, renames))
+        returns = [node for node in walk(body) if isinstance(node, Return)]
+        last = body[-1] if body else None
+        if len(returns) == 1 and last is returns[0]:
+            if target is not None:
+                # return e; at the end of target = f(...): target = e;
+                body[-1] = self.at(Assignment(self.copy(target, {}), last.value), last)
+                before.extend(body)
+                return None
+            if self.stable(last.value):
+                # ... of anything else: e instead of the call
+                before.extend(body[:-1])
+                return last.value
+            # ... else var result = e;
+            body[-1] = result = self.new_variable(name, last.value, function.return_type, last)
+            before.extend(body)
+        elif self.returns(body) and len(self.tail_returns(body)) == len(returns):
+            # Every return is the last thing done on its way through the body: result = e; (or target = e;)
+            if target is not None:
+                before.extend(self.rewrite_tails(body, lambda where: self.copy(target, {})))
+                return None
+            result = self.new_variable(name, None, function.return_type, call)
+            self.assigned_first.add(result)
+            before.append(result)
+            before.extend(self.rewrite_tails(body, lambda where: self.location(result, where)))
+        elif self.is_search(body, returns):
+            # A loop with returns in it and return <literal>; after it: the literal is the result
+            # unless a return in the loop breaks out of it
+            result = self.new_variable(name, last.value, function.return_type, call)
+            before.append(result)
+            loop = body[-2]
+            loop.consequence = self.rewrite_returns(loop.consequence, result, None, call)
+            before.extend(body[:-1])
+        else:
+            result = self.new_variable(name, None, function.return_type, call)
+            before.append(result)
+            done = None
+            if any(isinstance(node, While) and any(isinstance(n, Return) for n in walk(node.consequence))
+                   for node in walk(body)):
+                done = self.new_variable(self.fresh('done', function.name), self.at(Bool('false'), call), 'bool', call)
+                before.append(done)
+            body = self.rewrite_returns(body, result, done, call) + [self.at(Break(), call)]
+            before.append(self.at(While(self.at(Bool('true'), call), body), call))
+        return self.location(result, call)
+
+    def location(self, declaration, where):
+        """ A use of a new variable.  The caller may be inlined later, which needs its declaration """
+        location = self.at(NamedLocation(declaration.name), where)
+        location.declaration = declaration
+        location.depth = GLOBAL if self.caller is None else LOCAL
+        return location
+
+    def returns_last(self, statements):
+        """ statements with the ones after an if that always returns in one branch moved into the other """
+        for index, statement in enumerate(statements):
+            if not isinstance(statement, If):
+                continue
+            statement.consequence = self.returns_last(statement.consequence)
+            statement.alternative = self.returns_last(statement.alternative or [])
+            rest = statements[index + 1:]
+            if rest and self.returns(statement.consequence):
+                statement.alternative = self.returns_last(statement.alternative + rest)
+            elif rest and self.returns(statement.alternative):
+                statement.consequence = self.returns_last(statement.consequence + rest)
+            else:
+                continue
+            return statements[:index + 1]
+        return statements
+
+    def returns(self, statements):
+        """ Does every way through statements end with a return? """
+        last = statements[-1] if statements else None
+        return isinstance(last, Return) or \
+            isinstance(last, If) and self.returns(last.consequence) and self.returns(last.alternative)
+
+    def tail_returns(self, statements):
+        last = statements[-1] if statements else None
+        if isinstance(last, Return):
+            return [last]
+        if isinstance(last, If):
+            return self.tail_returns(last.consequence) + self.tail_returns(last.alternative)
+        return []
+
+    def rewrite_tails(self, statements, store):
+        """ statements with each return e; made into store(return) = e; """
+        last = statements[-1]
+        if isinstance(last, Return):
+            return statements[:-1] + [self.at(Assignment(store(last), last.value), last)]
+        last.consequence = self.rewrite_tails(last.consequence, store)
+        last.alternative = self.rewrite_tails(last.alternative, store)
+        return statements
+
+    @staticmethod
+    def is_search(body, returns):
+        """ Is body ...; while test { ... return e; ... } return <literal>; with no other returns? """
+        if len(body) < 2 or not isinstance(body[-1], Return) or not isinstance(body[-1].value, Literal) \
+                or not isinstance(body[-2], While):
+            return False
+        in_loop = [node for node in walk(body[-2].consequence) if isinstance(node, Return)]
+        nested = [node for node in walk(body[-2].consequence) if isinstance(node, While)
+                  for inner in walk(node.consequence) if isinstance(inner, Return)]
+        return len(in_loop) + 1 == len(returns) and not nested
+
+    def rewrite_returns(self, statements, result, done, call):
+        rewritten = []
+        for statement in statements:
+            if isinstance(statement, Return):
+                rewritten.append(self.at(Assignment(self.location(result, statement), statement.value), statement))
+                if done is not None:
+                    rewritten.append(self.at(Assignment(self.location(done, statement),
+                                                        self.at(Bool('true'), statement)), statement))
+                rewritten.append(self.at(Break(), statement))
+                continue
+            if isinstance(statement, If):
+                statement.consequence = self.rewrite_returns(statement.consequence, result, done, call)
+                if statement.alternative is not None:
+                    statement.alternative = self.rewrite_returns(statement.alternative, result, done, call)
+            rewritten.append(statement)
+            if isinstance(statement, While) and any(isinstance(node, Return) for node in walk(statement.consequence)):
+                statement.consequence = self.rewrite_returns(statement.consequence, result, done, call)
+                rewritten.append(self.at(If(self.location(done, call), [self.at(Break(), call)], []), call))
+        return rewritten
+
+    def copy(self, node, renames):
+        """ A copy of the function's code, with its variables renamed """
+        if isinstance(node, list):
+            return [self.copy(item, renames) for item in node]
+        if not isinstance(node, Node):
+            return node
+        new = object.__new__(type(node))
+        for name in node._fields:
+            if name == 'structural_hash' or not hasattr(node, name):
+                continue
+            value = getattr(node, name)
+            if name != 'declaration' and isinstance(value, (Node, list)):
+                value = self.copy(value, renames)
+            setattr(new, name, value)
+        if isinstance(node, (Variable, Constant)):
+            new.name = self.fresh(node.name, self.inlining)
+            renames[node] = new
+            if isinstance(node, Variable):
+                self.new_variables.add(new)
+        elif isinstance(node, NamedLocation) and node.declaration in renames:
+            rename = renames[node.declaration]
+            if not isinstance(rename, (Variable, Constant)):
+                return self.copy(rename, {})  # An argument used as it is
+            new.name = rename.name
+            new.declaration = rename
+        return new
+
+    @staticmethod
+    def at(node, where):
+        node.offset = where.offset
+        return node
+
+
+def inline_functions(statements, max_size=MAX_SIZE):
+    """ Inline the small leaf functions of a checked program (see the top).  Returns the Inliner """
+    inliner = Inliner(max_size)
+    inliner.run(statements)
+    return inliner
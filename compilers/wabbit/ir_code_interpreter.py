@@ -1,36 +1,74 @@
-code = [
-    ('GLOBALI', 'x'),
-    ('CONSTI', 4),
-    ('STORE', 'x'),
-    ('GLOBALI', 'y'),
-    ('CONSTI', 5),
-    ('STORE', 'y'),
-    ('GLOBALI', 'd'),
-    ('LOAD', 'x'),
-    ('LOAD', 'x'),
-    ('MULI',),
-    ('LOAD', 'y'),
-    ('LOAD', 'y'),
-    ('MULI',),
-    ('ADDI',),
-    ('STORE', 'd'),
-    ('LOAD', 'd'),
-    ('PRINTI',)
-]
+# ir_code_interpreter.py
+#
+# Runs IR code (see ircode.py) on a little stack machine.  The code is
+# run as Bytecode (see bytecode.py): instead of unpacking a tuple and
+# calling getattr(self, f'run_{opcode}') for every instruction, run()
+# walks the words of the code and calls the handler at the opcode's
+# index in a table.  Handlers get the operand words as they are (pool
+# indexes, depth, slot) and the program counter of the next instruction
+# is in self.pc, so the control flow handlers can move it.
+#
+# Variables live in frames indexed by the slot from resolve.py:
+# self.frames[depth][slot].  Ints are Python ints (there is no 32-bit
+# wrap-around like in Wasm), and DIVI truncates towards zero like Wasm.
+#
+# The structured control flow (IF/ELSE/ENDIF, LOOP/CBREAK/ENDLOOP) has
+# no jump targets.  They are worked out before the code runs (see
+# cfg.py), so a branch sets self.pc to its target.  The markers have no
+# operands, so a branch is at self.pc - 1 when its handler runs.
+#
+# Functions (IRFunctions from ircode.py, by name) are run by CALL with a
+# new LOCAL frame that starts with the arguments, and RET ends the run
+# of the function's code with the result on the stack.  Each function is
+# encoded (and its targets worked out) the first time it is called.
+from compilers.wabbit.bytecode import as_bytecode, handler_table, OPCODE_BITS, OPCODE_MASK
+from compilers.wabbit.cfg import ControlFlow
+from compilers.wabbit.resolve import GLOBAL, LOCAL
+
 
 # compare with ceval.c in cython - not too dissimilar!
 class Interpreter:
-    def __init__(self):
-        self.stack = []   # IR is for a 'stack machine'
-        self.memory = {}  # Variables
-        self.pc = 0       # Program counter, current instruction being executed
+    def __init__(self, out=print, functions=None):
+        self.stack = []           # IR is for a 'stack machine'
+        self.frames = [[], []]    # Variables by depth (GLOBAL, LOCAL) and slot
+        self.pc = 0               # Program counter, next instruction to execute
+        self.code = self.constants = self.names = self.targets = None  # Of the code being run, see execute()
+        self.out = out
+        self.functions = {} if functions is None else functions  # name -> IRFunction
+        self.compiled = {}        # name -> (Bytecode, targets) of the functions called so far
+        self.handlers = handler_table(self, 'run_')
+
+    def run(self, code):
+        """ Run IR code (Bytecode or a list of instructions) """
+        bytecode = as_bytecode(code)
+        self.execute(bytecode, ControlFlow(bytecode).targets)
 
-    def run(self, instructions):
+    def call(self, name, *args):
+        """ Call a function, returns its result """
+        self.stack.extend(args)
+        self.run_function(name, len(args))
+        return self.pop()
+
+    def execute(self, bytecode, targets):
+        self.code = bytecode.code
+        self.constants = bytecode.constants
+        self.names = bytecode.names
+        self.targets = targets
+        words = self.code
+        handlers = self.handlers
         self.pc = 0
-        while self.pc < len(instructions):
-            opcode, *args = instructions[self.pc]  # Get the instruction
-            self.pc += 1
-            getattr(self, f'run_{opcode}')(*args)  # Run the instruction
+        end = len(words)
+        while self.pc < end:
+            pc = self.pc
+            header = words[pc]
+            count = header >> OPCODE_BITS
+            self.pc = pc + 1 + count
+            if count == 0:
+                handlers[header & OPCODE_MASK]()
+            elif count == 1:
+                handlers[header & OPCODE_MASK](words[pc + 1])
+            else:
+                handlers[header & OPCODE_MASK](*words[pc + 1:pc + 1 + count])
 
     def push(self, item):
         self.stack.append(item)
@@ -38,37 +76,182 @@ class Interpreter:
     def pop(self):
         return self.stack.pop()
 
-    def run_GLOBALI(self, name):
+    # Constants and variables
+
+    def run_CONSTI(self, index):
+        """ Put a constant value on the stack"""
+        self.push(self.constants[index])
+
+    run_CONSTF = run_CONSTI
+
+    def declare(self, depth, slot, value):
+        frame = self.frames[depth]
+        if slot >= len(frame):
+            frame.extend([None] * (slot + 1 - len(frame)))
+        frame[slot] = value
+
+    def run_GLOBALI(self, name, slot):
         """ Declares a new variable """
-        self.memory[name] = None
+        self.declare(GLOBAL, slot, 0)
+
+    def run_GLOBALF(self, name, slot):
+        self.declare(GLOBAL, slot, 0.0)
+
+    def run_LOCALI(self, name, slot):
+        self.declare(LOCAL, slot, 0)
+
+    def run_LOCALF(self, name, slot):
+        self.declare(LOCAL, slot, 0.0)
+
+    def run_LOAD(self, name, depth, slot):
+        """ Memory -> Stack """
+        self.push(self.frames[depth][slot])
+
+    def run_STORE(self, name, depth, slot):
+        """ Stack -> Memory """
+        self.frames[depth][slot] = self.pop()
+
+    # Arithmetic.  Comparisons push 1 or 0
 
     def run_ADDI(self):
+        right = self.pop()
+        self.stack[-1] += right
+
+    def run_SUBI(self):
+        right = self.pop()
+        self.stack[-1] -= right
+
+    def run_MULI(self):
+        right = self.pop()
+        self.stack[-1] *= right
+
+    def run_DIVI(self):
         right = self.pop()
         left = self.pop()
-        self.push(right + left)
+        quotient = abs(left) // abs(right)
+        self.push(-quotient if (left < 0) != (right < 0) else quotient)
 
-    def run_STORE(self, name):
-        """ Stack -> Memory """
-        value = self.pop()
-        self.memory[name] = value
+    def run_DIVF(self):
+        right = self.pop()
+        self.stack[-1] /= right
+
+    run_ADDF, run_SUBF, run_MULF = run_ADDI, run_SUBI, run_MULI
+
+    def run_LTI(self):
+        right = self.pop()
+        self.stack[-1] = int(self.stack[-1] < right)
+
+    def run_LEI(self):
+        right = self.pop()
+        self.stack[-1] = int(self.stack[-1] <= right)
+
+    def run_GTI(self):
+        right = self.pop()
+        self.stack[-1] = int(self.stack[-1] > right)
+
+    def run_GEI(self):
+        right = self.pop()
+        self.stack[-1] = int(self.stack[-1] >= right)
+
+    def run_EQI(self):
+        right = self.pop()
+        self.stack[-1] = int(self.stack[-1] == right)
+
+    def run_NEI(self):
+        right = self.pop()
+        self.stack[-1] = int(self.stack[-1] != right)
+
+    run_LTF, run_LEF, run_GTF, run_GEF, run_EQF, run_NEF = run_LTI, run_LEI, run_GTI, run_GEI, run_EQI, run_NEI
+
+    def run_ANDI(self):
+        right = self.pop()
+        self.stack[-1] &= right
+
+    def run_ORI(self):
+        right = self.pop()
+        self.stack[-1] |= right
+
+    def run_ITOF(self):
+        self.stack[-1] = float(self.stack[-1])
+
+    def run_FTOI(self):
+        self.stack[-1] = int(self.stack[-1])
+
+    # Output (like the runtime in test_ir_out.html)
 
     def run_PRINTI(self):
         """ Print what is on the top of the stack """
-        print(self.stack.pop())
+        self.out(self.pop())
 
-    def run_MULI(self):
-        right = self.pop()
-        left = self.pop()
-        self.push(left * right)
+    run_PRINTF = run_PRINTI
 
-    def run_LOAD(self, name):
-        """ Memory -> Stack """
-        self.push(self.memory[name])
+    def run_PRINTB(self):
+        self.out(chr(self.pop()), end='')
+
+    # Structured control flow
+
+    def run_IF(self):
+        if not self.pop():
+            self.pc = self.targets[self.pc - 1]
+
+    def run_ELSE(self):
+        self.pc = self.targets[self.pc - 1]  # The end of the consequence
+
+    def run_ENDIF(self):
+        pass
+
+    def run_LOOP(self):
+        pass
+
+    def run_CBREAK(self):
+        if self.pop():
+            self.pc = self.targets[self.pc - 1]
+
+    run_CONTINUE = run_ENDLOOP = run_ELSE
+
+    # Functions
+
+    def run_CALL(self, name):
+        name = self.names[name]
+        self.run_function(name, len(self.functions[name].parameters))
+
+    def run_function(self, name, count):
+        compiled = self.compiled.get(name)
+        if compiled is None:
+            if not self.functions[name].code:
+                raise ValueError(f'Function {name} has no code (imported?)')
+            bytecode = as_bytecode(self.functions[name].code)
+            compiled = self.compiled[name] = (bytecode, ControlFlow(bytecode).targets)
+        caller = (self.code, self.constants, self.names, self.targets, self.pc, self.frames[LOCAL])
+        self.frames[LOCAL] = self.stack[len(self.stack) - count:]
+        del self.stack[len(self.stack) - count:]
+        self.execute(*compiled)
+        self.code, self.constants, self.names, self.targets, self.pc, self.frames[LOCAL] = caller
+
+    def run_RET(self):
+        self.pc = len(self.code)  # The result stays on the stack
 
-    def run_CONSTI(self, const):
-        """ Put a constant value on the stack"""
-        self.push(const)
 
+if __name__ == '__main__':
+    code = [
+        ('GLOBALI', 'x', 0),
+        ('CONSTI', 4),
+        ('STORE', 'x', GLOBAL, 0),
+        ('GLOBALI', 'y', 1),
+        ('CONSTI', 5),
+        ('STORE', 'y', GLOBAL, 1),
+        ('GLOBALI', 'd', 2),
+        ('LOAD', 'x', GLOBAL, 0),
+        ('LOAD', 'x', GLOBAL, 0),
+        ('MULI',),
+        ('LOAD', 'y', GLOBAL, 1),
+        ('LOAD', 'y', GLOBAL, 1),
+        ('MULI',),
+        ('ADDI',),
+        ('STORE', 'd', GLOBAL, 2),
+        ('LOAD', 'd', GLOBAL, 2),
+        ('PRINTI',)
+    ]
 
-interp = Interpreter()
-interp.run(code)
\ No newline at end of file
+    interp = Interpreter()
+    interp.run(code)
@@ -1,31 +1,56 @@
+# ir_code_transpiler.py
+#
+# Turns IR code (see ircode.py) back into Python source.  Expressions
+# are kept on the stack as source text and become a statement when a
+# STORE or a PRINT takes them off.  The structured control flow maps
+# onto if/else and `while True:` with break.  Functions and memory
+# (CALL, RET, PEEK/POKE, GROW) aren't supported.
+from compilers.wabbit.bytecode import as_bytecode, dispatch, handler_table
+from compilers.wabbit.resolve import GLOBAL, LOCAL
+
 code = [
-    ('GLOBALI', 'x'),
+    ('GLOBALI', 'x', 0),
     ('CONSTI', 4),
-    ('STORE', 'x'),
-    ('GLOBALI', 'y'),
+    ('STORE', 'x', GLOBAL, 0),
+    ('GLOBALI', 'y', 1),
     ('CONSTI', 5),
-    ('STORE', 'y'),
-    ('GLOBALI', 'd'),
-    ('LOAD', 'x'),
-    ('LOAD', 'x'),
+    ('STORE', 'y', GLOBAL, 1),
+    ('GLOBALI', 'd', 2),
+    ('LOAD', 'x', GLOBAL, 0),
+    ('LOAD', 'x', GLOBAL, 0),
     ('MULI',),
-    ('LOAD', 'y'),
-    ('LOAD', 'y'),
+    ('LOAD', 'y', GLOBAL, 1),
+    ('LOAD', 'y', GLOBAL, 1),
     ('MULI',),
     ('ADDI',),
-    ('STORE', 'd'),
-    ('LOAD', 'd'),
+    ('STORE', 'd', GLOBAL, 2),
+    ('LOAD', 'd', GLOBAL, 2),
     ('PRINTI',)
 ]
 
 class Transpiler:
+    # DIVI truncates towards zero (like Wasm), Python's // rounds down
+    DIVI_SOURCE = ('def _divi(left, right):\n'
+                   '    quotient = abs(left) // abs(right)\n'
+                   '    return -quotient if (left < 0) != (right < 0) else quotient\n')
+
     def __init__(self):
         self.stack = []   # IR is for a 'stack machine'
         self.source = ""
+        self.indent = 0
+        self.blocks = []  # len(self.source) where each open block started
+        self.uses_divi = False
 
     def translate(self, instructions):
-        for opcode, *args in instructions:
-            getattr(self, f'translate_{opcode}')(*args)
+        # Bytecode or a list of instructions.  The handlers get the operand words
+        # of the Bytecode, names and constants are indexes (see bytecode.py)
+        bytecode = as_bytecode(instructions)
+        self.names = bytecode.names
+        self.constants = bytecode.constants
+        dispatch(bytecode, handler_table(self, 'translate_'))
+        if self.uses_divi:
+            self.source = self.DIVI_SOURCE + self.source
+            self.uses_divi = False
 
     def push(self, item):
         self.stack.append(item)
@@ -33,37 +58,145 @@ class Transpiler:
     def pop(self):
         return self.stack.pop()
 
-    def translate_GLOBALI(self, name):
-        # self.source += f'{name} = None\n'
-        pass
+    def emit(self, line):
+        self.source += '    ' * self.indent + line + '\n'
 
-    def translate_ADDI(self):
+    def open_block(self, line):
+        self.emit(line)
+        self.indent += 1
+        self.blocks.append(len(self.source))
+
+    def close_block(self):
+        if self.blocks.pop() == len(self.source):
+            self.emit('pass')
+        self.indent -= 1
+
+    def variable(self, name, depth, slot):
+        # Names can be declared again in an inner block, the slot tells them apart
+        return f'{self.names[name]}_{slot}' if depth == GLOBAL else f'{self.names[name]}_local{slot}'
+
+    # Constants and variables
+
+    def translate_CONSTI(self, constant):
+        self.push(repr(self.constants[constant]))
+
+    translate_CONSTF = translate_CONSTI
+
+    def translate_GLOBALI(self, name, slot):
+        self.emit(f'{self.variable(name, GLOBAL, slot)} = 0')
+
+    def translate_GLOBALF(self, name, slot):
+        self.emit(f'{self.variable(name, GLOBAL, slot)} = 0.0')
+
+    def translate_LOCALI(self, name, slot):
+        self.emit(f'{self.variable(name, LOCAL, slot)} = 0')
+
+    def translate_LOCALF(self, name, slot):
+        self.emit(f'{self.variable(name, LOCAL, slot)} = 0.0')
+
+    def translate_LOAD(self, name, depth, slot):
+        self.push(self.variable(name, depth, slot))
+
+    def translate_STORE(self, name, depth, slot):
+        self.emit(f'{self.variable(name, depth, slot)} = {self.pop()}')
+
+    # Arithmetic.  Comparisons give 1 or 0, like in the interpreter
+
+    def binary(self, template):
         right = self.pop()
         left = self.pop()
-        self.push(f'({right} + {left})')
+        self.push(template.format(left=left, right=right))
 
-    def translate_STORE(self, name):
-        self.source += f'{name} = {self.pop()}\n'
+    def translate_ADDI(self):
+        self.binary('({left} + {right})')
 
-    def translate_PRINTI(self):
-        self.source += f'print({self.   pop()})\n'
+    def translate_SUBI(self):
+        self.binary('({left} - {right})')
 
     def translate_MULI(self):
-        right = self.pop()
-        left = self.pop()
-        self.push(f'({left} * {right})')
+        self.binary('({left} * {right})')
+
+    def translate_DIVI(self):
+        self.uses_divi = True
+        self.binary('_divi({left}, {right})')
+
+    def translate_DIVF(self):
+        self.binary('({left} / {right})')
+
+    translate_ADDF, translate_SUBF, translate_MULF = translate_ADDI, translate_SUBI, translate_MULI
+
+    def translate_ANDI(self):
+        self.binary('({left} & {right})')
+
+    def translate_ORI(self):
+        self.binary('({left} | {right})')
+
+    def translate_LTI(self):
+        self.binary('int({left} < {right})')
+
+    def translate_LEI(self):
+        self.binary('int({left} <= {right})')
+
+    def translate_GTI(self):
+        self.binary('int({left} > {right})')
+
+    def translate_GEI(self):
+        self.binary('int({left} >= {right})')
+
+    def translate_EQI(self):
+        self.binary('int({left} == {right})')
+
+    def translate_NEI(self):
+        self.binary('int({left} != {right})')
+
+    translate_LTF, translate_LEF, translate_GTF = translate_LTI, translate_LEI, translate_GTI
+    translate_GEF, translate_EQF, translate_NEF = translate_GEI, translate_EQI, translate_NEI
+
+    def translate_ITOF(self):
+        self.push(f'float({self.pop()})')
+
+    def translate_FTOI(self):
+        self.push(f'int({self.pop()})')
+
+    # Output
+
+    def translate_PRINTI(self):
+        self.emit(f'print({self.pop()})')
+
+    translate_PRINTF = translate_PRINTI
+
+    def translate_PRINTB(self):
+        self.emit(f"print(chr({self.pop()}), end='')")
+
+    # Structured control flow
+
+    def translate_IF(self):
+        self.open_block(f'if {self.pop()}:')
+
+    def translate_ELSE(self):
+        self.close_block()
+        self.open_block('else:')
+
+    def translate_ENDIF(self):
+        self.close_block()
+
+    def translate_LOOP(self):
+        self.open_block('while True:')
+
+    def translate_CBREAK(self):
+        self.emit(f'if {self.pop()}: break')
 
-    def translate_LOAD(self, name):
-        self.push(name)
+    def translate_CONTINUE(self):
+        self.emit('continue')
 
-    def translate_CONSTI(self, value):
-        self.push(str(value))
+    translate_ENDLOOP = translate_ENDIF
 
 
-transpiler = Transpiler()
-transpiler.translate(code)
-print(transpiler.source)
+if __name__ == '__main__':
+    transpiler = Transpiler()
+    transpiler.translate(code)
+    print(transpiler.source)
 
 # Expressions represent values
 # The stack
-# Statements (assignment) manipulate
\ No newline at end of file
+# Statements (assignment) manipulate
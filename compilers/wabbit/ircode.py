@@ -47,8 +47,8 @@ With that in mind, here is a basic instruction set for our IR Code:
 
     ; Integer operations
     CONSTI  value            ; Push a integer literal on the stack
-    GLOBALI name             ; Declare an integer global variable 
-    LOCALI name              ; Declare an integer local variable
+    GLOBALI name slot        ; Declare an integer global variable 
+    LOCALI name slot         ; Declare an integer local variable
     ADDI                     ; Add top two items on stack
     SUBI                     ; Substract top two items on stack
     MULI                     ; Multiply top two items on stack
@@ -68,8 +68,8 @@ With that in mind, here is a basic instruction set for our IR Code:
 
     ; Floating point operations
     CONSTF value             ; Push a float literal
-    GLOBALF name             ; Declare a float global variable 
-    LOCALF name              ; Declare a float local variable
+    GLOBALF name slot        ; Declare a float global variable 
+    LOCALF name slot         ; Declare a float local variable
     ADDF                     ; Add top two items on stack
     SUBF                     ; Substract top two items on stack
     MULF                     ; Multiply top two items on stack
@@ -91,8 +91,12 @@ With that in mind, here is a basic instruction set for our IR Code:
     POKEB                    ; Put byte in memory (value, address on stack)
 
     ; Variable load/store
-    LOAD name                ; Load variable on stack (must be declared already)
-    STORE name               ; Save variable from stack (must be declared already)
+    LOAD name depth slot     ; Load variable on stack (must be declared already)
+    STORE name depth slot    ; Save variable from stack (must be declared already)
+
+    Variables are numbered by resolve.py: depth is 0 for globals and 1
+    for locals, slot is the index of the variable among the globals or
+    the locals of its function.  The name is only there for people.
 
     ; Function call and return
     CALL name                ; Call function. All arguments must be on stack
@@ -207,8 +211,62 @@ and produce this:
 
 
 '''
-from compilers.wabbit.model import Print, Integer, BinaryOperator, Float, UnaryOperator, Constant, Variable, Assignment, \
-    NamedLocation, If, While, Char, Bool
+from compilers.wabbit.flat import kind_handlers
+from compilers.wabbit.resolve import GLOBAL, LOCAL
+from compilers.wabbit.typesys import INT, FLOAT, BOOL, CHAR, TYPES, binary_table, unary_table, type_id
+from compilers.wabbit.visitor import Visitor
+
+# Instructions by type, as dense tables indexed by type id (see typesys.py)
+
+BINARY_OPCODES = binary_table({
+    (INT,   '+',  INT):   'ADDI',
+    (INT,   '-',  INT):   'SUBI',
+    (INT,   '*',  INT):   'MULI',
+    (INT,   '/',  INT):   'DIVI',
+    (INT,   '<',  INT):   'LTI',
+    (INT,   '>',  INT):   'GTI',
+    (INT,   '<=', INT):   'LEI',
+    (INT,   '>=', INT):   'GEI',
+
+    (FLOAT, '+',  FLOAT): 'ADDF',
+    (FLOAT, '-',  FLOAT): 'SUBF',
+    (FLOAT, '*',  FLOAT): 'MULF',
+    (FLOAT, '/',  FLOAT): 'DIVF',
+    (FLOAT, '<',  FLOAT): 'LTF',
+    (FLOAT, '>',  FLOAT): 'GTF',
+    (FLOAT, '<=', FLOAT): 'LEF',
+    (FLOAT, '>=', FLOAT): 'GEF',
+})
+BINARY_INSTRUCTIONS = {op: [[opcode and (opcode,) for opcode in row] for row in rows]
+                       for op, rows in BINARY_OPCODES.items()}
+
+# Instructions before and after the operand
+UNARY_INSTRUCTIONS = unary_table({
+    ('-', INT):   (('CONSTI', 0), ('SUBI',)),
+    ('-', FLOAT): (('CONSTF', 0), ('SUBF',)),
+    ('!', BOOL):  (('CONSTI', 1), ('SUBI',)),   # Bools are 0 or 1
+})
+
+# CAST_INSTRUCTIONS[from type id][to type id], the instructions after the value
+CAST_INSTRUCTIONS = [[{
+    (INT, INT):     (),
+    (FLOAT, INT):   (('FTOI',),),
+    (FLOAT, FLOAT): (),
+    (INT, FLOAT):   (('ITOF',),),
+    (INT, BOOL):    (('CONSTI', 0), ('NEI',)),
+    (FLOAT, BOOL):  (('CONSTF', 0.0), ('NEF',)),
+    (CHAR, BOOL):   (('CONSTI', 0), ('NEI',)),
+    (BOOL, BOOL):   (),
+}.get((from_type, to_type)) for to_type in TYPES] for from_type in TYPES]
+
+PRINT_INSTRUCTIONS = [{INT: ('PRINTI',), FLOAT: ('PRINTF',), CHAR: ('PRINTB',)}.get(type) for type in TYPES]
+
+# DECLARATION_OPCODES[depth][type id].  Chars and bools are stored as ints
+_STORAGE = {INT: 'I', FLOAT: 'F', CHAR: 'I', BOOL: 'I'}
+DECLARATION_OPCODES = [None, None]
+DECLARATION_OPCODES[GLOBAL] = ['GLOBAL' + _STORAGE[type] for type in TYPES]
+DECLARATION_OPCODES[LOCAL] = ['LOCAL' + _STORAGE[type] for type in TYPES]
+
 
 
 class IRFunction:
@@ -230,123 +288,97 @@ class IRFunction:
 # square.append(('RETURN',))
 
 
-class IRModule:
+class IRModule(Visitor):
+    prefix = 'transpile_'  # transpile(node) calls transpile_<class name>, see visitor.py
+
     def __init__(self):
         self.functions = {}
         self.code = []
 
         self.variable_map = {}
 
-    def transpile(self, node):
-        if isinstance(node, list):
-            for item in node:
-                self.transpile(item)
-        elif isinstance(node, Print):
-            self.transpile_Print(node)
-        elif isinstance(node, Integer):
-            self.code.append(('CONSTI', node.value))
-        elif isinstance(node, Float):
-            self.code.append(('CONSTF', node.value))
-        elif isinstance(node, Char):
-            self.code.append(('CONSTI', ord(node.value)))
-        elif isinstance(node, Bool):
-            value = 1 if node.value == 'true' else 0
-            self.code.append(('CONSTI', value))
-        elif isinstance(node, BinaryOperator):
-            self.transpile_BinaryOperator(node)
-        elif isinstance(node, UnaryOperator):
-            self.transpile_UnaryOperator(node)
-        elif isinstance(node, Constant):
-            self.transpile_ConstantOrVariable(node)
-        elif isinstance(node, Variable):
-            self.transpile_ConstantOrVariable(node)
-        elif isinstance(node, Assignment):
-            self.transpile_Assignment(node)
-        elif isinstance(node, NamedLocation):
-            self.transpile_LoadNamedLocation(node)
-        elif isinstance(node, If):
-            self.transpile_If(node)
-        elif isinstance(node, While):
-            self.transpile_While(node)
-        else:
-            raise ValueError(f"Could not handle '{node}', unknown type")
+    transpile = Visitor.visit
+
+    def transpile_list(self, node):
+        for item in node:
+            self.transpile(item)
+
+    def transpile_FlatTree(self, node):
+        FlatTranspiler(self, node).transpile(node.root)  # Straight from the arrays, see below
+
+    def transpile_object(self, node):
+        raise ValueError(f"Could not handle '{node}', unknown type")
+
+    def transpile_Integer(self, node):
+        self.code.append(('CONSTI', node.value))
+
+    def transpile_Float(self, node):
+        self.code.append(('CONSTF', node.value))
+
+    def transpile_Char(self, node):
+        self.code.append(('CONSTI', ord(node.value)))
+
+    def transpile_Bool(self, node):
+        value = 1 if node.value == 'true' else 0
+        self.code.append(('CONSTI', value))
 
     def transpile_Print(self, node):
         self.transpile(node.expression)
-        if node.expression.type == Integer.type:
-            self.code.append(('PRINTI',))
-        elif node.expression.type == Float.type:
-            self.code.append(('PRINTF',))
-        elif node.expression.type == Char.type:
-            self.code.append(('PRINTB',))
-        else:
+        type = type_id(node.expression.type)
+        instruction = None if type is None else PRINT_INSTRUCTIONS[type]
+        if instruction is None:
             raise ValueError(f'Unhandled (un-print-able) type {node.expression.type}')
+        self.code.append(instruction)
 
     def transpile_UnaryOperator(self, node):
-        unaryOpMap = {
-            (Integer.type, '-'): [('CONSTI', 0), ('SUBI', )],
-            (Float.type,   '-'): [('CONSTF', 0), ('SUBF', )],
-        }
-        if node.operator == '-':
-            instructions = unaryOpMap.get((node.operand.type, node.operator))
-            self.code.append(instructions[0])
+        if node.operator in UNARY_INSTRUCTIONS:
+            before, after = UNARY_INSTRUCTIONS[node.operator][type_id(node.operand.type)]
+            self.code.append(before)
             self.transpile(node.operand)
-            self.code.append(instructions[1])
+            self.code.append(after)
         elif node.operator == '+':
             self.transpile(node.operand)
         else:
             raise ValueError(f'Operator {node.operator} not supported yet')
 
-
     def transpile_BinaryOperator(self, node):
-        binaryOpMap = {
-            (Integer.type, '+', Integer.type):  'ADDI',
-            (Integer.type, '-', Integer.type):  'SUBI',
-            (Integer.type, '*', Integer.type):  'MULI',
-            (Integer.type, '/', Integer.type):  'DIVI',
-            (Integer.type, '<', Integer.type):  'LTI',
-            (Integer.type, '>', Integer.type):  'GTI',
-            (Integer.type, '<=', Integer.type): 'LEI',
-            (Integer.type, '>=', Integer.type): 'GEI',
-
-            (Float.type,   '+', Float.type):    'ADDF',
-            (Float.type,   '-', Float.type):    'SUBF',
-            (Float.type,   '*', Float.type):    'MULF',
-            (Float.type,   '/', Float.type):    'DIVF',
-            (Float.type,   '<', Float.type):    'LTF',
-            (Float.type,   '>', Float.type):    'GTF',
-            (Float.type,   '<=', Float.type):   'LEF',
-            (Float.type,   '>=', Float.type):   'GEF',
-
-        }
         self.transpile(node.left)
         self.transpile(node.right)
-        opType = binaryOpMap.get((node.left.type, node.operator, node.right.type))
-        if opType is None:
+        left, right = type_id(node.left.type), type_id(node.right.type)
+        rows = BINARY_INSTRUCTIONS.get(node.operator)
+        instruction = None if rows is None or left is None or right is None else rows[left][right]
+        if instruction is None:
             raise ValueError(f'OpType not known for {node.left.type}{node.operator}{node.right.type}')
-        self.code.append((opType, ))
+        self.code.append(instruction)
+
+    def transpile_TypeCast(self, node):
+        self.transpile(node.value)
+        source, target = type_id(node.value.type), type_id(node.target_type)
+        instructions = None if source is None or target is None else CAST_INSTRUCTIONS[source][target]
+        if instructions is None:
+            raise ValueError(f'Unhandled type-cast {node}')
+        self.code.extend(instructions)
 
     def transpile_ConstantOrVariable(self, node):
-        if node.type == Float.type:
-            self.code.append(('GLOBALF', node.name))
-        elif node.type == Integer.type:
-            self.code.append(('GLOBALI', node.name))
-        elif node.type == Char.type:
-            self.code.append(('GLOBALI', node.name))
-        elif node.type == Bool.type:
-            self.code.append(('GLOBALI', node.name))
-        else:
+        type = type_id(node.type)
+        if type is None:
             raise ValueError(f'Unhandled Const with type {node.type}')
+        opcodes = DECLARATION_OPCODES[LOCAL if node.depth == LOCAL else GLOBAL]
+        self.code.append((opcodes[type], node.name, node.slot))
 
         if node.value:
             self.transpile(node.value)
-            self.code.append(('STORE', node.name))
+            self.code.append(('STORE', node.name, node.depth, node.slot))
+
+    transpile_Constant = transpile_Variable = transpile_ConstantOrVariable
 
     def transpile_LoadNamedLocation(self, node):
-        self.code.append(('LOAD', node.name))
+        self.code.append(('LOAD', node.name, node.depth, node.slot))
+
+    transpile_NamedLocation = transpile_LoadNamedLocation
 
     def transpile_StoreNamedLocation(self, node):
-        self.code.append(('STORE', node.name))
+        self.code.append(('STORE', node.name, node.depth, node.slot))
 
     def transpile_Assignment(self, node):
         self.transpile(node.expression)
@@ -361,6 +393,35 @@ class IRModule:
             self.transpile(node.alternative)
         self.code.append(('ENDIF',))
 
+    def transpile_Break(self, node):
+        self.code.append(('CONSTI', 1))
+        self.code.append(('CBREAK',))
+
+    def transpile_Continue(self, node):
+        self.code.append(('CONTINUE',))
+
+    # Functions.  The code of a function goes into an IRFunction in
+    # self.functions, the parameters are its first local slots (the caller
+    # puts the arguments there, so they aren't declared)
+
+    def transpile_Function(self, node):
+        parameters = [(parameter.name, _STORAGE[parameter.type]) for parameter in node.parameters]
+        function = IRFunction(node.name, parameters, _STORAGE[node.return_type])
+        if not node.imported:
+            outer = self.code
+            self.code = function.code
+            self.transpile(node.statements)
+            self.code = outer
+        self.functions[node.name] = function
+
+    def transpile_FunctionCall(self, node):
+        self.transpile(node.args)
+        self.code.append(('CALL', node.function_name))
+
+    def transpile_Return(self, node):
+        self.transpile(node.value)
+        self.code.append(('RET',))
+
     def transpile_While(self, node):
         self.code.append(('LOOP',))
 
@@ -376,7 +437,178 @@ class IRModule:
 # alternative
 
 
+# Transpiling a FlatTree
+# ======================
+# Like checking (see FlatChecker in check.py), IR for a FlatTree is made
+# straight from its arrays, with a handler per kind of node.  It's the
+# same code IRModule makes for the model (test_flat.py checks that).
+
+class FlatTranspiler:
+    def __init__(self, module, tree):
+        self.module = module
+        self.tree = tree
+        self.kind, self.first, self.edges = tree.kind, tree.first, tree.edges
+        self.pool, self.pool_index = tree.pool, tree.pool_index
+        self.type, self.depth, self.slot = tree.type, tree.depth, tree.slot
+
+    def transpile(self, id):
+        FLAT_TRANSPILERS[self.kind[id]](self, id)
+
+    def child(self, id, position):
+        return self.edges[self.first[id] + position]
+
+    def value(self, id, position):
+        return self.pool[self.pool_index[id]][position + 1]
+
+    def location(self, id):
+        """ name, depth, slot of a NamedLocation (or declaration) """
+        depth, slot = self.depth[id], self.slot[id]
+        return self.value(id, 0), None if depth < 0 else depth, None if slot < 0 else slot
+
+    def transpile_list(self, id):
+        for child in self.edges[self.first[id]:self.first[id + 1]]:
+            self.transpile(child)
+
+    def transpile_object(self, id):
+        raise ValueError(f"Could not handle '{self.tree.node(id)}', unknown type")
+
+    def transpile_Integer(self, id):
+        self.module.code.append(('CONSTI', self.value(id, 0)))
+
+    def transpile_Float(self, id):
+        self.module.code.append(('CONSTF', self.value(id, 0)))
+
+    def transpile_Char(self, id):
+        self.module.code.append(('CONSTI', ord(self.value(id, 0))))
+
+    def transpile_Bool(self, id):
+        self.module.code.append(('CONSTI', 1 if self.value(id, 0) == 'true' else 0))
+
+    def transpile_Print(self, id):
+        expression = self.child(id, 0)
+        self.transpile(expression)
+        type = self.type[expression]
+        instruction = None if type < 0 else PRINT_INSTRUCTIONS[type]
+        if instruction is None:
+            raise ValueError(f'Unhandled (un-print-able) type {TYPES[type] if type >= 0 else None}')
+        self.module.code.append(instruction)
+
+    def transpile_UnaryOperator(self, id):
+        operator, operand = self.value(id, 0), self.child(id, 0)
+        if operator in UNARY_INSTRUCTIONS:
+            before, after = UNARY_INSTRUCTIONS[operator][self.type[operand]]
+            self.module.code.append(before)
+            self.transpile(operand)
+            self.module.code.append(after)
+        elif operator == '+':
+            self.transpile(operand)
+        else:
+            raise ValueError(f'Operator {operator} not supported yet')
+
+    def transpile_BinaryOperator(self, id):
+        left, right = self.child(id, 0), self.child(id, 1)
+        self.transpile(left)
+        self.transpile(right)
+        operator = self.value(id, 0)
+        left_type, right_type = self.type[left], self.type[right]
+        rows = BINARY_INSTRUCTIONS.get(operator)
+        instruction = None if rows is None or left_type < 0 or right_type < 0 else rows[left_type][right_type]
+        if instruction is None:
+            left_type, right_type = self.tree.node(left).type, self.tree.node(right).type
+            raise ValueError(f'OpType not known for {left_type}{operator}{right_type}')
+        self.module.code.append(instruction)
+
+    def transpile_TypeCast(self, id):
+        value = self.child(id, 0)
+        self.transpile(value)
+        source, target = self.type[value], type_id(self.value(id, 0))
+        instructions = None if source < 0 or target is None else CAST_INSTRUCTIONS[source][target]
+        if instructions is None:
+            raise ValueError(f'Unhandled type-cast {self.tree.node(id)}')
+        self.module.code.extend(instructions)
+
+    def transpile_ConstantOrVariable(self, id):
+        type = self.type[id]
+        if type < 0:
+            raise ValueError('Unhandled Const with type None')
+        name, depth, slot = self.location(id)
+        opcodes = DECLARATION_OPCODES[LOCAL if depth == LOCAL else GLOBAL]
+        self.module.code.append((opcodes[type], name, slot))
+        value = self.child(id, 0)
+        if value >= 0:
+            self.transpile(value)
+            self.module.code.append(('STORE', name, depth, slot))
+
+    transpile_Constant = transpile_Variable = transpile_ConstantOrVariable
+
+    def transpile_NamedLocation(self, id):
+        self.module.code.append(('LOAD',) + self.location(id))
+
+    def transpile_Assignment(self, id):
+        location = self.child(id, 0)
+        self.transpile(self.child(id, 1))
+        self.module.code.append(('STORE',) + self.location(location))
+
+    def transpile_If(self, id):
+        code = self.module.code
+        self.transpile(self.child(id, 0))
+        code.append(('IF',))
+        self.transpile(self.child(id, 1))
+        alternative = self.child(id, 2)
+        if alternative >= 0:
+            code.append(('ELSE',))
+            self.transpile(alternative)
+        code.append(('ENDIF',))
+
+    def transpile_Break(self, id):
+        self.module.code.append(('CONSTI', 1))
+        self.module.code.append(('CBREAK',))
+
+    def transpile_Continue(self, id):
+        self.module.code.append(('CONTINUE',))
+
+    def transpile_Function(self, id):
+        name, return_type, imported = self.pool[self.pool_index[id]][1:]
+        parameters = [(self.value(parameter, 0), _STORAGE[TYPES[self.type[parameter]]])
+                      for parameter in self.tree.children(self.child(id, 0))]
+        function = IRFunction(name, parameters, _STORAGE[return_type])
+        if not imported:
+            outer = self.module.code
+            self.module.code = function.code
+            self.transpile(self.child(id, 1))
+            self.module.code = outer
+        self.module.functions[name] = function
+
+    def transpile_FunctionCall(self, id):
+        self.transpile(self.child(id, 0))
+        self.module.code.append(('CALL', self.value(id, 0)))
+
+    def transpile_Return(self, id):
+        self.transpile(self.child(id, 0))
+        self.module.code.append(('RET',))
+
+    def transpile_While(self, id):
+        code = self.module.code
+        code.append(('LOOP',))
+        code.append(('CONSTI', 1))
+        self.transpile(self.child(id, 0))
+        code.append(('SUBI', ))
+        code.append(('CBREAK', ))
+        self.transpile(self.child(id, 1))
+        code.append(('ENDLOOP',))
+
+
+FLAT_TRANSPILERS = kind_handlers(FlatTranspiler, 'transpile_', FlatTranspiler.transpile_object)
+
+
 def generate_ircode(code):
     irmodule = IRModule()
     irmodule.transpile(code)
     return irmodule.code
+
+
+def generate_module(code):
+    """ The IRModule for a program: the top-level code in .code, the functions in .functions """
+    irmodule = IRModule()
+    irmodule.transpile(code)
+    return irmodule
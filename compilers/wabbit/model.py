@@ -34,11 +34,55 @@
 # Starting out, I'd advise against making this file too fancy. Just
 # use basic Python class definitions.  You can add usability improvements
 # later.
+#
+# Later: every class lists its attributes in __slots__, so nodes don't
+# carry a __dict__ each (see bench.py node_memory).  That includes the
+# attributes filled in after parsing: the source offset (parser) and the
+# type, mutability and declaration of expressions (checker).  Most of
+# those read as None until they are set, but the type and mutability of
+# an expression raise AttributeError: reading them before the checker
+# has run is a bug, not a missing type.  Expressions that were interned (see
+# hashcons.py) also carry their structural hash, and variables and the
+# names that refer to them get a (depth, slot) from resolve.py.
+
+from types import MemberDescriptorType
+
+from compilers.wabbit.typesys import INT, FLOAT, BOOL, CHAR, TYPES, intern_type
+
+# Attributes that are None until somebody fills them in
+OPTIONAL_FIELDS = {'offset', 'type', 'mutable', 'declaration', 'structural_hash', 'depth', 'slot'}
+# ... except these, which the checker sets on every expression it checks
+CHECKED_FIELDS = {'type', 'mutable'}
 
 
 class Node:
     """ Parent of Everything """
-    pass
+    __slots__ = ('offset',)  # Position in the source (set by the parser, see source.py)
+    _fields = ('offset',)
+
+    def __init_subclass__(cls):
+        # All the slots of a class and its parents that can be set (the Literal
+        # subclasses fix 'type' with a class attribute, so it isn't one of them)
+        cls._fields = tuple(name for klass in reversed(cls.__mro__) for name in vars(klass).get('__slots__', ())
+                            if isinstance(getattr(cls, name), MemberDescriptorType))
+
+    def __getattr__(self, name):
+        # Only called when normal lookup fails, i.e. for slots that are still empty
+        if name in CHECKED_FIELDS and name in self._fields:
+            raise AttributeError(f'{type(self).__name__!r} object has no {name!r} (it has not been checked)')
+        if name in OPTIONAL_FIELDS and name not in CHECKED_FIELDS:
+            return None
+        raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+
+    # Pickling. There's no __dict__ to save, just the slots (an optional
+    # one that isn't set is saved as None and left empty again on loading)
+    def __getstate__(self):
+        return tuple(getattr(self, name, None) for name in self._fields)
+
+    def __setstate__(self, state):
+        for name, value in zip(self._fields, state):
+            if value is not None or name not in OPTIONAL_FIELDS:
+                setattr(self, name, value)
 
 # -------------------
 # Part 1. Statements.
@@ -51,7 +95,7 @@ class Statement(Node):
     Wabbit programs consist of statements.  Statements are related to
     things like assignment, I/O (printing), control-flow, and other operations.
     """
-    pass
+    __slots__ = ()
 
 
 class Assignment(Statement):
@@ -59,6 +103,8 @@ class Assignment(Statement):
     # 1.1 Assignment
     #     location = expression ;
     """
+    __slots__ = ('location', 'expression')
+
     def __init__(self, location, expression):
         self.location = location
         self.expression = expression
@@ -75,6 +121,8 @@ class Print(Statement):
     # 1.2 Printing
     #     print expression ;
     """
+    __slots__ = ('expression',)
+
     def __init__(self, expression):
         self.expression = expression
 
@@ -87,6 +135,8 @@ class If(Statement):
     # 1.3 Conditional
     #     if test { consequence} else { alternative }
     """
+    __slots__ = ('test', 'consequence', 'alternative')
+
     def __init__(self, test, consequence, alternative=None):
         self.test = test
         self.consequence = consequence
@@ -103,6 +153,8 @@ class While(Statement):
     # 1.4 While Loop
     #  while test { body }
     """
+    __slots__ = ('test', 'consequence')
+
     def __init__(self, test, body):
         self.test = test
         self.consequence = body
@@ -120,12 +172,18 @@ class Break(Statement):
     #       break;   // continue
     #   }
     """
-    pass
+    __slots__ = ()
+
+    def __str__(self):
+        return "break;"
 
 
 class Continue(Statement):
     """ DB has this, but I didn't think it would be necessary ... think further """
-    pass
+    __slots__ = ()
+
+    def __str__(self):
+        return "continue;"
 
 
 class Return(Statement):
@@ -133,6 +191,8 @@ class Return(Statement):
     # 1.6 Return a value
     #  return expression ;
     """
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
@@ -152,7 +212,7 @@ class Definition(Statement):
     are defined within an environment that forms a so-called "scope."
     For example, global scope or local scope.
     """
-    pass
+    __slots__ = ()
 
 
 class Variable(Definition):
@@ -165,6 +225,9 @@ class Variable(Definition):
     # Constants are immutable.  If a value is present, the type can be
     # ommitted and inferred from the type of the value.
     """
+    __slots__ = ('name', 'type', 'value', 'mutable', 'type_specified_when_declared', 'value_specified_when_declared',
+                 'depth', 'slot')  # Filled in by resolve.py
+
     def __init__(self, name, value=None, type=None):
         assert value or type
         assert type is None or type in KNOWN_TYPES
@@ -172,7 +235,7 @@ class Variable(Definition):
         self.value_specified_when_declared = value is not None
 
         self.name = name
-        self.type = type
+        self.type = intern_type(type)
         self.value = value
         self.mutable = True
 
@@ -183,11 +246,14 @@ class Variable(Definition):
 
 
 class Constant(Definition):
+    __slots__ = ('name', 'type', 'value', 'mutable', 'type_specified_when_declared',
+                 'depth', 'slot')  # Filled in by resolve.py
+
     def __init__(self, name, value, type=None):
         assert type is None or type in KNOWN_TYPES
         self.type_specified_when_declared = type is not None
         self.name = name
-        self.type = type
+        self.type = intern_type(type)
         self.value = value
         self.mutable = False
 
@@ -203,15 +269,20 @@ class Function(Definition):
     # An external functions can be imported from using the special statement:
     #    import func name(parameters) return_type;
     """
-    def __init__(self, name, parameters, return_type, statements):
+    __slots__ = ('name', 'parameters', 'return_type', 'statements', 'imported')
+
+    def __init__(self, name, parameters, return_type, statements, imported=False):
         self.name = name
         self.parameters = parameters
-        self.return_type = return_type
+        self.return_type = intern_type(return_type)
         self.statements = statements
-        assert statements, f'Function {self.name} contains no statements, should contain at least one.'
+        self.imported = imported  # Imported functions have no statements
+        assert statements or imported, f'Function {self.name} contains no statements, should contain at least one.'
 
     def __str__(self):
         parameters = ', '.join([str(p) for p in self.parameters])
+        if self.imported:
+            return f"import func {self.name}({parameters}) {self.return_type};"
         statements = '\n  '.join([str(s) for s in self.statements])
         return f"""\
 {self.name} ({parameters}) {self.return_type} {{
@@ -230,9 +301,11 @@ class FunctionParameter(Definition):
     # as part of the function definition itself, not as a separate "var"
     # declaration.
     """
+    __slots__ = ('name', 'type', 'depth', 'slot')  # depth and slot are filled in by resolve.py
+
     def __init__(self, name, type):
         self.name = name
-        self.type = type
+        self.type = intern_type(type)
         assert type in KNOWN_TYPES
 
     def __str__(self):
@@ -251,13 +324,18 @@ class Expression(Node):
 
     Wabbit defines the following expressions and operators
     """
+    __slots__ = ('type',             # Filled in by the checker
+                 'structural_hash')  # Only for shared nodes, see hashcons.py
 
 
 class Literal(Expression):
     """
     # 3.1 Literals
 
+    The subclasses fix the type with a class attribute (Integer.type == 'int').
     """
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
@@ -269,7 +347,8 @@ class Integer(Literal):
     """
     #        23            (Integer literal)
     """
-    type = 'int'
+    __slots__ = ()
+    type = INT
 
     def __init__(self, value):
         assert isinstance(value, int)
@@ -280,7 +359,8 @@ class Float(Literal):
     """
     #        4.5           (Float literal)
     """
-    type = 'float'
+    __slots__ = ()
+    type = FLOAT
 
     def __init__(self, value):
         assert isinstance(value, float)
@@ -292,7 +372,8 @@ class Bool(Literal):
     """
     #        true,false    (Bool literal)
     """
-    type = 'bool'
+    __slots__ = ()
+    type = BOOL
 
     def __init__(self, value):
         assert value in {'true', 'false'}
@@ -303,14 +384,15 @@ class Char(Literal):
     """
     #        'c'           (Character literal - A single character)
     """
-    type = 'char'
+    __slots__ = ()
+    type = CHAR
 
     def __init__(self, value):
         assert isinstance(value, str) and len(value) == 1
         super().__init__(value)
 
 
-KNOWN_TYPES = {Integer.type, Float.type, Bool.type, Char.type}
+KNOWN_TYPES = set(TYPES)
 
 
 class BinaryOperator(Expression):
@@ -329,6 +411,8 @@ class BinaryOperator(Expression):
     #        left && right       (Logical and)
     #        left || right       (Logical or)
     """
+    __slots__ = ('operator', 'left', 'right')
+
     def __init__(self, operator, left, right):
         self.operator = operator
         self.left = left
@@ -346,6 +430,8 @@ class UnaryOperator(Expression):
     #        !operand       (logical not)
     #        ^operand       (Grow memory)
     """
+    __slots__ = ('operator', 'operand')
+
     def __init__(self, operator, operand):
         self.operator = operator
         self.operand = operand
@@ -359,6 +445,8 @@ class Fetch(Expression):
     # 3.4 Reading from a location  (see below)
     #        location
     """
+    __slots__ = ('location',)
+
     def __init__(self, location):
         self.location = location
 
@@ -369,9 +457,11 @@ class TypeCast(Expression):
     #         int(expr)
     #         float(expr)
     """
+    __slots__ = ('target_type', 'value')
+
     def __init__(self, target_type, value):
-        assert self.target_type in KNOWN_TYPES
-        self.target_type = target_type
+        assert target_type in KNOWN_TYPES
+        self.target_type = intern_type(target_type)
         self.value = value
 
     def __str__(self):
@@ -383,6 +473,8 @@ class FunctionCall(Expression):
     # 3.6 Function/Procedure Call
     #        func(arg1, arg2, ..., argn)
     """
+    __slots__ = ('function_name', 'args')
+
     def __init__(self, function_name, args):
         self.function_name = function_name
         self.args = args
@@ -419,7 +511,7 @@ class Location(Expression):
 
     Wabbit has two types of locations:
     """
-    pass
+    __slots__ = ('mutable', 'declaration')  # Filled in by the checker
 
 
 class NamedLocation(Location):
@@ -435,6 +527,8 @@ class NamedLocation(Location):
     #
     #           var abc int;
     """
+    __slots__ = ('name', 'depth', 'slot')  # depth and slot are filled in by resolve.py
+
     def __init__(self, name):
         self.name = name
 
@@ -449,6 +543,8 @@ class MemoryAddress(Location):
     #       `address = 123;
     #       print `address + 10;
     """
+    __slots__ = ('address',)
+
     def __init__(self, address):
         self.address = address
 
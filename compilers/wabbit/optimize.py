@@ -0,0 +1,342 @@
+# optimize.py
+#
+# Optimizing IR code (see ircode.py).  A pass is a function that takes
+# a list of instructions and returns a new one that does the same.  A
+# PassManager runs a list of passes, over and over until none of them
+# changes anything, and records how many instructions each pass took
+# out:
+#
+#     manager = PassManager()
+#     code = manager.run(generate_ircode(program))
+#     manager.report()
+#
+# The passes:
+#
+#   propagate_constants   A global that is stored once, with a constant,
+#                         outside of any block (a const, or a var that
+#                         is never assigned) is loaded as that constant
+#   fold_constants        Operators on constants become a constant,
+#                         CONSTI 2; CONSTI 3; MULI -> CONSTI 6
+#   simplify              x + 0, x - 0, x * 1, x / 1, 0 + x, 1 * x -> x
+#   peephole              CONSTI 1; <test>; SUBI (the 'not' that
+#                         IRModule puts in front of CBREAK) -> <test>
+#                         with the opposite comparison, and an empty
+#                         ELSE goes
+#   eliminate_dead_code   Code after RET/CONTINUE up to the end of its
+#                         block, IF on a constant, CBREAK on a constant
+#
+# What they do must not be visible when the program runs:
+#
+#  - Ints are 32 bits in Wasm, so an int is only folded if the result
+#    fits, and division by zero is left for run time.
+#  - Float comparisons are not inverted (not a < b isn't a >= b if one
+#    of them is a NaN), except == and !=.  x + 0.0 is not x (for -0.0).
+#  - Expressions are never dropped, only the constants around them, so
+#    GROW, PEEK and calls still happen.
+#
+# Operands are found by walking back from an operator while adding up
+# how many values each instruction leaves on the stack (STACK_EFFECTS).
+# Only expression instructions have an effect there; anything else
+# (STORE, IF, CALL, ...) stops the walk and the rewrite doesn't happen.
+import math
+
+from compilers.wabbit.bytecode import Bytecode, as_bytecode, decode
+from compilers.wabbit.resolve import GLOBAL
+
+INT_MIN = -2 ** 31
+INT_MAX = 2 ** 31 - 1
+
+STACK_EFFECTS = {
+    'CONSTI': 1, 'CONSTF': 1, 'LOAD': 1,
+    'ADDI': -1, 'SUBI': -1, 'MULI': -1, 'DIVI': -1, 'ANDI': -1, 'ORI': -1,
+    'LTI': -1, 'LEI': -1, 'GTI': -1, 'GEI': -1, 'EQI': -1, 'NEI': -1,
+    'ADDF': -1, 'SUBF': -1, 'MULF': -1, 'DIVF': -1,
+    'LTF': -1, 'LEF': -1, 'GTF': -1, 'GEF': -1, 'EQF': -1, 'NEF': -1,
+    'ITOF': 0, 'FTOI': 0, 'PEEKI': 0, 'PEEKF': 0, 'PEEKB': 0, 'GROW': 0,
+}
+
+
+def _divide(left, right):
+    quotient = abs(left) // abs(right)  # Truncated, like Wasm
+    return -quotient if (left < 0) != (right < 0) else quotient
+
+
+# Folding.  None means "don't fold"
+BINARY_FOLDS = {
+    'ADDI': lambda a, b: a + b,
+    'SUBI': lambda a, b: a - b,
+    'MULI': lambda a, b: a * b,
+    'DIVI': lambda a, b: _divide(a, b) if b else None,
+    'ANDI': lambda a, b: a & b,
+    'ORI': lambda a, b: a | b,
+    'ADDF': lambda a, b: a + b,
+    'SUBF': lambda a, b: a - b,
+    'MULF': lambda a, b: a * b,
+    'DIVF': lambda a, b: a / b if b else None,
+}
+for _suffix in 'IF':
+    BINARY_FOLDS.update({
+        'LT' + _suffix: lambda a, b: int(a < b),
+        'LE' + _suffix: lambda a, b: int(a <= b),
+        'GT' + _suffix: lambda a, b: int(a > b),
+        'GE' + _suffix: lambda a, b: int(a >= b),
+        'EQ' + _suffix: lambda a, b: int(a == b),
+        'NE' + _suffix: lambda a, b: int(a != b),
+    })
+
+# The opposite of each comparison, where not (a op b) == (a opposite b)
+OPPOSITES = {
+    'LTI': 'GEI', 'GEI': 'LTI', 'GTI': 'LEI', 'LEI': 'GTI', 'EQI': 'NEI', 'NEI': 'EQI',
+    'EQF': 'NEF', 'NEF': 'EQF',
+}
+
+BLOCK_STARTS = {'IF', 'LOOP'}
+BLOCK_ENDS = {'ENDIF', 'ENDLOOP'}
+
+
+def constant(value):
+    """ The instruction that pushes value, or None if it isn't a foldable value """
+    if isinstance(value, float):
+        return ('CONSTF', value)
+    if isinstance(value, int) and INT_MIN <= value <= INT_MAX:
+        return ('CONSTI', value)
+    return None
+
+
+def is_constant(instruction):
+    return instruction[0] == 'CONSTI' or instruction[0] == 'CONSTF'
+
+
+def operand_start(code, end):
+    """ Index of the first instruction of the expression that ends just before end (None if there isn't one) """
+    pushed = 0
+    for index in range(end - 1, -1, -1):
+        effect = STACK_EFFECTS.get(code[index][0])
+        if effect is None:
+            return None
+        pushed += effect
+        if pushed == 1:
+            return index
+    return None
+
+
+def matching_end(code, start, stops):
+    """ Index of the first of stops (opcodes) after start that isn't in a nested block """
+    depth = 0
+    for index in range(start + 1, len(code)):
+        opcode = code[index][0]
+        if depth == 0 and opcode in stops:
+            return index
+        if opcode in BLOCK_STARTS:
+            depth += 1
+        elif opcode in BLOCK_ENDS:
+            depth -= 1
+    raise ValueError(f'No {"/".join(stops)} for {code[start][0]} at {start}')
+
+
+# Passes
+
+def propagate_constants(code):
+    stores = {}  # (depth, slot) -> [index of the STORE, or None if it can't be propagated]
+    depth = 0
+    for index, instruction in enumerate(code):
+        opcode = instruction[0]
+        if opcode == 'CALL':
+            return code  # The function may store any global
+        if opcode in BLOCK_STARTS:
+            depth += 1
+        elif opcode in BLOCK_ENDS:
+            depth -= 1
+        elif opcode == 'STORE':
+            if len(instruction) < 4 or instruction[3] is None:
+                return code  # Not resolved, a load may be the same variable under another key
+            key = instruction[2:]
+            if key in stores or depth > 0 or instruction[2] != GLOBAL or index == 0 or not is_constant(code[index - 1]):
+                stores[key] = None
+            else:
+                stores[key] = index
+    constants = {}  # index of the STORE -> (key, constant)
+    for key, index in stores.items():
+        if index is not None:
+            constants[index] = (key, code[index - 1])
+    if not constants:
+        return code
+    known = {}
+    optimized = []
+    for index, instruction in enumerate(code):
+        if instruction[0] == 'LOAD' and instruction[2:] in known:
+            optimized.append(known[instruction[2:]])
+            continue
+        optimized.append(instruction)
+        if index in constants:
+            key, value = constants[index]
+            known[key] = value  # Only loads after the store (the ones before see the initial 0)
+    return optimized
+
+
+def fold_constants(code):
+    optimized = []
+    for instruction in code:
+        opcode = instruction[0]
+        fold = BINARY_FOLDS.get(opcode)
+        if fold is not None and len(optimized) >= 2 and is_constant(optimized[-1]) and is_constant(optimized[-2]):
+            folded = constant(fold(optimized[-2][1], optimized[-1][1]))
+            if folded is not None:
+                optimized[-2:] = [folded]
+                continue
+        elif opcode == 'ITOF' and optimized and optimized[-1][0] == 'CONSTI':
+            optimized[-1] = ('CONSTF', float(optimized[-1][1]))
+            continue
+        elif opcode == 'FTOI' and optimized and optimized[-1][0] == 'CONSTF':
+            value = optimized[-1][1]
+            folded = constant(int(value)) if value - value == 0 else None  # Not for inf and nan
+            if folded is not None:
+                optimized[-1] = folded
+                continue
+        optimized.append(instruction)
+    return optimized
+
+
+def _is_identity(instruction, value):
+    """ Is instruction a constant that equals value (and for floats, has the same sign)? """
+    if instruction[0] == 'CONSTI':
+        return instruction[1] == value
+    return instruction[0] == 'CONSTF' and instruction[1] == value and math.copysign(1.0, instruction[1]) > 0
+
+
+# (opcode, position of the constant) that can be dropped when the constant is the identity value
+IDENTITIES = {
+    ('ADDI', 'right'): 0, ('SUBI', 'right'): 0, ('MULI', 'right'): 1, ('DIVI', 'right'): 1,
+    ('ADDI', 'left'): 0, ('MULI', 'left'): 1,
+    ('SUBF', 'right'): 0.0, ('MULF', 'right'): 1.0, ('DIVF', 'right'): 1.0,
+    ('MULF', 'left'): 1.0,
+}
+
+
+def simplify(code):
+    optimized = []
+    for instruction in code:
+        opcode = instruction[0]
+        if STACK_EFFECTS.get(opcode) == -1 and len(optimized) >= 2:
+            right = operand_start(optimized, len(optimized))
+            left = None if right is None else operand_start(optimized, right)
+            if left is not None:
+                value = IDENTITIES.get((opcode, 'right'))
+                if value is not None and right == len(optimized) - 1 and _is_identity(optimized[right], value):
+                    del optimized[right]
+                    continue
+                value = IDENTITIES.get((opcode, 'left'))
+                if value is not None and left == right - 1 and _is_identity(optimized[left], value):
+                    del optimized[left]
+                    continue
+        optimized.append(instruction)
+    return optimized
+
+
+def peephole(code):
+    optimized = []
+    for instruction in code:
+        if instruction[0] == 'SUBI' and optimized and optimized[-1][0] in OPPOSITES:
+            test = operand_start(optimized, len(optimized))
+            if test is not None and test > 0 and optimized[test - 1] == ('CONSTI', 1):
+                # 1 - (a < b) -> a >= b
+                optimized[-1] = (OPPOSITES[optimized[-1][0]],)
+                del optimized[test - 1]
+                continue
+        if instruction[0] == 'ENDIF' and optimized and optimized[-1][0] == 'ELSE':
+            optimized.pop()
+        optimized.append(instruction)
+    return optimized
+
+
+def eliminate_dead_code(code):
+    optimized = []
+    index = 0
+    while index < len(code):
+        instruction = code[index]
+        opcode = instruction[0]
+        if opcode in ('RET', 'CONTINUE'):
+            # Nothing runs until the end of the block this is in
+            optimized.append(instruction)
+            index = matching_end(code, index, ('ELSE', 'ENDIF', 'ENDLOOP')) if _in_block(code, index) else len(code)
+            continue
+        if optimized and optimized[-1][0] == 'CONSTI':
+            test = optimized[-1][1]
+            if opcode == 'IF':
+                optimized.pop()
+                middle = matching_end(code, index, ('ELSE', 'ENDIF'))
+                end = middle if code[middle][0] == 'ENDIF' else matching_end(code, middle, ('ENDIF',))
+                if test:
+                    code = code[:index] + code[index + 1:middle] + code[end + 1:]
+                else:
+                    code = code[:index] + code[middle + 1:end] + code[end + 1:]
+                continue  # The branch that is left may have dead code too
+            if opcode == 'CBREAK':
+                optimized.pop()
+                if test and optimized and optimized[-1][0] == 'LOOP':
+                    optimized.pop()  # A loop that ends before it does anything
+                    index = matching_end(code, index, ('ENDLOOP',)) + 1
+                elif test:
+                    optimized.append(('CONSTI', test))
+                    optimized.append(instruction)
+                    index += 1
+                else:
+                    index += 1  # Never breaks
+                continue
+        optimized.append(instruction)
+        index += 1
+    return optimized
+
+
+def _in_block(code, index):
+    depth = 0
+    for instruction in code[index + 1:]:
+        if instruction[0] in BLOCK_STARTS:
+            depth += 1
+        elif instruction[0] in BLOCK_ENDS:
+            if depth == 0:
+                return True
+            depth -= 1
+    return False
+
+
+PASSES = (propagate_constants, fold_constants, simplify, peephole, eliminate_dead_code)
+
+
+class PassManager:
+    def __init__(self, passes=PASSES, max_rounds=10):
+        self.passes = passes
+        self.max_rounds = max_rounds
+        self.removed = {p.__name__: 0 for p in passes}  # Instructions each pass took out, over all runs
+        self.changes = {p.__name__: 0 for p in passes}  # Times each pass changed the code
+        self.before = self.after = 0
+
+    def run(self, code):
+        """ The optimized code (a list of instructions, or Bytecode for Bytecode) """
+        bytecode = isinstance(code, Bytecode)
+        if bytecode:
+            code = decode(code)
+        self.before += len(code)
+        for _ in range(self.max_rounds):
+            changed = False
+            for optimization in self.passes:
+                optimized = optimization(code)
+                if optimized != code:
+                    changed = True
+                    self.removed[optimization.__name__] += len(code) - len(optimized)
+                    self.changes[optimization.__name__] += 1
+                    code = optimized
+            if not changed:
+                break
+        self.after += len(code)
+        return as_bytecode(code) if bytecode else code
+
+    def report(self, out=print):
+        out(f'{"pass":<24}{"changes":>9}{"removed":>9}')
+        for name, removed in self.removed.items():
+            out(f'{name:<24}{self.changes[name]:>9}{removed:>9}')
+        out(f'{"total":<24}{"":>9}{self.before - self.after:>9}  ({self.before} -> {self.after} instructions)')
+
+
+def optimize(code, passes=PASSES):
+    return PassManager(passes).run(code)
@@ -0,0 +1,260 @@
+# parallel.py
+#
+# Parsing a big program with several processes.
+#
+# Large Wabbit programs are mostly top-level function declarations that
+# have nothing to do with each other as far as the parser is concerned.
+# A quick pre-scan of the text finds where each top-level 'func' or
+# 'import func' starts, using nothing but brace counting (comments and
+# character literals are skipped so a '{' in them doesn't count).  The
+# text in between two of those boundaries is a run of complete
+# statements, so it can be tokenized and parsed on its own.
+#
+# Runs of statements are grouped into a few tasks of about the same size
+# and handed to a process pool.  The results come back in source order
+# and are simply concatenated.  Each worker gets the whole text once
+# (when the pool starts) and tasks are only (start, stop) offsets, so
+# node offsets are the same as if the program had been parsed in one go.
+#
+# The tokenizer reports illegal characters and unterminated comments
+# through errors.error() as it goes.  In a worker those would go to the
+# worker's own collector, so each task collects them and they come back
+# with its statements, to be reported again in order here.  A ParseError
+# comes back the same way and is raised once the diagnostics before it
+# have been reported, which is what Parser does.
+#
+# The price is pickling the model back from the workers.  That's not
+# cheap, so this only pays off for big programs (see bench.py parallel).
+#
+# Checking can be split up too, see check_parallel() at the end.
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from compilers.wabbit import errors
+from compilers.wabbit.check import FlatChecker
+from compilers.wabbit.errors import ParseError, TooManyErrors
+from compilers.wabbit.flat import KIND_CODES
+from compilers.wabbit.model import Function, Variable, Constant
+from compilers.wabbit.parse import Parser, K
+from compilers.wabbit.tokenizer import _scan
+
+DECLARATION_REGEX = re.compile(r"""
+      (?P<COMMENT>/\*.*?\*/|//[^\n]*)
+    | (?P<UNTERMINATED_COMMENT>/\*)
+    | (?P<CHAR>'(?:\\x[0-9a-fA-F]{2}|\\.|[^\\'\n])')
+    | (?P<LBRACE>\{)
+    | (?P<RBRACE>\})
+    | (?P<IMPORT>\bimport\b)
+    | (?P<FUNC>\bfunc\b)
+    """, re.VERBOSE | re.DOTALL)
+
+TASKS_PER_WORKER = 4
+
+
+def split_declarations(text):
+    """
+    Offsets where top-level declarations start.  The first is always 0 and
+    the text between two of them is a run of whole statements.
+    """
+    starts = [0]
+    depth = 0
+    after_import = False
+    for m in DECLARATION_REGEX.finditer(text):
+        kind = m.lastgroup
+        if kind == 'COMMENT':
+            continue
+        elif kind == 'UNTERMINATED_COMMENT':
+            break  # The rest stays in one piece and gets reported when it's parsed
+        elif kind == 'LBRACE':
+            depth += 1
+        elif kind == 'RBRACE':
+            depth = max(depth - 1, 0)
+        elif depth == 0 and (kind == 'IMPORT' or (kind == 'FUNC' and not after_import)):
+            if m.start() > starts[-1]:
+                starts.append(m.start())
+        after_import = kind == 'IMPORT'
+    return starts
+
+
+def group_tasks(starts, end, ntasks):
+    """ Merge neighbouring pieces into about ntasks (start, stop) ranges of similar size """
+    size = end / ntasks
+    tasks = []
+    begin = 0
+    for start in starts[1:]:
+        if start - begin >= size:
+            tasks.append((begin, start))
+            begin = start
+    tasks.append((begin, end))
+    return tasks
+
+
+_text = None  # The program being parsed (in a worker process)
+
+
+def _init_worker(text):
+    global _text
+    _text = text
+    errors.set_source(text)
+
+
+def parse_range(start, stop):
+    """
+    Tokenize and parse text[start:stop] of the program given to the worker.
+    Returns the statements (None after a ParseError), the diagnostics
+    reported while parsing and the ParseError, if there was one.
+    """
+    statements = failure = None
+    with errors.collecting(echo=False) as diagnostics:
+        try:
+            parser = Parser(_scan(_text[start:stop], 0, True, start))
+            statements = parser.parse_statements()
+            if not parser.peek(K.EOF):
+                raise ParseError(f'Unexpected {parser.next_token}', parser.next_token.offset)
+        except ParseError as e:
+            failure = e
+    return statements, diagnostics.records, failure
+
+
+def parse_parallel(text, workers=None):
+    """
+    Parse a whole program using a pool of worker processes (os.cpu_count()
+    by default).  Returns the same list of statements as Parser and reports
+    the same diagnostics.
+    """
+    errors.set_source(text)
+    workers = workers or os.cpu_count()
+    tasks = group_tasks(split_declarations(text), len(text), workers * TASKS_PER_WORKER)
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(text,)) as pool:
+        results = list(pool.map(parse_range, *zip(*tasks)))
+    diagnostics = errors.get_diagnostics()
+    statements = []
+    for chunk, records, failure in results:
+        for diagnostic in records:
+            diagnostics.report(diagnostic.severity, diagnostic.message, diagnostic.offset, diagnostic.code)
+        if failure is not None:
+            raise failure
+        statements.extend(chunk)
+    return statements
+
+
+# Checking
+# ========
+# The body of a top-level function only reads the globals declared
+# before it and writes its own local scope, so the bodies of different
+# functions can be checked independently.  check_parallel() does that in
+# two phases:
+#
+#  1. Here, in order: everything except function bodies is resolved and
+#     checked (global variables get their types and slots, functions are
+#     declared).
+#  2. Workers check the function bodies.  A task is a range of top-level
+#     statements: the worker rebuilds the global scope up to there and
+#     checks the bodies of the functions in the range.
+#
+# Sending the model to the workers and the annotations (type, mutable,
+# declaration, depth, slot) back costs more than checking it, so this
+# works on a FlatTree (see flat.py), where all of that is a handful of
+# arrays.  Each top-level statement is a contiguous range of node ids,
+# so the annotations of a task come back as one slice of each array and
+# are copied in with a slice assignment.  Both phases check with a
+# FlatChecker (see check.py), which works on the arrays.
+#
+# Diagnostics are reported at the end in program order, so they are the
+# same as check_program()'s.  That's also when max_errors applies, so it
+# doesn't save any work here.
+
+ANNOTATIONS = ('type', 'mutable', 'declaration', 'depth', 'slot')  # Arrays of a FlatTree
+
+FUNCTION_KIND = KIND_CODES[Function]
+GLOBAL_KINDS = {FUNCTION_KIND, KIND_CODES[Variable], KIND_CODES[Constant]}
+
+
+def declare_global(checker, id):
+    """ What checking a top-level statement does to the global scope, without checking it """
+    name = checker.value(id, 0)
+    if checker.kind[id] != FUNCTION_KIND or name not in checker.scope:
+        checker.bind(name, id)
+
+
+def is_function_body(tree, id):
+    """ Is the body of this top-level statement checked by a worker? """
+    return tree.kind[id] == FUNCTION_KIND and not tree.pool[tree.pool_index[id]][3]  # Not imported
+
+
+_tree = None  # The program being checked (in a worker process)
+
+
+def _init_check_worker(tree):
+    global _tree
+    _tree = tree
+
+
+def check_functions(start, stop):
+    """
+    Check the bodies of the functions in the top-level statements start to
+    stop of the tree given to the worker.  Returns the annotations of the
+    nodes of those statements (a slice of each array) and the diagnostics
+    of each function as (statement number, diagnostics).
+    """
+    tree = _tree
+    ids = tree.children(tree.root)
+    kinds = tree.kind
+    checker = FlatChecker(tree)
+    found = []
+    for n, id in enumerate(ids[:stop]):
+        if kinds[id] not in GLOBAL_KINDS:
+            continue  # Only declarations matter
+        declare_global(checker, id)
+        if n >= start and is_function_body(tree, id):
+            with errors.collecting(echo=False) as diagnostics:
+                checker.check_function_body(id)
+            found.append((n, diagnostics.records))
+    first = ids[start - 1] + 1 if start else 0
+    last = ids[stop - 1] + 1
+    return [getattr(tree, name)[first:last] for name in ANNOTATIONS], found
+
+
+def check_parallel(tree, workers=None):
+    """
+    Check a program (a FlatTree) like check_program(), with the bodies of
+    the top-level functions checked by a pool of worker processes
+    (os.cpu_count() by default).  Returns True if no errors were found.
+    """
+    workers = workers or os.cpu_count()
+    checker = FlatChecker(tree)
+    found = []      # The diagnostics of each top-level statement
+    functions = []  # Numbers of the statements whose bodies are left to the workers
+    with errors.collecting(echo=False) as diagnostics:
+        for n, id in enumerate(tree.children(tree.root)):
+            start = len(diagnostics.records)
+            if is_function_body(tree, id):
+                checker.declare_function(id)
+                functions.append(n)
+            else:
+                checker.check(id)
+            found.append(diagnostics.records[start:])
+
+    if functions:
+        size = -(-len(functions) // workers)  # A task per worker: each one rebuilds the globals up to its range
+        groups = [functions[i:i + size] for i in range(0, len(functions), size)]
+        tasks = [(group[0], group[-1] + 1) for group in groups]
+        ids = tree.children(tree.root)
+        with ProcessPoolExecutor(workers, initializer=_init_check_worker, initargs=(tree,)) as pool:
+            for (start, _), (columns, checked) in zip(tasks, pool.map(check_functions, *zip(*tasks))):
+                first = ids[start - 1] + 1 if start else 0
+                for name, column in zip(ANNOTATIONS, columns):
+                    getattr(tree, name)[first:first + len(column)] = column
+                for n, records in checked:
+                    found[n].extend(records)
+
+    diagnostics = errors.get_diagnostics()
+    errors_before = diagnostics.error_count
+    try:
+        for records in found:
+            for diagnostic in records:
+                diagnostics.report(diagnostic.severity, diagnostic.message, diagnostic.offset, diagnostic.code)
+    except TooManyErrors:
+        pass
+    return diagnostics.error_count == errors_before
@@ -66,7 +66,7 @@
 # addterm <- factor (('*' / '/') factor)*
 #
 # factor <- literal  
-#        / ('+' / '-' / '^') expression
+#        / ('+' / '-' / '!' / '^') factor
 #        / '(' expression ')'
 #        / type '(' expression ')'
 #        / ID '(' arguments ')'
@@ -79,12 +79,39 @@
 #
 # bool <- 'true' / 'false
 from time import sleep
+from types import SimpleNamespace
 
 from compilers.wabbit.check import Variable, Constant, While, Char, Bool
 from compilers.wabbit.errors import ParseError
+from compilers.wabbit.flat import FlatTree, LIST
 from compilers.wabbit.model import Assignment, BinaryOperator, Integer, Float, NamedLocation, Print, If, \
-    UnaryOperator, KNOWN_TYPES
-from compilers.wabbit.tokenizer import tokenize
+    UnaryOperator, KNOWN_TYPES, Break, Continue, Return, Function, FunctionParameter, FunctionCall, TypeCast, \
+    MemoryAddress
+from compilers.wabbit.tokenizer import tokenize, TOKEN_KINDS, KIND_CODES
+
+
+# Token kinds as bit masks: K.SEMI, K.PLUS | K.MINUS, ...  A set of token
+# kinds is a single int, so checking the look-ahead token against any set
+# of possibilities is a shift and an and (see Parser.peek).
+K = SimpleNamespace(**{kind: 1 << code for code, kind in enumerate(TOKEN_KINDS)})
+
+
+def kind_names(mask):
+    """ The token types in a mask (for error messages) """
+    return tuple(kind for code, kind in enumerate(TOKEN_KINDS) if mask >> code & 1)
+
+
+# FIRST sets: the kinds of token that can start each grammar rule.  The
+# rules test the look-ahead token against them before they dispatch on it.
+FIRST_PRIMARY = K.INT | K.FLOAT | K.CHAR | K.BOOL | K.NAME
+UNARY_OPERATORS = K.PLUS | K.MINUS | K.LNOT | K.GROW
+FIRST_FACTOR = FIRST_PRIMARY | UNARY_OPERATORS | K.LPAREN | K.DEREF
+FIRST_STATEMENT = K.PRINT | K.IF | K.WHILE | K.CONST | K.VAR | K.NAME | K.DEREF \
+    | K.FUNC | K.IMPORT | K.RETURN | K.BREAK | K.CONTINUE
+END_OF_BLOCK = K.EOF | K.RBRACE
+BLOCK_STATEMENTS = K.IF | K.WHILE
+DECLARATIONS = K.CONST | K.VAR | K.FUNC | K.IMPORT
+PREFIX_OPERATORS = FIRST_FACTOR & ~FIRST_PRIMARY  # What can come in front of a primary
 
 
 # Special EOF token
@@ -93,172 +120,424 @@ from compilers.wabbit.tokenizer import tokenize
 class EOF:
     type = 'EOF'
     value = 'EOF'
+    offset = None
+    kind = KIND_CODES['EOF']
+
+
+# Binding power of the binary operators (see expression ... addterm above).
+# Higher binds tighter. All of them are left associative.
+BINARY_PRECEDENCE = {
+    'LOR': 1,
+    'LAND': 2,
+    'LT': 3, 'LE': 3, 'GT': 3, 'GE': 3, 'EQ': 3, 'NE': 3,
+    'PLUS': 4, 'MINUS': 4,
+    'TIMES': 5, 'DIVIDE': 5,
+}
+
+# The same, indexed by token kind (0 for tokens that aren't binary operators)
+PRECEDENCE = [BINARY_PRECEDENCE.get(kind, 0) for kind in TOKEN_KINDS]
+
+# Token kind -> (model class, conversion of the token text)
+FACTOR_LITERALS = {
+    KIND_CODES['INT']: (Integer, int),
+    KIND_CODES['FLOAT']: (Float, float),
+    KIND_CODES['CHAR']: (Char, str),
+    KIND_CODES['BOOL']: (Bool, str),
+}
+
 
 class Parser:
     """
     Predictive (i.e. peek) Recursive Descent (i.e. recursive calls) Parser
     Also a LL1 Parser: Left to right, Left side first, 1 token ahead
     """
-    def __init__(self, tokens):
-        self.tokens = tokens    # An iterator that produces a stream of tokens
+    def __init__(self, tokens, interner=None):
+        self.tokens = iter(tokens)  # An iterator that produces a stream of tokens (or a TokenStream)
         self.next_token = None  # one token look-ahead
+        self.interner = interner  # Shares identical expressions if given (see hashcons.py)
 
-    def peek(self, *possible):
-        # Look ahead at the next token and return it if the type matches one or more possibilities
+    def peek(self, possible):
+        # Look ahead at the next token and return it if its kind is in the possible mask (K.NAME | ...)
         # Does not consume the token
-        if self.next_token is None:
-            self.next_token = next(self.tokens, EOF)
-
-        if self.next_token.type in possible:
-            return self.next_token
-        else:
-            return None
+        tok = self.next_token
+        if tok is None:
+            tok = self.next_token = next(self.tokens, EOF)
+        return tok if possible >> tok.kind & 1 else None
 
-    def expect(self, *possible):
+    def expect(self, possible):
         """ Like peek() but it also consumes the token. Think Pac-Man.  """
         # Return it and consume it
-        tok = self.peek(*possible)
-        if tok:
+        tok = self.next_token
+        if tok is None:
+            tok = next(self.tokens, EOF)
+        if possible >> tok.kind & 1:
             self.next_token = None
             return tok
-        else:
-            raise ParseError(f"Nope! Looking for {possible} but next token is {next(self.tokens)}")
+        self.next_token = tok
+        raise ParseError(f"Nope! Looking for {kind_names(possible)} but next token is {tok}", tok.offset)
+
+    def lookahead(self):
+        """ The next token, whatever it is. Does not consume it """
+        if self.next_token is None:
+            self.next_token = next(self.tokens, EOF)
+        return self.next_token
+
+    @staticmethod
+    def at(node, tok):
+        """ Record where in the source a node came from """
+        node.offset = tok.offset
+        return node
+
+    def expression(self, cls, tok, *args):
+        """ cls(*args) at tok, or the identical shared node if there is an interner """
+        if self.interner is not None:
+            return self.interner.make(cls, tok.offset, *args)
+        node = cls(*args)
+        node.offset = tok.offset
+        return node
 
     # Grammar:
     def parse_assignment(self):
-        """assignment := Name '= expr ';'"""
-        name = self.expect('NAME')
-        self.expect('ASSIGN')
+        """assignment := location '= expr ';'"""
+        location = self.parse_location()
+        self.expect(K.ASSIGN)
         expression = self.parse_expr()
-        self.expect('SEMI')
-        return Assignment(NamedLocation(name.value), expression)  # Data Model
+        self.expect(K.SEMI)
+        return self.at(Assignment(location, expression), location)  # Data Model
 
-    def parse_expr(self):
-        """expr := term {'+' | '-' term }"""
-        term = self.parse_term()
-        while self.peek('PLUS', 'MINUS', 'LT', 'GT', 'LE', 'GE'):
-            op = self.expect('PLUS', 'MINUS', 'LT', 'GT', 'LE', 'GE')
-            right_term = self.parse_term()
-            term = BinaryOperator(op.value, term, right_term)
-        return term
-
-    def parse_term(self):
-        """term := factor { '*', | '/' factor}"""
-        term = self.parse_factor()
-        while self.peek('TIMES', 'DIVIDE'):
-            op = self.expect('TIMES', 'DIVIDE')
-            right_term = self.parse_term()
-            term = BinaryOperator(op.value, term, right_term)
-        return term
+    # location := NAME | '`' factor
+    def parse_location(self):
+        tok = self.expect(K.NAME | K.DEREF)
+        if tok.kind == NAME_KIND:
+            return self.at(NamedLocation(tok.value), tok)
+        return self.at(MemoryAddress(self.parse_factor()), tok)
+
+    def parse_expr(self, min_precedence=1):
+        """
+        Precedence climbing.  Parse a factor, then keep folding in binary operators
+        that bind at least as tightly as min_precedence.  The right operand only
+        takes operators that bind tighter, so equal precedence associates to the
+        left and a chain like a*b*c*d is a loop, not a recursion.
+        """
+        left = self.parse_factor()
+        while True:
+            op = self.lookahead()
+            precedence = PRECEDENCE[op.kind]
+            if precedence < min_precedence:
+                return left
+            self.next_token = None
+            right = self.parse_expr(precedence + 1)
+            left = self.expression(BinaryOperator, op, op.value, left, right)
 
     def parse_factor(self):
-        # factor: INTEGER | FLOAT
-        if self.peek('INT'):
-            # Tokens only have strings. The .value attribute is the matched text.
-            # You might have to to run it into a proper integer for the model
-            return Integer(int(self.expect('INT').value))
-        elif self.peek('FLOAT'):
-            return Float(float(self.expect('FLOAT').value))
-        elif self.peek('CHAR'):
-            return Char(str(self.expect('CHAR').value))
-        elif self.peek('BOOL'):
-            return Bool(self.expect('BOOL').value)
-        elif self.peek('LPAREN'):
-            self.expect('LPAREN')
+        tok = self.lookahead()
+        kind = tok.kind
+        if FIRST_PRIMARY >> kind & 1:
+            return self.parse_primary()
+        if not FIRST_FACTOR >> kind & 1:
+            raise ParseError(f'Bad factor ... found {tok}', tok.offset)
+        self.next_token = None
+        if kind == LPAREN_KIND:
             expression = self.parse_expr()
-            self.expect('RPAREN')
+            self.expect(K.RPAREN)
             return expression
-        elif self.peek('MINUS', 'PLUS'):
-            op = self.expect('MINUS', 'PLUS')
-            expr = self.parse_expr()
-            return UnaryOperator(op.value, expr)
-        elif self.peek('NAME'):
-            expr = self.expect('NAME')
-            return NamedLocation(expr.value)
+        elif kind == DEREF_KIND:
+            return self.at(MemoryAddress(self.parse_factor()), tok)
         else:
-            raise ParseError('Bad factor ... reached the end but nothing found')
+            # Unary operators bind tighter than any binary operator: -a*b is (-a)*b
+            return self.expression(UnaryOperator, tok, tok.value, self.parse_factor())
+
+    def parse_primary(self):
+        """ The factors that don't contain other expressions """
+        tok = self.lookahead()
+        kind = tok.kind
+        if not FIRST_PRIMARY >> kind & 1:
+            raise ParseError(f'Bad factor ... found {tok}', tok.offset)
+        if kind == NAME_KIND:
+            self.next_token = None
+            if not self.peek(K.LPAREN):
+                return self.expression(NamedLocation, tok, tok.value)
+            self.next_token = None
+            args = self.parse_arguments()
+            # int(x) is a type-cast. Anything else that looks like a call is one.
+            if tok.value in KNOWN_TYPES and len(args) == 1:
+                return self.expression(TypeCast, tok, tok.value, args[0])
+            return self.at(FunctionCall(tok.value, args), tok)
+        else:
+            # Tokens only have strings. The .value attribute is the matched text.
+            # It gets turned into a proper value for the model here.
+            self.next_token = None
+            literal, convert = FACTOR_LITERALS[kind]
+            return self.expression(literal, tok, convert(tok.value))
+
+    # arguments ) -- the '(' has been consumed already
+    def parse_arguments(self):
+        args = []
+        while not self.peek(K.RPAREN):
+            if args:
+                self.expect(K.COMMA)
+            args.append(self.parse_expr())
+        self.expect(K.RPAREN)
+        return args
 
     # print expression ;
     def parse_print(self):
-        self.expect('PRINT')
+        tok = self.expect(K.PRINT)
         expr = self.parse_expr()
-        self.expect('SEMI')
-        return Print(expr)
+        self.expect(K.SEMI)
+        return self.at(Print(expr), tok)
 
     # if test {consequences } else {alternative}
     def parse_if(self):
-        self.expect('IF')
+        tok = self.expect(K.IF)
         test = self.parse_expr()
-        self.expect('LBRACE')
+        self.expect(K.LBRACE)
         consequence = self.parse_statements()
-        self.expect('RBRACE')
-        if self.peek('ELSE'):
-            self.expect('ELSE')
-            self.expect('LBRACE')
+        self.expect(K.RBRACE)
+        if self.peek(K.ELSE):
+            self.expect(K.ELSE)
+            self.expect(K.LBRACE)
             alternative = self.parse_statements()
-            self.expect('RBRACE')
+            self.expect(K.RBRACE)
         else:
             alternative = []
-        return If(test, consequence, alternative)
+        return self.at(If(test, consequence, alternative), tok)
 
     def parse_statements(self):
         statements = []
-        while not self.peek('EOF', 'RBRACE'):
-            stmt = self.parse_statement()
-            if stmt:
-                statements.append(stmt)
-            else:
-                break
+        while not self.peek(END_OF_BLOCK):
+            statements.append(self.parse_statement())
+        if self.interner is not None:
+            self.interner.new_region()  # Names declared in the block go out of scope (see hashcons.py)
         return statements
 
     # var declaration: (var | const) name [type] [= expr] ;
     def parse_var(self):
-        decl = self.expect('VAR', 'CONST').type
-        name = self.expect('NAME').value
-        if self.peek('NAME'):
+        tok = self.expect(K.VAR | K.CONST)
+        decl = tok.type
+        name = self.expect(K.NAME).value
+        if self.peek(K.NAME):
             type = self.parse_type()
         else:
             type = None
-        if self.peek('ASSIGN'):
-            self.expect('ASSIGN')
+        if self.peek(K.ASSIGN):
+            self.expect(K.ASSIGN)
             expr = self.parse_expr()
         else:
             expr = None
-        self.expect('SEMI')
+        self.expect(K.SEMI)
         if decl == 'VAR':
-            return Variable(name, expr, type)
+            return self.at(Variable(name, expr, type), tok)
         else:
-            return Constant(name, expr, type)
+            return self.at(Constant(name, expr, type), tok)
 
     # type declaration: (int | float | bool | char)
     def parse_type(self):
-        tok = self.expect('NAME')
+        tok = self.expect(K.NAME)
         if tok.value in KNOWN_TYPES:
             return tok.value
         else:
-            raise ParseError(f'Expected a type when parsing {tok}')
+            raise ParseError(f'Expected a type when parsing {tok}', tok.offset)
 
     def parse_statement(self):
-        if self.peek('PRINT'):
-            return self.parse_print()
-        elif self.peek('IF'):
-            return self.parse_if()
-        elif self.peek('WHILE'):
-            return self.parse_while()
-        elif self.peek('CONST', 'VAR'):
-            return self.parse_var()
-        elif self.peek('NAME'):
-            return self.parse_assignment()
-        else:
-            raise ParseError(f'parse_statement failed to handle {self.next_token}')
+        tok = self.lookahead()
+        if not FIRST_STATEMENT >> tok.kind & 1:
+            raise ParseError(f'parse_statement failed to handle {tok}', tok.offset)
+        rule = STATEMENT_RULES[tok.kind]
+        if self.interner is None:
+            return rule(self)
+        statement = rule(self)
+        if DECLARATIONS >> tok.kind & 1:
+            self.interner.new_region()
+        return statement
 
     def parse_while(self):
-        self.expect('WHILE')
+        tok = self.expect(K.WHILE)
         test = self.parse_expr()
-        self.expect('LBRACE')
+        self.expect(K.LBRACE)
         consequence = self.parse_statements()
-        self.expect('RBRACE')
-        return While(test, consequence)
+        self.expect(K.RBRACE)
+        return self.at(While(test, consequence), tok)
+
+    # break ; | continue ;
+    def parse_break(self):
+        tok = self.expect(K.BREAK | K.CONTINUE)
+        self.expect(K.SEMI)
+        return self.at(Break() if tok.kind == BREAK_KIND else Continue(), tok)
+
+    # return expression ;
+    def parse_return(self):
+        tok = self.expect(K.RETURN)
+        value = self.parse_expr()
+        self.expect(K.SEMI)
+        return self.at(Return(value), tok)
+
+    # func name(parameters) type { statements }  |  import func name(parameters) type ;
+    def parse_func(self):
+        tok = self.expect(K.FUNC | K.IMPORT)
+        imported = tok.kind == IMPORT_KIND
+        if imported:
+            self.expect(K.FUNC)
+        name = self.expect(K.NAME).value
+        self.expect(K.LPAREN)
+        parameters = []
+        while not self.peek(K.RPAREN):
+            if parameters:
+                self.expect(K.COMMA)
+            param = self.expect(K.NAME)
+            parameters.append(self.at(FunctionParameter(param.value, self.parse_type()), param))
+        self.expect(K.RPAREN)
+        if self.interner is not None:
+            self.interner.new_region()  # Names in the body can be parameters
+        return_type = self.parse_type()
+        if imported:
+            self.expect(K.SEMI)
+            return self.at(Function(name, parameters, return_type, [], imported=True), tok)
+        self.expect(K.LBRACE)
+        statements = self.parse_statements()
+        self.expect(K.RBRACE)
+        return self.at(Function(name, parameters, return_type, statements), tok)
+
+
+# Which rule parses a statement, indexed by the kind of its first token (one of FIRST_STATEMENT)
+STATEMENT_RULES = [None] * len(TOKEN_KINDS)
+STATEMENT_RULES[KIND_CODES['PRINT']] = Parser.parse_print
+STATEMENT_RULES[KIND_CODES['IF']] = Parser.parse_if
+STATEMENT_RULES[KIND_CODES['WHILE']] = Parser.parse_while
+STATEMENT_RULES[KIND_CODES['CONST']] = Parser.parse_var
+STATEMENT_RULES[KIND_CODES['VAR']] = Parser.parse_var
+STATEMENT_RULES[KIND_CODES['NAME']] = Parser.parse_assignment
+STATEMENT_RULES[KIND_CODES['DEREF']] = Parser.parse_assignment
+STATEMENT_RULES[KIND_CODES['BREAK']] = Parser.parse_break
+STATEMENT_RULES[KIND_CODES['CONTINUE']] = Parser.parse_break
+STATEMENT_RULES[KIND_CODES['RETURN']] = Parser.parse_return
+STATEMENT_RULES[KIND_CODES['FUNC']] = Parser.parse_func
+STATEMENT_RULES[KIND_CODES['IMPORT']] = Parser.parse_func
+
+NAME_KIND, LPAREN_KIND, RPAREN_KIND = KIND_CODES['NAME'], KIND_CODES['LPAREN'], KIND_CODES['RPAREN']
+DEREF_KIND, BREAK_KIND, IMPORT_KIND = KIND_CODES['DEREF'], KIND_CODES['BREAK'], KIND_CODES['IMPORT']
+
+
+class StackParser(Parser):
+    """
+    Parser that keeps its own stack instead of recursing, so there is no
+    limit (other than memory) on how deeply blocks and parentheses nest.
+    Builds exactly the same model as Parser.  (Function bodies and the
+    arguments of calls are still parsed by a recursive call, so it's only
+    calls nested inside calls that use up the Python stack.)
+    """
+    def parse_statements(self):
+        statements = []  # Statements of the innermost open block
+        blocks = []      # Enclosing blocks: (kind, first token, test, consequence, statements)
+        while True:
+            tok = self.lookahead()
+            if BLOCK_STATEMENTS >> tok.kind & 1:
+                self.next_token = None
+                test = self.parse_expr()
+                self.expect(K.LBRACE)
+                blocks.append((tok.type, tok, test, None, statements))
+                statements = []
+            elif END_OF_BLOCK >> tok.kind & 1:
+                if not blocks:
+                    return statements
+                self.expect(K.RBRACE)
+                if self.interner is not None:
+                    self.interner.new_region()
+                block, start, test, consequence, outer = blocks.pop()
+                if block == 'IF' and self.peek(K.ELSE):
+                    self.expect(K.ELSE)
+                    self.expect(K.LBRACE)
+                    blocks.append(('ELSE', start, test, statements, outer))
+                    statements = []
+                    continue
+                elif block == 'IF':
+                    node = If(test, statements, [])
+                elif block == 'ELSE':
+                    node = If(test, consequence, statements)
+                else:
+                    node = While(test, statements)
+                statements = outer
+                statements.append(self.at(node, start))
+            else:
+                statements.append(self.parse_statement())
+
+    def parse_expr(self):
+        """ Precedence climbing done with an operand and an operator stack (shunting-yard) """
+        operands = []
+        operators = []  # (precedence, token). Unary operators and '(' use the markers below
+        open_parens = 0
+        while True:
+            # Prefix part: unary operators and '(' in front of an operand
+            tok = self.lookahead()
+            while PREFIX_OPERATORS >> tok.kind & 1:
+                self.next_token = None
+                if tok.kind == LPAREN_KIND:
+                    operators.append((_PAREN, tok))
+                    open_parens += 1
+                else:
+                    operators.append((_UNARY, tok))
+                tok = self.lookahead()
+            operands.append(self._apply_unary(self.parse_primary(), operators))
+
+            # Infix part: closing parentheses, then a binary operator or the end
+            while True:
+                op = self.lookahead()
+                precedence = PRECEDENCE[op.kind]
+                if precedence:
+                    self._reduce(operands, operators, precedence)
+                    self.next_token = None
+                    operators.append((precedence, op))
+                    break
+                elif op.kind == RPAREN_KIND and open_parens:
+                    self._reduce(operands, operators, 1)
+                    self.next_token = None
+                    operators.pop()
+                    open_parens -= 1
+                    operands.append(self._apply_unary(operands.pop(), operators))
+                else:
+                    if open_parens:
+                        self.expect(K.RPAREN)  # Raises the same error as Parser does
+                    self._reduce(operands, operators, 1)
+                    return operands.pop()
+
+    def _apply_unary(self, operand, operators):
+        while operators and operators[-1][0] == _UNARY:
+            tok = operators.pop()[1]
+            if tok.kind == DEREF_KIND:
+                operand = self.at(MemoryAddress(operand), tok)
+            else:
+                operand = self.expression(UnaryOperator, tok, tok.value, operand)
+        return operand
+
+    def _reduce(self, operands, operators, precedence):
+        """ Fold in the stacked binary operators that bind at least as tight as precedence """
+        while operators and operators[-1][0] >= precedence:
+            op = operators.pop()[1]
+            right = operands.pop()
+            left = operands.pop()
+            operands.append(self.expression(BinaryOperator, op, op.value, left, right))
+
+
+# Operator stack markers for StackParser. Both are below every binary precedence
+# so _reduce() stops at them.
+_PAREN = -1
+_UNARY = -2
+
+
+def parse_flat(tokens, parser_class=Parser):
+    """
+    Parse a program straight into a FlatTree (see flat.py).  Each top-level
+    statement is flattened as soon as it has been parsed, so only one of
+    them exists as model objects at any time.
+    """
+    parser = parser_class(tokens)
+    tree = FlatTree()
+    statements = []
+    while not parser.peek(END_OF_BLOCK):
+        statements.append(tree.append(parser.parse_statement()))
+    tree.root = tree.add(LIST, statements)
+    tree.done()
+    return tree
 
 
 if __name__ == '__main__':
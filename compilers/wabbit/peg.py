@@ -0,0 +1,449 @@
+# peg.py
+#
+# A PEG (Parsing Expression Grammar) engine.  Instead of hand writing a
+# method per grammar rule (see parse.py), the grammar is given as text in
+# the same notation used at the top of parse.py and is run directly:
+#
+#    'quoted'   : A token with exactly that text
+#    UPPERCASE  : A token of that type (NAME, INT, FLOAT, CHAR, BOOL, EOF)
+#    lowercase  : Another rule
+#    ( ... )    : Grouping
+#      e?       : Optional (0 or 1 matches of e)
+#      e*       : Repetition (0 or more matches of e)
+#      e+       : Repetition (1 or more matches)
+#     &e, !e    : Lookahead. Succeeds if e matches (doesn't match). Consumes nothing
+#     e1 e2     : Match e1 then match e2 (sequence)
+#    e1 / e2    : Try to match e1. On failure, try to match e2.
+#
+# A PEG parser backtracks: when an alternative fails, the next one is
+# tried from the same position.  Without care that's exponential in the
+# worst case.  This is a "packrat" parser: the result of every rule at
+# every position is remembered (memoized), so no rule is ever run twice
+# at the same position and parsing stays linear.  The memo table holds
+# at most max_memo entries; when it's full, the oldest half (entries for
+# positions far behind the current one) is thrown away.
+#
+# Each rule can have an action, a function that turns what the rule
+# matched into a value (for Wabbit, model nodes).  What gets passed to
+# the action:
+#
+#    'quoted', TOKEN  -> the token
+#    e1 e2 ...        -> a list of the values of e1, e2, ...
+#    e*, e+           -> a list of the values of each e
+#    e?               -> the value of e, or None
+#    e1 / e2          -> the value of the alternative that matched
+#
+# Rules without an action produce the value of their expression.
+import re
+from itertools import islice
+
+from compilers.wabbit.errors import ParseError
+from compilers.wabbit.model import *
+from compilers.wabbit.parse import EOF
+
+WABBIT_GRAMMAR = r"""
+program       <- statement* EOF
+
+statement     <- assignment / vardecl / funcdecl / if_else / if_stmt / while_stmt
+               / break_stmt / continue_stmt / return_stmt / print_stmt
+
+assignment    <- location '=' expression ';'
+vardecl       <- ('var' / 'const') NAME type? ('=' expression)? ';'
+funcdecl      <- 'import' 'func' NAME '(' parameters ')' type ';'
+               / 'func' NAME '(' parameters ')' type block
+if_else       <- 'if' expression block 'else' block
+if_stmt       <- 'if' expression block
+while_stmt    <- 'while' expression block
+block         <- '{' statement* '}'
+break_stmt    <- 'break' ';'
+continue_stmt <- 'continue' ';'
+return_stmt   <- 'return' expression ';'
+print_stmt    <- 'print' expression ';'
+
+parameters    <- (parameter (',' parameter)*)?
+parameter     <- NAME type
+type          <- 'int' / 'float' / 'char' / 'bool'
+
+location      <- NAME !'(' / address
+address       <- '`' factor
+
+expression    <- orterm ('||' orterm)*
+orterm        <- andterm ('&&' andterm)*
+andterm       <- relterm (('<' / '>' / '<=' / '>=' / '==' / '!=') relterm)*
+relterm       <- addterm (('+' / '-') addterm)*
+addterm       <- factor (('*' / '/') factor)*
+
+factor        <- literal / unary / group / typecast / call / location
+unary         <- ('+' / '-' / '!' / '^') factor
+group         <- '(' expression ')'
+typecast      <- type '(' expression ')'
+call          <- NAME '(' arguments ')'
+arguments     <- (expression (',' expression)*)?
+
+literal       <- INT / FLOAT / CHAR / BOOL
+"""
+
+GRAMMAR_TOKEN_REGEX = re.compile(r"""
+      (?P<SPACE>\s+)
+    | (?P<ARROW><-)
+    | (?P<QUOTED>'[^']*')
+    | (?P<RULE>[a-z_][a-z_0-9]*)
+    | (?P<TOKEN>[A-Z_][A-Z_0-9]*)
+    | (?P<OP>[/()*+?&!])
+    """, re.VERBOSE)
+
+MAX_MEMO = 1_000_000
+
+
+# Grammar expressions
+# ===================
+
+class Quoted:
+    def __init__(self, text):
+        self.text = text
+
+
+class TokenType:
+    def __init__(self, type):
+        self.type = type
+
+
+class RuleRef:
+    def __init__(self, name):
+        self.name = name
+
+
+class Sequence:
+    def __init__(self, items):
+        self.items = items
+
+
+class Choice:
+    def __init__(self, alternatives):
+        self.alternatives = alternatives
+
+
+class Repeat:
+    def __init__(self, item, minimum):
+        self.item = item
+        self.minimum = minimum
+
+
+class Optional:
+    def __init__(self, item):
+        self.item = item
+
+
+class Lookahead:
+    def __init__(self, item, positive):
+        self.item = item
+        self.positive = positive
+
+
+def parse_grammar(text):
+    """ Turn grammar text into a dict of {rule name: expression}. The first rule is the start rule """
+    tokens = []
+    index = 0
+    while index < len(text):
+        m = GRAMMAR_TOKEN_REGEX.match(text, index)
+        if m is None:
+            raise SyntaxError(f'Bad character {text[index]!r} in grammar')
+        if m.lastgroup != 'SPACE':
+            tokens.append((m.lastgroup, m.group()))
+        index = m.end()
+    tokens.append(('END', ''))
+    pos = 0
+
+    def peek(*values):
+        kind, value = tokens[pos]
+        return value in values or kind in values
+
+    def take():
+        nonlocal pos
+        pos += 1
+        return tokens[pos - 1]
+
+    def choice():
+        alternatives = [sequence()]
+        while peek('/'):
+            take()
+            alternatives.append(sequence())
+        return alternatives[0] if len(alternatives) == 1 else Choice(alternatives)
+
+    def sequence():
+        items = []
+        # A rule name followed by '<-' starts the next rule
+        while not peek('/', ')', 'END') and not (peek('RULE') and tokens[pos + 1][0] == 'ARROW'):
+            items.append(prefixed())
+        return items[0] if len(items) == 1 else Sequence(items)
+
+    def prefixed():
+        if peek('&', '!'):
+            positive = take()[1] == '&'
+            return Lookahead(suffixed(), positive)
+        return suffixed()
+
+    def suffixed():
+        item = primary()
+        while peek('*', '+', '?'):
+            op = take()[1]
+            item = Optional(item) if op == '?' else Repeat(item, 0 if op == '*' else 1)
+        return item
+
+    def primary():
+        kind, value = take()
+        if kind == 'QUOTED':
+            return Quoted(value[1:-1])
+        elif kind == 'TOKEN':
+            return TokenType(value)
+        elif kind == 'RULE':
+            return RuleRef(value)
+        elif value == '(':
+            item = choice()
+            if take()[1] != ')':
+                raise SyntaxError("Expected ')' in grammar")
+            return item
+        raise SyntaxError(f'Unexpected {value!r} in grammar')
+
+    rules = {}
+    while not peek('END'):
+        kind, name = take()
+        if kind != 'RULE' or take()[0] != 'ARROW':
+            raise SyntaxError(f'Expected a rule definition at {name!r}')
+        rules[name] = choice()
+    return rules
+
+
+# The engine
+# ==========
+
+class PEGParser:
+    def __init__(self, grammar, actions=None, max_memo=MAX_MEMO):
+        self.rules = parse_grammar(grammar)
+        self.start = next(iter(self.rules))
+        self.actions = actions or {}
+        self.max_memo = max_memo
+        self.rule_index = {name: n for n, name in enumerate(self.rules)}
+        self.bodies = []  # Filled in after compiling so rules can refer to each other
+        self.bodies.extend(self.compile(expr) for expr in self.rules.values())
+
+    def parse(self, tokens, rule=None):
+        """ Match rule (the first rule of the grammar by default) against the tokens """
+        self.tokens = list(tokens)
+        self.tokens.append(EOF)
+        self.memo = {}
+        self.furthest = 0
+        self.expected = set()
+        result = self.compile(RuleRef(rule or self.start))(0)
+        tok = self.tokens[self.furthest]
+        del self.tokens, self.memo
+        if result is None:
+            raise ParseError(f"Syntax error at {tok}. Expected one of {', '.join(sorted(self.expected))}",
+                             tok.offset)
+        return result[1]
+
+    def fail(self, pos, expected):
+        """ Remember the furthest point reached for error messages """
+        if pos > self.furthest:
+            self.furthest = pos
+            self.expected = {expected}
+        elif pos == self.furthest:
+            self.expected.add(expected)
+
+    def evict(self):
+        """ Throw away the oldest half of the memo table """
+        memo = self.memo
+        for key in list(islice(memo, len(memo) // 2)):
+            del memo[key]
+
+    def compile(self, expr):
+        """ Turn a grammar expression into a function match(pos) -> (new pos, value) or None """
+        return getattr(self, f'compile_{type(expr).__name__}')(expr)
+
+    def compile_Quoted(self, expr):
+        text = expr.text
+        expected = repr(text)
+
+        def match(pos):
+            tok = self.tokens[pos]
+            if tok.value == text and tok.type != 'CHAR':
+                return pos + 1, tok
+            self.fail(pos, expected)
+            return None
+        return match
+
+    def compile_TokenType(self, expr):
+        type = expr.type
+
+        def match(pos):
+            tok = self.tokens[pos]
+            if tok.type == type:
+                return pos + 1, tok
+            self.fail(pos, type)
+            return None
+        return match
+
+    def compile_RuleRef(self, expr):
+        if expr.name not in self.rule_index:
+            raise SyntaxError(f'Undefined rule {expr.name}')
+        index = self.rule_index[expr.name]
+        nrules = len(self.rules)
+        bodies = self.bodies
+        action = self.actions.get(expr.name)
+
+        def match(pos):
+            key = pos * nrules + index
+            memo = self.memo
+            if key in memo:
+                return memo[key]
+            result = bodies[index](pos)
+            if result is not None and action is not None:
+                result = (result[0], action(result[1], self.tokens[pos]))
+            if len(memo) >= self.max_memo:
+                self.evict()
+            memo[key] = result
+            return result
+        return match
+
+    def compile_Sequence(self, expr):
+        items = [self.compile(item) for item in expr.items]
+
+        def match(pos):
+            values = []
+            for item in items:
+                result = item(pos)
+                if result is None:
+                    return None
+                pos, value = result
+                values.append(value)
+            return pos, values
+        return match
+
+    def compile_Choice(self, expr):
+        alternatives = [self.compile(alt) for alt in expr.alternatives]
+
+        def match(pos):
+            for alternative in alternatives:
+                result = alternative(pos)
+                if result is not None:
+                    return result
+            return None
+        return match
+
+    def compile_Repeat(self, expr):
+        item = self.compile(expr.item)
+        minimum = expr.minimum
+
+        def match(pos):
+            values = []
+            while (result := item(pos)) is not None:
+                pos, value = result
+                values.append(value)
+            return (pos, values) if len(values) >= minimum else None
+        return match
+
+    def compile_Optional(self, expr):
+        item = self.compile(expr.item)
+
+        def match(pos):
+            result = item(pos)
+            return result if result is not None else (pos, None)
+        return match
+
+    def compile_Lookahead(self, expr):
+        item = self.compile(expr.item)
+        positive = expr.positive
+
+        def match(pos):
+            return (pos, None) if (item(pos) is not None) == positive else None
+        return match
+
+
+# Actions that build the Wabbit model
+# ===================================
+
+def at(node, tok):
+    node.offset = tok.offset
+    return node
+
+
+def binary_chain(value, tok):
+    left, rest = value
+    for op, right in rest:
+        left = at(BinaryOperator(op.value, left, right), op)
+    return left
+
+
+def separated_list(value, tok):
+    """ (item (',' item)*)? """
+    if value is None:
+        return []
+    first, rest = value
+    return [first] + [item for _, item in rest]
+
+
+def vardecl(value, tok):
+    decl, name, type, init, _ = value
+    expr = init[1] if init else None
+    if decl.value == 'var':
+        return at(Variable(name.value, expr, type), tok)
+    else:
+        return at(Constant(name.value, expr, type), tok)
+
+
+def funcdecl(value, tok):
+    if value[0].value == 'import':
+        _, _, name, _, parameters, _, return_type, _ = value
+        return at(Function(name.value, parameters, return_type, [], imported=True), tok)
+    _, name, _, parameters, _, return_type, statements = value
+    return at(Function(name.value, parameters, return_type, statements), tok)
+
+
+def location(value, tok):
+    if isinstance(value, list):
+        return at(NamedLocation(value[0].value), tok)
+    return value
+
+
+LITERALS = {
+    'INT': lambda text: Integer(int(text)),
+    'FLOAT': lambda text: Float(float(text)),
+    'CHAR': Char,
+    'BOOL': Bool,
+}
+
+WABBIT_ACTIONS = {
+    'program': lambda v, tok: v[0],
+    'assignment': lambda v, tok: at(Assignment(v[0], v[2]), tok),
+    'vardecl': vardecl,
+    'funcdecl': funcdecl,
+    'if_else': lambda v, tok: at(If(v[1], v[2], v[4]), tok),
+    'if_stmt': lambda v, tok: at(If(v[1], v[2], []), tok),
+    'while_stmt': lambda v, tok: at(While(v[1], v[2]), tok),
+    'block': lambda v, tok: v[1],
+    'break_stmt': lambda v, tok: at(Break(), tok),
+    'continue_stmt': lambda v, tok: at(Continue(), tok),
+    'return_stmt': lambda v, tok: at(Return(v[1]), tok),
+    'print_stmt': lambda v, tok: at(Print(v[1]), tok),
+    'parameters': separated_list,
+    'parameter': lambda v, tok: at(FunctionParameter(v[0].value, v[1]), tok),
+    'type': lambda v, tok: v.value,
+    'location': location,
+    'address': lambda v, tok: at(MemoryAddress(v[1]), tok),
+    'expression': binary_chain,
+    'orterm': binary_chain,
+    'andterm': binary_chain,
+    'relterm': binary_chain,
+    'addterm': binary_chain,
+    'unary': lambda v, tok: at(UnaryOperator(v[0].value, v[1]), tok),
+    'group': lambda v, tok: v[1],
+    'typecast': lambda v, tok: at(TypeCast(v[0], v[2]), tok),
+    'call': lambda v, tok: at(FunctionCall(v[0].value, v[2]), tok),
+    'arguments': separated_list,
+    'literal': lambda v, tok: at(LITERALS[tok.type](tok.value), tok),
+}
+
+
+def parse_program(tokens, max_memo=MAX_MEMO):
+    """ Parse a whole Wabbit program with the PEG engine. Returns a list of statements """
+    return PEGParser(WABBIT_GRAMMAR, WABBIT_ACTIONS, max_memo).parse(tokens)
@@ -0,0 +1,175 @@
+# resolve.py
+#
+# Name resolution.  Every name (NamedLocation) is bound to its
+# declaration once, before checking, and every variable, constant and
+# function parameter gets a place to live:
+#
+#     depth   GLOBAL (declared outside of any function) or LOCAL
+#     slot    index into the frame for that depth
+#
+# There is one global frame and one frame per function.  Each
+# declaration gets the next slot of its frame, including declarations
+# in nested blocks (slots aren't reused when a block ends, so a frame is
+# never more than the number of declarations in it).  A name gets the
+# depth and slot of its declaration, so later passes (ircode.py, the
+# backends) can keep variables in arrays and index them instead of
+# looking names up in dicts.
+#
+# The scoping rules are the ones check.py uses: a block or a function
+# body opens a new scope, a variable can be used in its own initial
+# value only if it refers to an outer declaration, and a later
+# duplicate declaration replaces the earlier one.  Names that aren't
+# declared are left unbound, check.py reports them.
+#
+# Scopes aren't a ChainMap (where finding a name costs more the deeper
+# the blocks are nested).  There is a single dict of what each name
+# means at this point, and each scope remembers what the names it
+# declares meant outside of it, to put them back when it ends.
+from compilers.wabbit.visitor import Visitor
+
+GLOBAL = 0
+LOCAL = 1
+
+
+class Frame:
+    __slots__ = ('depth', 'size')
+
+    def __init__(self, depth):
+        self.depth = depth
+        self.size = 0  # Slots used so far
+
+
+class Resolver(Visitor):
+    prefix = 'resolve_'  # resolve(node) calls resolve_<class name>, see visitor.py
+
+    def __init__(self):
+        self.names = {}  # name -> the declaration it refers to here
+        self.scope = {}  # Names declared in the innermost scope -> what they referred to outside of it
+        self.frame = self.globals = Frame(GLOBAL)
+
+    resolve = Visitor.visit
+
+    def bind(self, name, node):
+        if name not in self.scope:
+            self.scope[name] = self.names.get(name)
+        self.names[name] = node
+
+    def declare(self, node):
+        node.depth = self.frame.depth
+        node.slot = self.frame.size
+        self.frame.size += 1
+        self.bind(node.name, node)
+
+    def lookup(self, name):
+        return self.names.get(name)
+
+    def enter_scope(self):
+        outer = self.scope
+        self.scope = {}
+        return outer
+
+    def leave_scope(self, outer):
+        for name, previous in self.scope.items():
+            if previous is None:
+                del self.names[name]
+            else:
+                self.names[name] = previous
+        self.scope = outer
+
+    def in_scope(self, statements):
+        """ Resolve a block in a new scope """
+        outer = self.enter_scope()
+        self.resolve(statements)
+        self.leave_scope(outer)
+
+    def resolve_list(self, node):
+        for item in node:
+            self.resolve(item)
+
+    def resolve_object(self, node):
+        pass  # Nothing in here has a name (literals, break, None, ...)
+
+    # Definitions
+
+    def resolve_Variable(self, node):
+        self.resolve(node.value)
+        self.declare(node)
+
+    resolve_Constant = resolve_Variable
+
+    def resolve_FunctionParameter(self, node):
+        self.declare(node)
+
+    def resolve_Function(self, node):
+        self.declare_function(node)
+        self.resolve_function_body(node)
+
+    def declare_function(self, node):
+        if node.name not in self.scope:  # A duplicate doesn't replace the first one (like in check.py)
+            self.bind(node.name, node)
+
+    def resolve_function_body(self, node):
+        outer_frame = self.frame
+        self.frame = Frame(LOCAL)
+        outer = self.enter_scope()
+        self.resolve(node.parameters)
+        self.resolve(node.statements)
+        self.leave_scope(outer)
+        self.frame = outer_frame
+
+    # Statements
+
+    def resolve_Assignment(self, node):
+        self.resolve(node.location)
+        self.resolve(node.expression)
+
+    def resolve_Print(self, node):
+        self.resolve(node.expression)
+
+    def resolve_If(self, node):
+        self.resolve(node.test)
+        self.in_scope(node.consequence)
+        self.in_scope(node.alternative)
+
+    def resolve_While(self, node):
+        self.resolve(node.test)
+        self.in_scope(node.consequence)
+
+    def resolve_Return(self, node):
+        self.resolve(node.value)
+
+    # Expressions
+
+    def resolve_NamedLocation(self, node):
+        declaration = node.declaration = self.lookup(node.name)  # May be resolved again, see IncrementalChecker
+        if declaration is not None:
+            node.depth = declaration.depth  # None for functions
+            node.slot = declaration.slot
+        else:
+            node.depth = node.slot = None
+
+    def resolve_MemoryAddress(self, node):
+        self.resolve(node.address)
+
+    def resolve_BinaryOperator(self, node):
+        self.resolve(node.left)
+        self.resolve(node.right)
+
+    def resolve_UnaryOperator(self, node):
+        self.resolve(node.operand)
+
+    def resolve_TypeCast(self, node):
+        self.resolve(node.value)
+
+    def resolve_FunctionCall(self, node):
+        self.resolve(node.args)
+
+    def resolve_Fetch(self, node):
+        self.resolve(node.location)
+
+
+def resolve_program(statements):
+    """ Bind the names in a program to their declarations.  Returns the number of global slots """
+    resolver = Resolver()
+    resolver.resolve(statements)
+    return resolver.globals.size
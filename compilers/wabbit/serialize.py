@@ -0,0 +1,272 @@
+# serialize.py
+#
+# Saving a (checked) model to bytes and loading it back, so a compile
+# cache can skip tokenizing, parsing and checking.  Everything is kept:
+# the offsets, the checker's annotations (type, mutable), the declaration
+# each name was resolved to, and nodes that are shared (see hashcons.py)
+# stay shared.
+#
+# The format is made of unsigned LEB128 varints (7 bits per byte, the
+# high bit set on all but the last byte):
+#
+#     MAGIC  version  schema  strings  value  declarations
+#
+#  - schema is a checksum of the model classes and their fields.  A file
+#    written for a different model is rejected instead of misread.
+#  - strings is a count followed by (length, utf-8 bytes) for each
+#    string.  Strings in values are an index into this table, so every
+#    name and operator is stored once.
+#  - value is the list of statements.  Each value starts with a tag
+#    (a varint like everything else, but all of them fit in one byte):
+#
+#        NONE, FALSE, TRUE
+#        INT n          (zig-zag encoded, so small negatives are small)
+#        FLOAT          (8 bytes, little endian double)
+#        STR index
+#        LIST count value*
+#        REF index      (a node that was already written, by number)
+#        NODE + kind    followed by the values of the class's _fields
+#
+#    Nodes are numbered in the order they are written.  Writing and
+#    reading keep what is left to do of the nodes and lists they are in
+#    the middle of on a stack instead of recursing, so a model as deeply
+#    nested as StackParser (parse.py) can make is fine.
+#  - declarations is a count followed by (node, declaration) pairs of
+#    node numbers.  They come at the end because a name can be resolved
+#    to a declaration that is written after it.
+import struct
+import zlib
+from itertools import repeat
+
+from compilers.wabbit.flat import KINDS
+from compilers.wabbit.model import Node
+from compilers.wabbit.typesys import intern_type
+
+MAGIC = b'WBAST'
+VERSION = 1
+
+NONE, FALSE, TRUE, INT, FLOAT, STR, LIST, REF, NODE = range(9)
+
+CLASSES = KINDS[1:]  # Numbered like in flat.py, but lists aren't nodes here
+KIND_CODES = {cls: code for code, cls in enumerate(CLASSES)}
+
+# The fields written for each class (the declaration goes at the end, see above)
+FIELDS = [tuple(name for name in cls._fields if name != 'declaration') for cls in CLASSES]
+
+SCHEMA = zlib.crc32(repr([(cls.__name__, cls._fields) for cls in CLASSES]).encode())
+
+DOUBLE = struct.Struct('<d')
+
+
+def write_varint(out, n):
+    while n > 0x7f:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+class Writer:
+    def __init__(self):
+        self.out = bytearray()
+        self.strings = {}       # string -> index in the table
+        self.numbers = {}       # id(node) -> number
+        self.nodes = []         # Keeps the nodes alive while their ids are in numbers
+        self.declarations = []  # (node number, declaration node)
+
+    def value(self, value):
+        out = self.out
+        numbers = self.numbers
+        strings = self.strings
+        work = [iter((value,))]  # The values left to write of each node and list being written
+        while work:
+            for value in work[-1]:
+                if value.__class__ is int:
+                    out.append(INT)
+                    write_varint(out, value << 1 if value >= 0 else (-value << 1) - 1)
+                elif value is None:
+                    out.append(NONE)
+                elif value is True or value is False:
+                    out.append(TRUE if value else FALSE)
+                elif isinstance(value, str):
+                    index = strings.get(value)
+                    if index is None:
+                        index = strings[value] = len(strings)
+                    out.append(STR)
+                    write_varint(out, index)
+                elif isinstance(value, Node):
+                    number = numbers.get(id(value))
+                    if number is not None:
+                        out.append(REF)
+                        write_varint(out, number)
+                        continue
+                    numbers[id(value)] = number = len(self.nodes)
+                    self.nodes.append(value)
+                    kind = KIND_CODES[type(value)]
+                    out.append(NODE + kind)
+                    declaration = getattr(value, 'declaration', None)
+                    if declaration is not None:
+                        self.declarations.append((number, declaration))
+                    work.append(map(getattr, repeat(value), FIELDS[kind], repeat(None)))
+                    break  # Its fields come next
+                elif isinstance(value, list):
+                    out.append(LIST)
+                    write_varint(out, len(value))
+                    work.append(iter(value))
+                    break
+                elif isinstance(value, int):
+                    out.append(INT)
+                    write_varint(out, value << 1 if value >= 0 else (-value << 1) - 1)
+                elif isinstance(value, float):
+                    out.append(FLOAT)
+                    out += DOUBLE.pack(value)
+                else:
+                    raise ValueError(f"Can't serialize {value!r}")
+            else:
+                work.pop()  # All written
+
+    def getvalue(self):
+        out = bytearray(MAGIC)
+        write_varint(out, VERSION)
+        write_varint(out, SCHEMA)
+        write_varint(out, len(self.strings))
+        for string in self.strings:
+            data = string.encode('utf-8')
+            write_varint(out, len(data))
+            out += data
+        out += self.out
+        declarations = [(number, self.numbers[id(declaration)]) for number, declaration in self.declarations
+                        if id(declaration) in self.numbers]
+        write_varint(out, len(declarations))
+        for number, declaration in declarations:
+            write_varint(out, number)
+            write_varint(out, declaration)
+        return bytes(out)
+
+
+class Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.strings = []
+        self.nodes = []
+
+    def varint(self):
+        data = self.data
+        pos = self.pos
+        byte = data[pos]
+        pos += 1
+        if byte < 0x80:
+            self.pos = pos
+            return byte
+        n = byte & 0x7f
+        shift = 7
+        while True:
+            byte = data[pos]
+            pos += 1
+            n |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                self.pos = pos
+                return n
+            shift += 7
+
+    def value(self):
+        data = self.data
+        nodes = self.nodes
+        varint = self.varint
+        outer = []  # (container, fields, index) of the nodes and lists around the one being read
+        container = None  # The node or list being read: fields are a node's field names and index the next
+        fields = index = None  # one, or the length of a list and None
+        while True:
+            tag = data[self.pos]  # A one byte varint
+            self.pos += 1
+            if tag >= NODE:
+                kind = tag - NODE
+                cls = CLASSES[kind]
+                value = cls.__new__(cls)
+                nodes.append(value)
+                if FIELDS[kind]:
+                    outer.append((container, fields, index))
+                    container, fields, index = value, FIELDS[kind], 0
+                    continue
+            elif tag == STR:
+                value = self.strings[varint()]
+            elif tag == LIST:
+                value = []
+                length = varint()
+                if length:
+                    outer.append((container, fields, index))
+                    container, fields, index = value, length, None
+                    continue
+            elif tag == NONE:
+                value = None
+            elif tag == INT:
+                n = varint()
+                value = -((n + 1) >> 1) if n & 1 else n >> 1
+            elif tag == FLOAT:
+                value, = DOUBLE.unpack_from(data, self.pos)
+                self.pos += DOUBLE.size
+            elif tag == REF:
+                value = nodes[varint()]
+            elif tag == TRUE or tag == FALSE:
+                value = tag == TRUE
+            else:
+                raise ValueError(f'Bad tag {tag} at {self.pos - 1}')
+
+            # value is complete: it goes into the container, which may be complete then too
+            while True:
+                if container is None:
+                    return value
+                if index is None:
+                    container.append(value)
+                    if len(container) < fields:
+                        break
+                else:
+                    setattr(container, fields[index], value)
+                    index += 1
+                    if index < len(fields):
+                        break
+                value = container
+                container, fields, index = outer.pop()
+
+    def read(self):
+        if not self.data.startswith(MAGIC):
+            raise ValueError('Not a serialized Wabbit model')
+        self.pos = len(MAGIC)
+        version = self.varint()
+        if version != VERSION:
+            raise ValueError(f'Unsupported format version {version} (expected {VERSION})')
+        if self.varint() != SCHEMA:
+            raise ValueError('Serialized for a different version of the model')
+        for _ in range(self.varint()):
+            length = self.varint()
+            string = self.data[self.pos:self.pos + length].decode('utf-8')
+            self.strings.append(intern_type(string))  # Type names come back as the Type objects
+            self.pos += length
+        value = self.value()
+        nodes = self.nodes
+        for _ in range(self.varint()):
+            node = nodes[self.varint()]
+            node.declaration = nodes[self.varint()]
+        return value
+
+
+def dumps(statements):
+    """ The model (a list of statements) as bytes """
+    writer = Writer()
+    writer.value(statements)
+    return writer.getvalue()
+
+
+def loads(data):
+    """ The model saved by dumps() """
+    return Reader(data).read()
+
+
+def dump(statements, filename):
+    with open(filename, 'wb') as f:
+        f.write(dumps(statements))
+
+
+def load(filename):
+    with open(filename, 'rb') as f:
+        return loads(f.read())
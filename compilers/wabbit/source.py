@@ -0,0 +1,74 @@
+# source.py
+#
+# Source positions.  Tokens and nodes only remember an integer offset
+# into the source text.  Turning an offset into a line and column is
+# only needed when something is reported to a person (an error message,
+# a profile, a source map), so it's done on demand here instead of
+# counting lines while scanning.
+#
+# The table of line start offsets is built once with a bulk scan of the
+# text, after which each lookup is a binary search.
+import re
+from bisect import bisect_right
+
+NEWLINE_REGEX = re.compile('\n')
+
+CHUNK_SIZE = 1 << 20
+
+
+class SourceIndex:
+    def __init__(self, text=None, filename=None):
+        assert text is not None or filename is not None
+        self.text = text
+        self.filename = filename
+        self._line_starts = None  # Built on first lookup
+
+    @classmethod
+    def from_file(cls, filename):
+        """ Index for a file that is too big to keep in memory. It's only read if a position is needed """
+        return cls(filename=filename)
+
+    @classmethod
+    def from_stream(cls, name=None):
+        """
+        Index for text that is only read once (e.g. a file object): the
+        line starts are recorded with add() as the text goes by.
+        """
+        index = cls(text='', filename=name)
+        index._line_starts = [0]
+        index._length = 0
+        return index
+
+    def add(self, text):
+        """ Add the next piece of a stream's text (see from_stream) """
+        self._line_starts.extend(self._length + m.end() for m in NEWLINE_REGEX.finditer(text))
+        self._length += len(text)
+
+    @property
+    def line_starts(self):
+        if self._line_starts is None:
+            self._line_starts = [0]
+            base = 0
+            for text in self._chunks():
+                self._line_starts.extend(base + m.end() for m in NEWLINE_REGEX.finditer(text))
+                base += len(text)
+        return self._line_starts
+
+    def _chunks(self):
+        if self.text is not None:
+            yield self.text
+        else:
+            with open(self.filename, encoding='utf-8', newline='') as f:  # Offsets count '\r' too
+                while chunk := f.read(CHUNK_SIZE):
+                    yield chunk
+
+    def position(self, offset):
+        """ Return (line, column) for an offset.  Both count from 1 """
+        line_starts = self.line_starts
+        line = bisect_right(line_starts, offset)
+        return line, offset - line_starts[line - 1] + 1
+
+    def describe(self, offset):
+        """ Position as text for messages, e.g. 'prog.wb:3:14' """
+        line, column = self.position(offset)
+        return f'{self.filename}:{line}:{column}' if self.filename else f'{line}:{column}'
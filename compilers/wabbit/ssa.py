@@ -0,0 +1,629 @@
+# ssa.py
+#
+# Converting IR code (see ircode.py) to a register based SSA form and
+# back.  In the stack IR values only live on the stack and in variables
+# that can be stored to any number of times, which is hard to reason
+# about.  In SSA form:
+#
+#   - every value is a virtual register (%3) that is assigned exactly
+#     once, by one Instruction
+#   - variables are gone.  A LOAD is replaced by the register that was
+#     last stored to the variable, and where control flow joins (after
+#     an if/else, at the start of a loop) a Phi picks the register that
+#     depends on where control came from
+#   - code is split into basic blocks that end with a terminator: jump,
+#     if, cbreak (the loop exit of CBREAK), continue, return or exit.
+#     The exit of the program's code uses the last value of each of its
+#     globals: the functions called after it run with them
+#
+# to_ssa() builds it in one pass over the code with the algorithm of
+# Braun et al., "Simple and Efficient Construction of Static Single
+# Assignment Form" (CC 2013): a block is sealed once all of its
+# predecessors are known, a variable read in a block that isn't sealed
+# yet gets an incomplete phi that is filled in when it is, and phis that
+# turn out to pick the same value everywhere are removed at the end, as
+# are phis nothing reads (a variable stored to in a loop and never read
+# again still gets one at the loop header).
+# The IR is structured, so blocks are sealed as soon as the structure
+# that makes them ends: a loop header at ENDLOOP, an if join at ENDIF.
+#
+# The SSAFunction remembers that structure (body: blocks, IfRegions and
+# LoopRegions in order), and from_ssa() uses it to turn the blocks back
+# into structured stack IR:
+#
+#   - a register used once, in its block, by a pure instruction is put
+#     back into the expression that uses it (so x * x + 1 comes back as
+#     it went in).  Other registers get a variable of their own, named
+#     after the register, declared after the program's variables
+#   - a phi is a variable too.  The end of each predecessor stores the
+#     value for that edge in it.  The stores load all the values first
+#     and then store them, so phis that swap values work
+#   - a phi after CBREAK (a loop with several exits) is stored before
+#     the test, which is safe because nothing in the loop reads it
+#
+# Every declaration is moved to the start, in the order of the slots.  A
+# declaration in a block still sets its variable to 0 where it was, in
+# SSA that's a constant.  The globals only get their values at the exit.
+#
+# The code of a function (IRFunction.code, with its parameters) works
+# the same way.  Its parameters are the first LOCAL slots, which the
+# caller fills in: each one starts out as a LOAD in the entry block, and
+# as nothing stores to them after from_ssa() that LOAD is put back
+# wherever the value is used.  The other registers get LOCAL variables.
+#
+# A variable the code uses without declaring it (a global, in a
+# function) stays in memory: its LOADs and STOREs are instructions that
+# keep their order, and to_ssa() has to be told its type (memory, see
+# global_types()).  Otherwise reading one is an error rather than 0.
+#
+# Calls are not supported: a call can read and write globals, so the
+# values of the globals declared in the code would have to be in memory
+# around every call.
+from compilers.wabbit.bytecode import Bytecode, decode
+from compilers.wabbit.resolve import GLOBAL, LOCAL
+
+# Result type ('I' or 'F') of the instructions that make a value
+RESULT_TYPES = {
+    'CONSTI': 'I', 'CONSTF': 'F',
+    'ADDI': 'I', 'SUBI': 'I', 'MULI': 'I', 'DIVI': 'I', 'ANDI': 'I', 'ORI': 'I',
+    'ADDF': 'F', 'SUBF': 'F', 'MULF': 'F', 'DIVF': 'F',
+    'LTI': 'I', 'LEI': 'I', 'GTI': 'I', 'GEI': 'I', 'EQI': 'I', 'NEI': 'I',
+    'LTF': 'I', 'LEF': 'I', 'GTF': 'I', 'GEF': 'I', 'EQF': 'I', 'NEF': 'I',
+    'ITOF': 'F', 'FTOI': 'I',
+    'PEEKI': 'I', 'PEEKF': 'F', 'PEEKB': 'I', 'GROW': 'I',
+}
+# Number of values each instruction takes from the stack
+ARGUMENT_COUNTS = {opcode: 0 if opcode.startswith('CONST') else 1 if opcode in ('ITOF', 'FTOI', 'PEEKI', 'PEEKF', 'PEEKB', 'GROW') else 2
+                   for opcode in RESULT_TYPES}
+ARGUMENT_COUNTS.update({'PRINTI': 1, 'PRINTF': 1, 'PRINTB': 1, 'POKEI': 2, 'POKEF': 2, 'POKEB': 2})
+
+# Instructions that can be moved (into the expression that uses them)
+PURE = {opcode for opcode in RESULT_TYPES if not opcode.startswith(('PEEK', 'GROW'))}
+
+DECLARATIONS = {'GLOBALI': (GLOBAL, 'I'), 'GLOBALF': (GLOBAL, 'F'), 'LOCALI': (LOCAL, 'I'), 'LOCALF': (LOCAL, 'F')}
+DECLARATION_OPCODES = {value: opcode for opcode, value in DECLARATIONS.items()}
+
+
+class Instruction:
+    __slots__ = ('dest', 'opcode', 'sources', 'operands')
+
+    def __init__(self, dest, opcode, sources=(), operands=()):
+        self.dest = dest          # Register, None if it doesn't make a value
+        self.opcode = opcode
+        self.sources = sources    # Registers it uses, in stack order
+        self.operands = operands  # The rest of the instruction (the value of a CONSTI, ...)
+
+    def __str__(self):
+        text = ' '.join([self.opcode] + [f'%{r}' for r in self.sources] + [repr(o) for o in self.operands])
+        return text if self.dest is None else f'%{self.dest} = {text}'
+
+
+class Phi:
+    __slots__ = ('dest', 'variable', 'operands')
+
+    def __init__(self, dest, variable):
+        self.dest = dest
+        self.variable = variable  # (depth, slot), for reading
+        self.operands = []        # A register for each predecessor of the block, in the same order
+
+    def __str__(self):
+        return f'%{self.dest} = phi ' + ', '.join(f'%{r}' for r in self.operands)
+
+
+class Block:
+    __slots__ = ('label', 'phis', 'instructions', 'terminator', 'predecessors')
+
+    def __init__(self, label):
+        self.label = label
+        self.phis = []
+        self.instructions = []
+        self.terminator = None    # (kind, ...) see the top
+        self.predecessors = []
+
+    def successors(self):
+        kind = self.terminator[0]
+        if kind == 'jump' or kind == 'continue':
+            return [self.terminator[1]]
+        if kind == 'if' or kind == 'cbreak':
+            return [self.terminator[2], self.terminator[3]]
+        return []
+
+    def __str__(self):
+        lines = [f'block{self.label}:' + (f'  ; from {", ".join(f"block{p.label}" for p in self.predecessors)}'
+                                          if self.predecessors else '')]
+        lines += [f'    {item}' for item in self.phis + self.instructions]
+        kind, *rest = self.terminator
+        lines.append('    ' + ' '.join([kind] + [f'block{r.label}' if isinstance(r, Block) else f'%{r}' for r in rest]))
+        return '\n'.join(lines)
+
+
+class IfRegion:
+    __slots__ = ('consequence', 'alternative')
+
+    def __init__(self):
+        self.consequence = []  # Body: Blocks and regions
+        self.alternative = []
+
+
+class LoopRegion:
+    __slots__ = ('body',)
+
+    def __init__(self):
+        self.body = []
+
+
+class SSAFunction:
+    def __init__(self):
+        self.blocks = []        # In the order they were made, the entry block first
+        self.body = []          # The structure, see the top
+        self.types = {}         # register -> 'I' or 'F'
+        self.declarations = []  # (depth, slot, name, type) of the variables, in the order they were declared
+        self.parameters = None  # [(name, type)] if it's the code of a function
+        self.outputs = []       # (depth, slot, name) of the globals whose values the exit uses, in order
+        self.registers = 0
+
+    def new_register(self, type):
+        register = self.registers
+        self.registers += 1
+        self.types[register] = type
+        return register
+
+    def new_block(self):
+        block = Block(len(self.blocks))
+        self.blocks.append(block)
+        return block
+
+    def __str__(self):
+        return '\n'.join(str(block) for block in self.blocks)
+
+
+class SSABuilder:
+    def __init__(self):
+        self.function = SSAFunction()
+        self.definitions = {}     # (block, variable) -> register
+        self.sealed = set()
+        self.incomplete = {}      # block -> [phis to fill in when it's sealed]
+        self.variable_types = {}  # variable -> 'I' or 'F'
+        self.memory = {}          # variable -> 'I' or 'F' of the ones in memory, see the top
+        self.undefined = {}       # type -> register of the value of a variable that was never set
+        self.replaced = {}        # register of a removed phi -> the register it is the same as
+        self.phis = {}            # register -> Phi
+        self.stack = []
+        self.loops = []           # (header, exit) of the loops we're in
+        self.ifs = []             # (region, alternative or None after ELSE, join) of the ifs we're in
+        self.bodies = []          # Bodies of the regions we're in
+
+    # Variables (Braun et al.)
+
+    def write(self, variable, block, register):
+        self.definitions[block, variable] = register
+
+    def read(self, variable, block):
+        register = self.definitions.get((block, variable))
+        if register is None:
+            register = self.read_recursive(variable, block)
+        return register
+
+    def read_recursive(self, variable, block):
+        if block not in self.sealed:
+            phi = self.new_phi(block, variable)
+            self.incomplete.setdefault(block, []).append(phi)
+            register = phi.dest
+        elif not block.predecessors:
+            register = self.undefined_value(self.variable_types.get(variable, 'I'))
+        elif len(block.predecessors) == 1:
+            register = self.read(variable, block.predecessors[0])
+        else:
+            phi = self.new_phi(block, variable)
+            self.write(variable, block, phi.dest)  # Before reading the operands, they may loop back here
+            self.fill(phi, block)
+            register = phi.dest
+        self.write(variable, block, register)
+        return register
+
+    def new_phi(self, block, variable):
+        phi = Phi(self.function.new_register(self.variable_types.get(variable, 'I')), variable)
+        block.phis.append(phi)
+        self.phis[phi.dest] = phi
+        return phi
+
+    def fill(self, phi, block):
+        phi.operands = [self.read(phi.variable, predecessor) for predecessor in block.predecessors]
+
+    def seal(self, block):
+        for phi in self.incomplete.pop(block, ()):
+            self.fill(phi, block)
+        self.sealed.add(block)
+
+    def undefined_value(self, type):
+        register = self.undefined.get(type)
+        if register is None:
+            register = self.undefined[type] = self.function.new_register(type)
+            self.function.blocks[0].instructions.insert(0, Instruction(register, 'CONST' + type, (), (0 if type == 'I' else 0.0,)))
+        return register
+
+    def find(self, register):
+        while register in self.replaced:
+            register = self.replaced[register]
+        return register
+
+    def remove_trivial_phis(self):
+        """ Remove phis that only pick one value (or themselves), until there are none """
+        changed = True
+        while changed:
+            changed = False
+            for block in self.function.blocks:
+                for phi in list(block.phis):
+                    values = {self.find(r) for r in phi.operands} - {phi.dest}
+                    if len(values) <= 1:
+                        block.phis.remove(phi)
+                        self.replaced[phi.dest] = values.pop() if values else \
+                            self.undefined_value(self.function.types[phi.dest])
+                        changed = True
+        # Every use now names a register that is still defined
+        for block in self.function.blocks:
+            for phi in block.phis:
+                phi.operands = [self.find(r) for r in phi.operands]
+            for instruction in block.instructions:
+                instruction.sources = tuple(self.find(r) for r in instruction.sources)
+            kind, *rest = block.terminator
+            block.terminator = (kind, *(r if isinstance(r, Block) else self.find(r) for r in rest))
+
+    def remove_dead_phis(self):
+        """ Remove phis whose value is never used (except by other unused phis) """
+        live = set()
+        for block in self.function.blocks:
+            for instruction in block.instructions:
+                live.update(instruction.sources)
+            live.update(terminator_registers(block.terminator))
+        work = [self.phis[r] for r in live if r in self.phis]
+        while work:
+            for register in work.pop().operands:
+                if register not in live:
+                    live.add(register)
+                    if register in self.phis:
+                        work.append(self.phis[register])
+        for block in self.function.blocks:
+            block.phis = [phi for phi in block.phis if phi.dest in live]
+
+    # Blocks
+
+    def start(self, block):
+        self.current = block
+        self.bodies[-1].append(block)
+
+    def end(self, terminator):
+        if self.stack:
+            raise ValueError(f'{len(self.stack)} values left on the stack at the end of a block')
+        self.current.terminator = terminator
+        if self.current.predecessors or self.current is self.function.blocks[0]:
+            # A block is done with its predecessors before it ends, except for the jumps
+            # back to a loop header, which don't make it reachable
+            for successor in self.current.successors():
+                successor.predecessors.append(self.current)
+
+    def unreachable(self):
+        """ Continue in a block nothing jumps to (the code after RET or CONTINUE) """
+        block = self.function.new_block()
+        self.seal(block)
+        self.start(block)
+
+    # The instructions
+
+    def build(self, code, parameters=None, memory=None):
+        entry = self.function.new_block()
+        self.bodies.append(self.function.body)
+        self.start(entry)
+        self.seal(entry)
+        if parameters is not None:
+            self.function.parameters = list(parameters)
+            for slot, (name, type) in enumerate(parameters):
+                self.variable_types[LOCAL, slot] = type
+                register = self.function.new_register(type)
+                entry.instructions.append(Instruction(register, 'LOAD', (), (name, LOCAL, slot)))
+                self.write((LOCAL, slot), entry, register)
+        if memory is not None:
+            self.memory = dict(memory)
+        for instruction in code:
+            opcode, *operands = instruction
+            handler = getattr(self, f'build_{opcode}', None)
+            if handler is not None:
+                handler(*operands)
+            elif opcode in ARGUMENT_COUNTS:
+                self.operation(opcode, operands)
+            else:
+                raise ValueError(f"Can't convert {instruction} to SSA form")
+        outputs = [(depth, slot, name) for depth, slot, name, type in self.function.declarations if depth == GLOBAL]
+        self.function.outputs = outputs
+        self.end(('exit', *(self.read((depth, slot), self.current) for depth, slot, name in outputs)))
+        if len(self.bodies) != 1:
+            raise ValueError('IF or LOOP without an end')
+        self.remove_trivial_phis()
+        self.remove_dead_phis()
+        return self.function
+
+    def operation(self, opcode, operands):
+        count = ARGUMENT_COUNTS[opcode]
+        if len(self.stack) < count:
+            raise ValueError(f'Stack underflow at {opcode}')
+        sources = tuple(self.stack[len(self.stack) - count:])
+        del self.stack[len(self.stack) - count:]
+        type = RESULT_TYPES.get(opcode)
+        dest = None if type is None else self.function.new_register(type)
+        self.current.instructions.append(Instruction(dest, opcode, sources, tuple(operands)))
+        if dest is not None:
+            self.stack.append(dest)
+
+    def declare(self, opcode, name, slot):
+        depth, type = DECLARATIONS[opcode]
+        variable = (depth, slot)
+        if variable not in self.variable_types:
+            self.function.declarations.append((depth, slot, name, type))
+        self.variable_types[variable] = type
+        value = self.function.new_register(type)
+        self.current.instructions.append(Instruction(value, 'CONST' + type, (), (0 if type == 'I' else 0.0,)))
+        self.write(variable, self.current, value)
+
+    def build_GLOBALI(self, name, slot):
+        self.declare('GLOBALI', name, slot)
+
+    def build_GLOBALF(self, name, slot):
+        self.declare('GLOBALF', name, slot)
+
+    def build_LOCALI(self, name, slot):
+        self.declare('LOCALI', name, slot)
+
+    def build_LOCALF(self, name, slot):
+        self.declare('LOCALF', name, slot)
+
+    def build_LOAD(self, name, depth, slot):
+        variable = (depth, slot)
+        if variable in self.variable_types:
+            self.stack.append(self.read(variable, self.current))
+        elif variable in self.memory:
+            dest = self.function.new_register(self.memory[variable])
+            self.current.instructions.append(Instruction(dest, 'LOAD', (), (name, depth, slot)))
+            self.stack.append(dest)
+        else:
+            raise ValueError(f"Can't convert LOAD of {name} to SSA form, it isn't declared in this code")
+
+    def build_STORE(self, name, depth, slot):
+        variable = (depth, slot)
+        if variable in self.variable_types:
+            self.write(variable, self.current, self.stack.pop())
+        elif variable in self.memory:
+            self.current.instructions.append(Instruction(None, 'STORE', (self.stack.pop(),), (name, depth, slot)))
+        else:
+            raise ValueError(f"Can't convert STORE to {name} to SSA form, it isn't declared in this code")
+
+    def build_IF(self):
+        test = self.stack.pop()
+        consequence, alternative, join = (self.function.new_block() for _ in range(3))
+        self.end(('if', test, consequence, alternative))
+        region = IfRegion()
+        self.bodies[-1].append(region)
+        self.seal(consequence)
+        self.seal(alternative)
+        self.ifs.append((region, alternative, join))
+        self.bodies.append(region.consequence)
+        self.start(consequence)
+
+    def build_ELSE(self):
+        region, alternative, join = self.ifs[-1]
+        self.end(('jump', join))
+        self.bodies[-1] = region.alternative
+        self.start(alternative)
+        self.ifs[-1] = (region, None, join)
+
+    def build_ENDIF(self):
+        region, alternative, join = self.ifs.pop()
+        self.end(('jump', join))
+        if alternative is not None:  # There was no ELSE
+            self.bodies[-1] = region.alternative
+            self.start(alternative)
+            self.end(('jump', join))
+        self.bodies.pop()
+        self.seal(join)
+        self.start(join)
+
+    def build_LOOP(self):
+        header, exit = self.function.new_block(), self.function.new_block()
+        self.end(('jump', header))
+        region = LoopRegion()
+        self.bodies[-1].append(region)
+        self.bodies.append(region.body)
+        self.loops.append((header, exit))
+        self.start(header)
+
+    def build_CBREAK(self):
+        header, exit = self.loops[-1]
+        test = self.stack.pop()
+        following = self.function.new_block()
+        self.end(('cbreak', test, exit, following))
+        self.seal(following)
+        self.start(following)
+
+    def build_CONTINUE(self):
+        header, exit = self.loops[-1]
+        self.end(('continue', header))
+        self.unreachable()
+
+    def build_ENDLOOP(self):
+        header, exit = self.loops.pop()
+        self.end(('jump', header))
+        self.seal(header)
+        self.bodies.pop()
+        self.seal(exit)
+        self.start(exit)
+
+    def build_RET(self):
+        self.end(('return', self.stack.pop()))
+        self.unreachable()
+
+
+def to_ssa(code, parameters=None, memory=None):
+    """
+    The SSAFunction for IR code (a list of instructions or Bytecode).  For
+    the code of a function, parameters is IRFunction.parameters and memory
+    the types of the globals it uses, {(depth, slot): 'I' or 'F'}.
+    """
+    if isinstance(code, Bytecode):
+        code = decode(code)
+    return SSABuilder().build(code, parameters, memory)
+
+
+def global_types(code):
+    """ The memory argument of to_ssa() for the functions of a program with this code """
+    if isinstance(code, Bytecode):
+        code = decode(code)
+    return {(GLOBAL, instruction[2]): DECLARATIONS[instruction[0]][1]
+            for instruction in code if instruction[0] in ('GLOBALI', 'GLOBALF')}
+
+
+# Back to stack IR
+
+class StackEmitter:
+    def __init__(self, function):
+        self.function = function
+        self.code = []
+        uses = {}
+        users = {}  # register -> the block that uses it (if it's used once)
+        for block in function.blocks:
+            for phi in block.phis:
+                for register in phi.operands:
+                    uses[register] = uses.get(register, 0) + 1
+                    users[register] = None  # Can't be put into an expression
+            for instruction in block.instructions:
+                for register in instruction.sources:
+                    uses[register] = uses.get(register, 0) + 1
+                    users[register] = block
+            for register in terminator_registers(block.terminator):
+                uses[register] = uses.get(register, 0) + 1
+                users[register] = block
+        self.uses = uses
+        # Registers that are computed where they are used, instead of being stored
+        self.inline = set()
+        self.definitions = {}
+        for block in function.blocks:
+            for instruction in block.instructions:
+                if instruction.dest is not None:
+                    self.definitions[instruction.dest] = instruction
+                    if instruction.opcode == 'LOAD' and instruction.operands[1] == LOCAL:
+                        self.inline.add(instruction.dest)  # Of a parameter, see the top
+                    elif instruction.opcode in PURE and uses.get(instruction.dest) == 1 \
+                            and users[instruction.dest] is block:
+                        self.inline.add(instruction.dest)
+        # The other registers (and phis) get a variable each
+        if function.parameters is not None or any(d == LOCAL for d, _, _, _ in function.declarations):
+            depth = LOCAL
+        else:
+            depth = GLOBAL
+        next_slot = 1 + max((slot for d, slot, _, _ in function.declarations if d == depth), default=-1)
+        if function.parameters is not None:
+            next_slot = max(next_slot, len(function.parameters))
+        self.variables = {}  # register -> (depth, slot)
+        self.temporaries = []
+        for register in sorted(uses):
+            if register not in self.inline:
+                self.variables[register] = (depth, next_slot)
+                self.temporaries.append((depth, next_slot, f'%{register}', function.types[register]))
+                next_slot += 1
+        for block in function.blocks:
+            for instruction in block.instructions:
+                # Impure values nothing uses still have to go somewhere
+                if instruction.dest is not None and instruction.opcode not in PURE \
+                        and instruction.dest not in self.variables and instruction.dest not in self.inline:
+                    self.variables[instruction.dest] = (depth, next_slot)
+                    self.temporaries.append((depth, next_slot, f'%{instruction.dest}', function.types[instruction.dest]))
+                    next_slot += 1
+
+    def emit(self):
+        for depth, slot, name, type in sorted(self.function.declarations) + self.temporaries:
+            self.code.append((DECLARATION_OPCODES[depth, type], name, slot))
+        self.emit_body(self.function.body)
+        return self.code
+
+    def emit_body(self, body):
+        for item in body:
+            if isinstance(item, Block):
+                self.emit_block(item)
+            elif isinstance(item, IfRegion):
+                self.code.append(('IF',))
+                self.emit_body(item.consequence)
+                if any(isinstance(b, LoopRegion) or isinstance(b, IfRegion) or b.instructions or b.phis
+                       or self.copies_after(b) for b in item.alternative):
+                    self.code.append(('ELSE',))
+                    self.emit_body(item.alternative)
+                self.code.append(('ENDIF',))
+            else:
+                self.code.append(('LOOP',))
+                self.emit_body(item.body)
+                self.code.append(('ENDLOOP',))
+
+    def emit_block(self, block):
+        if block.predecessors or block is self.function.blocks[0]:
+            for instruction in block.instructions:
+                if instruction.dest in self.inline:
+                    continue
+                if instruction.dest is not None and instruction.dest not in self.variables:
+                    continue  # A pure value nobody uses
+                self.emit_instruction(instruction)
+                if instruction.dest is not None:
+                    self.store(instruction.dest)
+            self.emit_copies(self.copies_after(block))
+        kind, *rest = block.terminator
+        if kind == 'if':
+            self.value(rest[0])  # Followed by IF, see emit_body()
+        elif kind == 'cbreak':
+            self.value(rest[0])
+            self.code.append(('CBREAK',))
+        elif kind == 'continue':
+            self.code.append(('CONTINUE',))
+        elif kind == 'return':
+            self.value(rest[0])
+            self.code.append(('RET',))
+        elif kind == 'exit' and (block.predecessors or block is self.function.blocks[0]):
+            for register, (depth, slot, name) in zip(rest, self.function.outputs):
+                self.value(register)
+                self.code.append(('STORE', name, depth, slot))
+
+    def copies_after(self, block):
+        """ [(phi register, register)] to store at the end of block (see the top) """
+        copies = []
+        for successor in block.successors():
+            if successor.phis:
+                index = successor.predecessors.index(block)
+                copies.extend((phi.dest, phi.operands[index]) for phi in successor.phis)
+        return copies
+
+    def emit_copies(self, copies):
+        for phi, register in copies:
+            self.value(register)
+        for phi, register in reversed(copies):
+            self.store(phi)
+
+    def emit_instruction(self, instruction):
+        for register in instruction.sources:
+            self.value(register)
+        self.code.append((instruction.opcode, *instruction.operands))
+
+    def value(self, register):
+        """ Code that pushes the value of register """
+        if register in self.inline:
+            self.emit_instruction(self.definitions[register])
+        else:
+            depth, slot = self.variables[register]
+            self.code.append(('LOAD', f'%{register}', depth, slot))
+
+    def store(self, register):
+        depth, slot = self.variables[register]
+        self.code.append(('STORE', f'%{register}', depth, slot))
+
+
+def terminator_registers(terminator):
+    return [r for r in terminator[1:] if not isinstance(r, Block)]
+
+
+def from_ssa(function):
+    """ Structured stack IR (a list of instructions) that does what function does """
+    return StackEmitter(function).emit()
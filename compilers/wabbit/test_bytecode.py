@@ -0,0 +1,92 @@
+# test_bytecode.py
+#
+# Bytecode (bytecode.py) holds the same code as the list of IR
+# instructions it was encoded from.  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_bytecode.py
+import contextlib
+import io
+import os
+
+import pytest
+
+from compilers.wabbit import errors
+from compilers.wabbit.bytecode import encode, decode, dispatch, handler_table, OPCODES
+from compilers.wabbit.check import check_program
+from compilers.wabbit.ir_code_interpreter import Interpreter
+from compilers.wabbit.ircode import generate_module
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.resolve import GLOBAL, LOCAL
+from compilers.wabbit.tokenizer import tokenize
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Tests')
+TEST_FILES = ['chartest.wb', 'fact.wb', 'fib.wb', 'floattest.wb', 'inttest.wb', 'mandel.wb', 'mandel_loop.wb']
+
+
+def compile_module(text):
+    statements = Parser(tokenize(text)).parse_statements()
+    with errors.collecting(echo=False) as diagnostics:
+        check_program(statements)
+    assert not diagnostics.error_count
+    return generate_module(statements)
+
+
+def test_test_programs():
+    for filename in TEST_FILES:
+        with open(os.path.join(TESTS_DIR, filename), encoding='ascii') as f:
+            module = compile_module(f.read())
+        for code in [module.code] + [function.code for function in module.functions.values()]:
+            assert decode(encode(code)) == code
+
+
+def test_constants_and_short_instructions():
+    code = [('CONSTI', 1), ('CONSTF', 1.0), ('CONSTI', True), ('CONSTF', -0.0), ('CONSTF', 0.0),
+            ('CONSTI', -2 ** 31), ('GLOBALI', 'x', 0), ('LOCALF', 'y', 3), ('STORE', 'x'),
+            ('LOAD', 'x', GLOBAL, 0), ('STORE', 'y', LOCAL, None), ('CALL', 'f'), ('RET',)]
+    decoded = decode(encode(code))
+    assert decoded == code
+    # Equal but different constants stay apart in the pool
+    assert [type(instruction[1]) for instruction in decoded[:3]] == [int, float, bool]
+    assert str(decoded[3][1]) == '-0.0'
+
+
+def test_bad_instructions():
+    with pytest.raises(ValueError):
+        encode([('NOPE',)])
+    with pytest.raises(ValueError):
+        encode([('ADDI', 1)])
+
+
+def test_dispatch():
+    class Counter:
+        def __init__(self):
+            self.seen = []
+
+        def count_CONSTI(self, index):
+            self.seen.append(('CONSTI', index))
+
+        def count_LOAD(self, name, depth, slot):
+            self.seen.append(('LOAD', name, depth, slot))
+
+        def count_ADDI(self):
+            self.seen.append(('ADDI',))
+
+    counter = Counter()
+    bytecode = encode([('CONSTI', 7), ('LOAD', 'x', GLOBAL, 2), ('ADDI',)])
+    dispatch(bytecode, handler_table(counter, 'count_'))
+    assert counter.seen == [('CONSTI', 0), ('LOAD', 0, GLOBAL, 2), ('ADDI',)]  # Pool indexes, not values
+    assert [OPCODES[opcode] for opcode, _ in bytecode] == ['CONSTI', 'LOAD', 'ADDI']
+    with pytest.raises(ValueError):
+        dispatch(encode([('MULI',)]), handler_table(counter, 'count_'))
+
+
+def test_interpreter_runs_either_form():
+    with open(os.path.join(TESTS_DIR, 'fact.wb'), encoding='ascii') as f:
+        module = compile_module(f.read())
+    outputs = []
+    for code in (module.code, encode(module.code)):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            Interpreter().run(code)
+        outputs.append(out.getvalue())
+    assert outputs[0] == outputs[1] != ''
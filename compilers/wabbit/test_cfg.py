@@ -0,0 +1,94 @@
+# test_cfg.py
+#
+# Branch targets, basic blocks, dominators and loops of IR code
+# (cfg.py).  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_cfg.py
+import os
+
+import pytest
+
+from compilers.wabbit import errors
+from compilers.wabbit.bytecode import encode
+from compilers.wabbit.cfg import ControlFlow
+from compilers.wabbit.check import check_program
+from compilers.wabbit.ircode import generate_module
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.resolve import GLOBAL
+from compilers.wabbit.tokenizer import tokenize
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Tests')
+
+X = ('LOAD', 'x', GLOBAL, 0)
+
+
+def words(code):
+    """ The word of each instruction, and where the code ends """
+    bytecode = encode(code)
+    pcs = []
+    pc = 0
+    for _, operands in bytecode:
+        pcs.append(pc)
+        pc += 1 + len(operands)
+    return pcs + [pc]
+
+
+def test_if_targets():
+    code = [X, ('IF',), X, ('PRINTI',), ('ELSE',), X, ('PRINTI',), ('ENDIF',), X, ('IF',), ('ENDIF',)]
+    pc = words(code)
+    flow = ControlFlow(code)
+    assert flow.targets[pc[1]] == pc[5]    # IF -> the alternative
+    assert flow.targets[pc[4]] == pc[8]    # ELSE -> after ENDIF
+    assert flow.targets[pc[9]] == pc[11]   # IF without ELSE -> after ENDIF
+    assert [flow.targets[p] for p in pc[:-1]].count(-1) == len(code) - 3
+
+
+def test_loop_targets():
+    code = [('LOOP',), X, ('CBREAK',), X, ('IF',), ('CONTINUE',), ('ENDIF',), X, ('IF',), ('CONSTI', 1), ('CBREAK',),
+            ('ENDIF',), ('ENDLOOP',), X]
+    pc = words(code)
+    flow = ControlFlow(code)
+    after = pc[13]
+    assert flow.targets[pc[0]] == after            # LOOP
+    assert flow.targets[pc[2]] == after            # CBREAK
+    assert flow.targets[pc[10]] == after           # CBREAK in an IF
+    assert flow.targets[pc[5]] == pc[1]            # CONTINUE -> the first instruction in the loop
+    assert flow.targets[pc[12]] == pc[1]           # ENDLOOP
+    assert flow.labels == {pc[2]: 0, pc[5]: 1, pc[10]: 1}  # IFs between the branch and its loop
+
+
+def test_bad_markers():
+    for code in ([('IF',)], [('ENDIF',)], [('LOOP',), ('ENDIF',)], [('CBREAK',)], [('IF',), ('ENDLOOP',)]):
+        with pytest.raises(ValueError):
+            ControlFlow(code)
+
+
+def test_blocks_and_dominators():
+    # 0: X IF | 1: X PRINTI ELSE | 2: X PRINTI | 3: ENDIF X PRINTI RET | 4: X (unreachable)
+    code = [X, ('IF',), X, ('PRINTI',), ('ELSE',), X, ('PRINTI',), ('ENDIF',), X, ('PRINTI',), ('RET',), X]
+    flow = ControlFlow(code)
+    entry, then, otherwise, join, dead = flow.blocks
+    assert entry.successors == [then, otherwise]
+    assert join.predecessors == [then, otherwise] and join.successors == []
+    assert flow.dominators() == [None, entry, entry, entry, None]
+    assert flow.dominates(entry, join) and not flow.dominates(then, join)
+    assert flow.dominates(join, join) and not flow.dominates(entry, dead)
+
+
+def test_nested_loops():
+    code = [('LOOP',), X, ('CBREAK',), ('LOOP',), X, ('CBREAK',), X, ('PRINTI',), ('ENDLOOP',), ('ENDLOOP',)]
+    outer, inner = ControlFlow(code).loops()
+    assert inner.parent is outer and (outer.depth, inner.depth) == (1, 2)
+    assert inner.blocks < outer.blocks
+    assert all(block.loop is inner for block in inner.blocks)
+
+
+def test_test_program():
+    with open(os.path.join(TESTS_DIR, 'mandel.wb'), encoding='ascii') as f:
+        statements = Parser(tokenize(f.read())).parse_statements()
+    with errors.collecting(echo=False) as diagnostics:
+        check_program(statements)
+    assert not diagnostics.error_count
+    for function in generate_module(statements).functions.values():
+        loops = ControlFlow(function.code).loops()
+        assert len(loops) == sum(instruction[0] == 'LOOP' for instruction in function.code)
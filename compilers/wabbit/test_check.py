@@ -0,0 +1,38 @@
+# test_check.py
+#
+# check_program() (check.py) on small programs: the errors it reports.
+# Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_check.py
+from compilers.wabbit import errors
+from compilers.wabbit.check import check_program
+from compilers.wabbit.flat import FlatTree
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.tokenizer import tokenize
+
+FUNCTION = 'func f(a int) int { return a; }\n'
+
+
+def checked(text, flat=False):
+    """ (result of check_program, [(code, message) of each diagnostic]) """
+    statements = Parser(tokenize(text)).parse_statements()
+    with errors.collecting(echo=False) as diagnostics:
+        ok = check_program(FlatTree.from_model(statements) if flat else statements)
+    return ok, [(d.code, d.message) for d in diagnostics]
+
+
+def test_function_as_value():
+    for statement in ['var x int = 1;\nx = f;', 'var y = f;', 'print f + 1;', 'print -f;']:
+        for flat in (False, True):
+            assert checked(FUNCTION + statement, flat) == (False, [('not-a-value', 'f is a function, not a value')])
+
+
+def test_assign_to_function():
+    # One error, not one about assigning to something immutable too
+    for flat in (False, True):
+        assert checked(FUNCTION + 'f = 1;', flat) == (False, [('not-a-value', 'f is a function, not a value')])
+
+
+def test_function_call():
+    assert checked(FUNCTION + 'print f(2);') == (True, [])
+    assert checked('var x int = 1;\nprint x(2);') == (False, [('not-callable', 'Cannot call x as a function')])
@@ -0,0 +1,66 @@
+# test_errors.py
+#
+# The Diagnostics collector (errors.py): what it keeps and stopping
+# at max_errors.  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_errors.py
+import pytest
+
+from compilers.wabbit import errors
+from compilers.wabbit.check import check_program
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.tokenizer import tokenize
+
+UNDEFINED = ''.join(f'print x{n};\n' for n in range(10))
+
+
+def parse(text):
+    return Parser(tokenize(text)).parse_statements()
+
+
+def test_all_errors():
+    statements = parse(UNDEFINED)
+    with errors.collecting(echo=False) as diagnostics:
+        assert not check_program(statements)
+    assert diagnostics.error_count == len(diagnostics) == 10
+    assert diagnostics.has_errors and not diagnostics.aborted
+    assert [d.message for d in diagnostics] == [f'Location x{n} was not declared' for n in range(10)]
+
+
+def test_max_errors():
+    statements = parse(UNDEFINED)
+    with errors.collecting(max_errors=3, echo=False) as diagnostics:
+        assert not check_program(statements)  # Stops, TooManyErrors doesn't get out
+    assert diagnostics.error_count == len(diagnostics) == 3
+    assert diagnostics.has_errors and diagnostics.aborted
+    assert [str(d) for d in diagnostics] == [f'{n + 1}:7: Location x{n} was not declared' for n in range(3)]
+    assert statements[3].expression.declaration is None and statements[3].expression.slot is None  # Not reached
+
+
+def test_warnings_dont_count():
+    with errors.collecting(max_errors=2, echo=False) as diagnostics:
+        errors.warning('first')
+        errors.warning('second')
+        errors.error('one')
+    assert (diagnostics.error_count, len(diagnostics.warnings), diagnostics.aborted) == (1, 2, False)
+    assert [str(d) for d in diagnostics] == ['warning: first', 'warning: second', 'one']
+
+
+def test_tokenizer_errors():
+    # Reported while parsing, so TooManyErrors comes out of the parser
+    with errors.collecting(max_errors=2, echo=False) as diagnostics:
+        with pytest.raises(errors.TooManyErrors):
+            parse('print 1 @;\nprint 2 @;\nprint 3 @;\n')
+    assert diagnostics.error_count == 2 and diagnostics.aborted
+
+
+def test_collectors_nest():
+    outer_before = errors.get_diagnostics()
+    with errors.collecting(echo=False) as outer:
+        errors.error('outer')
+        with errors.collecting(echo=False) as inner:
+            errors.error('inner')
+        errors.error('outer again')
+    assert [d.message for d in outer] == ['outer', 'outer again']
+    assert [d.message for d in inner] == ['inner']
+    assert errors.get_diagnostics() is outer_before
@@ -0,0 +1,203 @@
+# test_flat.py
+#
+# A FlatTree (flat.py) against the model it was made from: checking it
+# (FlatChecker in check.py) must give the same diagnostics and the same
+# annotations, and IRModule (FlatTranspiler in ircode.py) the same IR.
+# Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_flat.py
+import os
+import pickle
+
+from compilers.wabbit import errors
+from compilers.wabbit.bench import synthetic_program, broken_program, function_program
+from compilers.wabbit.check import check_program
+from compilers.wabbit.flat import FlatTree, CHILD_FIELDS, VALUE_FIELDS, KINDS
+from compilers.wabbit.ircode import generate_module
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.tokenizer import tokenize
+from compilers.wabbit.typesys import TYPES
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Tests')
+
+# One of each error the checker reports
+ERRORS = '''\
+func f(a int, a int) int { return a; }
+func f(b int) int { return b; }
+const c = 1;
+var x int = 2.5;
+var y = 1 + 2.0;
+var z char = 'a';
+var x int = 3;
+c = 2;
+x = 'b';
+print undefined + 1;
+print g(1);
+print x(1);
+print f(1, 2);
+print f(1.5);
+print -'a';
+print int('c');
+print ^1;
+`x = 1;
+print f;
+f = 1;
+if x { print 1; }
+while 1.5 { print 2; }
+if x < 2 { var x int = 4; print x; } else { var w float = 1.0; print w * 2; }
+'''
+
+PROGRAMS = '''\
+import func put(x int) int;
+var total float = 0.0;
+const scale = 2.5;
+func square(x float) float { return x * x; }
+func sum(n int) float {
+    var i int = 0;
+    var s float = 0.0;
+    while i < n {
+        if i > 3 { s = s + square(float(i)) * scale; } else { s = s - 1.0; continue; }
+        i = i + 1;
+        if i > 100 { break; }
+    }
+    return s;
+}
+total = sum(10);
+print total;
+print put(int(total));
+if bool(total) { if !false { print 'y'; } } else { print 'n'; }
+'''
+
+
+def read_tests():
+    for filename in sorted(os.listdir(TESTS_DIR)):
+        if filename.endswith('.wb'):
+            with open(os.path.join(TESTS_DIR, filename), encoding='ascii') as f:
+                yield f.read()
+
+
+def texts():
+    yield from read_tests()
+    yield PROGRAMS
+    yield ERRORS
+    yield PROGRAMS + ERRORS
+    yield synthetic_program(5000)
+    yield broken_program(5000)
+    yield function_program(20)
+
+
+def parse(text):
+    return Parser(tokenize(text)).parse_statements()
+
+
+def model_nodes(statements):
+    """ The nodes in the order FlatTree.from_model() gives them ids (children first) """
+    nodes = []
+    work = [(statements, False)]
+    while work:
+        node, done = work.pop()
+        if node is None:
+            continue
+        if done:
+            nodes.append(node)
+            continue
+        work.append((node, True))
+        children = node if isinstance(node, list) else [getattr(node, name) for name in CHILD_FIELDS.get(type(node), ())]
+        work.extend((child, False) for child in reversed(children))
+    return nodes
+
+
+def checked(program, max_errors=None):
+    """ (result of check_program, the diagnostics) """
+    with errors.collecting(max_errors, echo=False) as diagnostics:
+        ok = check_program(program)
+    return ok, [(d.severity, d.code, d.message, d.offset) for d in diagnostics], diagnostics.aborted
+
+
+def model_annotations(statements):
+    """ (class, type, mutable, declaration, depth, slot) of every node, declarations by id """
+    nodes = model_nodes(statements)
+    ids = {id(node): n for n, node in enumerate(nodes)}
+    found = []
+    for node in nodes:
+        if isinstance(node, list):
+            found.append((list, None, None, None, None, None))
+            continue
+        mutable = getattr(node, 'mutable', None)
+        declaration = node.declaration
+        found.append((type(node), getattr(node, 'type', None), None if mutable is None else bool(mutable),
+                      None if declaration is None else ids[id(declaration)], node.depth, node.slot))
+    return found
+
+
+def flat_annotations(tree):
+    def value(number):
+        return None if number < 0 else number
+    return [(KINDS[tree.kind[n]], value(tree.type[n]) if tree.type[n] < 0 else TYPES[tree.type[n]],
+             None if tree.mutable[n] < 0 else bool(tree.mutable[n]), value(tree.declaration[n]),
+             value(tree.depth[n]), value(tree.slot[n])) for n in range(len(tree))]
+
+
+def ir(module):
+    functions = {name: (f.parameters, f.return_type, f.code) for name, f in module.functions.items()}
+    return module.code, functions
+
+
+def test_same_tree():
+    for text in texts():
+        statements = parse(text)
+        tree = FlatTree.from_model(statements)
+        nodes = model_nodes(statements)
+        ids = {id(node): n for n, node in enumerate(nodes)}
+        assert [KINDS[kind] for kind in tree.kind] == [type(node) for node in nodes]
+        for n, node in enumerate(nodes):
+            if isinstance(node, list):
+                assert list(tree.children(n)) == [ids[id(item)] for item in node]
+                continue
+            children = [getattr(node, name) for name in CHILD_FIELDS.get(type(node), ())]
+            assert list(tree.children(n)) == [-1 if child is None else ids[id(child)] for child in children]
+            values = tuple(getattr(node, name) for name in VALUE_FIELDS[type(node)])
+            assert (tree.pool[tree.pool_index[n]][1:] if values else ()) == values
+            assert tree.offset[n] == node.offset
+        assert tree.root == len(nodes) - 1
+
+
+def test_same_check():
+    compiled = 0
+    for text in texts():
+        statements = parse(text)
+        tree = FlatTree.from_model(statements)
+        result = checked(statements)
+        assert checked(tree) == result
+        assert flat_annotations(tree) == model_annotations(statements)
+        if result[0]:
+            compiled += 1
+            assert ir(generate_module(tree)) == ir(generate_module(statements))
+    assert compiled >= 9  # Some of the Tests/ programs use operators the checker doesn't take
+
+
+def test_error_program():
+    # Every kind of error is there, and in the same order from both
+    ok, diagnostics, _ = checked(parse(ERRORS))
+    assert not ok
+    assert {code for _, code, _, _ in diagnostics} == {
+        'duplicate', 'declared-type', 'immutable', 'assignment-type', 'undefined', 'not-callable', 'arguments',
+        'argument-type', 'unop', 'typecast', 'unsupported', 'not-a-value', 'test-type', 'binop'}
+    assert checked(FlatTree.from_model(parse(ERRORS)))[1] == diagnostics
+
+
+def test_max_errors():
+    for max_errors in (1, 5, 12):
+        statements = parse(ERRORS)
+        tree = FlatTree.from_model(statements)
+        result = checked(statements, max_errors)
+        assert result[2] and len(result[1]) == max_errors
+        assert checked(tree, max_errors) == result
+
+
+def test_pickled():
+    statements = parse(PROGRAMS)
+    tree = pickle.loads(pickle.dumps(FlatTree.from_model(statements)))
+    assert checked(tree) == checked(statements)
+    assert flat_annotations(tree) == model_annotations(statements)
+    assert ir(generate_module(tree)) == ir(generate_module(statements))
@@ -0,0 +1,71 @@
+# test_hashcons.py
+#
+# Parsing with an Interner (hashcons.py) shares identical pure
+# expressions but builds the same program.  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_hashcons.py
+import os
+
+from compilers.wabbit import errors
+from compilers.wabbit.check import check_program
+from compilers.wabbit.hashcons import Interner
+from compilers.wabbit.ircode import generate_module
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.test_parse import flatten
+from compilers.wabbit.tokenizer import tokenize
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Tests')
+TEST_FILES = ['chartest.wb', 'fact.wb', 'fib.wb', 'floattest.wb', 'inttest.wb', 'mandel.wb', 'mandel_loop.wb']
+
+
+def parse(text, interner=None):
+    return Parser(tokenize(text), interner).parse_statements()
+
+
+def without_offsets(statements):
+    """ flatten() without the offsets, a shared node has the offset of its first occurrence """
+    return [item[::2] if isinstance(item, tuple) and len(item) == 3 else item for item in flatten(statements)]
+
+
+def ircode(statements):
+    with errors.collecting(echo=False) as diagnostics:
+        check_program(statements)
+    assert not diagnostics.error_count
+    module = generate_module(statements)
+    return module.code, {name: function.code for name, function in module.functions.items()}
+
+
+def test_test_programs():
+    for filename in TEST_FILES:
+        with open(os.path.join(TESTS_DIR, filename), encoding='ascii') as f:
+            text = f.read()
+        shared = parse(text, Interner())
+        assert without_offsets(shared) == without_offsets(parse(text))
+        assert ircode(shared) == ircode(parse(text))  # Checking the shared nodes gave them the same types and slots
+
+
+def test_shared():
+    interner = Interner()
+    square, other = parse('var x int = 2;\nprint x * x + 1;\nprint x * x - 1;\n', interner)[1:]
+    assert square.expression.left is other.expression.left
+    assert square.expression.right is other.expression.right  # The literal 1
+    assert square.expression is not other.expression
+    assert square.expression.left.structural_hash == other.expression.left.structural_hash
+
+
+def test_impure_expressions_not_shared():
+    statements = parse('func f(a int) int { return a; }\nprint f(1) + f(1);\nprint ^1 + ^1;\nprint `4 + `4;\n',
+                       Interner())
+    for statement in statements[1:]:
+        left, right = statement.expression.left, statement.expression.right
+        assert left is not right
+        assert left.structural_hash is None is right.structural_hash
+        assert statement.expression.structural_hash is None  # Contains something that isn't shared
+
+
+def test_names_in_regions():
+    # x is an int parameter in f and a float parameter in g: not the same node
+    f, g = parse('func f(x int) int { return x; }\nfunc g(x float) float { return x; }\n', Interner())
+    assert f.statements[0].value is not g.statements[0].value
+    ircode([f, g])
+    assert f.statements[0].value.type != g.statements[0].value.type
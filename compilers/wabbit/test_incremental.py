@@ -0,0 +1,113 @@
+# test_incremental.py
+#
+# IncrementalProgram (incremental.py) and IncrementalChecker (check.py)
+# against tokenizing, parsing and checking the edited text from scratch.
+# Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_incremental.py
+import random
+
+from compilers.wabbit import errors
+from compilers.wabbit.check import check_program, IncrementalChecker
+from compilers.wabbit.incremental import IncrementalProgram
+from compilers.wabbit.model import Node
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.tokenizer import tokenize
+
+PROGRAM = '''\
+var a int = 1;
+var b int = 2;
+const c = 3;
+print a + b;
+print a + d;
+while a < 10 {
+    a = a + c;
+}
+print b * 2.0;
+'''
+
+
+def full_check(text):
+    """ The diagnostics of checking text from scratch, as they are printed """
+    statements = Parser(tokenize(text)).parse_statements()
+    with errors.collecting(echo=False) as diagnostics:
+        check_program(statements)
+    return [str(d) for d in diagnostics]
+
+
+def edit(program, old, new, count=1):
+    """ Replace the count-th old in the program with new """
+    offset = -1
+    for _ in range(count):
+        offset = program.text.index(old, offset + 1)
+    program.edit(offset, len(old), new)
+
+
+def offsets(statement, shift):
+    """ (class, current offset) of every node of a statement """
+    found = []
+    work = [statement]
+    while work:
+        item = work.pop()
+        if isinstance(item, list):
+            work.extend(item)
+        elif isinstance(item, Node):
+            found.append((type(item).__name__, item.offset + shift))
+            work.extend(getattr(item, name, None) for name in item._fields)
+    return sorted(found)
+
+
+def assert_same_as_fresh(program):
+    tokens = [(tok.type, tok.value, tok.offset + program.shift(seg.statement))
+              for seg in program.segments for tok in seg.tokens]
+    assert tokens == [(tok.type, tok.value, tok.offset) for tok in tokenize(program.text)]
+    fresh = Parser(tokenize(program.text)).parse_statements()
+    assert [offsets(s, program.shift(s)) for s in program.statements] == [offsets(s, 0) for s in fresh]
+
+
+def test_error_positions_after_edit():
+    program = IncrementalProgram(PROGRAM)
+    checker = IncrementalChecker()
+    checker.update(program.statements, program.shift)
+    assert [str(d) for d in checker.diagnostics()] == full_check(PROGRAM)
+
+    edit(program, 'a + b;', 'a +\n    b;')  # Everything after moves a line down
+    checker.update(program.statements, program.shift)
+    assert len(checker.rechecked) == 1  # Only the new statement, the errors after it are reused
+    expected = full_check(program.text)
+    assert [str(d) for d in checker.diagnostics()] == expected
+    assert expected[0].startswith('6:')
+
+
+def test_moved_statement_rechecked():
+    program = IncrementalProgram(PROGRAM)
+    checker = IncrementalChecker()
+    checker.update(program.statements, program.shift)
+    # a changes type: the statements after it that use it are checked again, where they are now
+    edit(program, 'var a int = 1;', '/* a float */\nvar a float = 1.5;')
+    checker.update(program.statements, program.shift)
+    assert len(checker.rechecked) > 1
+    expected = full_check(program.text)
+    assert [str(d) for d in checker.diagnostics()] == expected
+    assert {str(d) for d in checker.last} <= set(expected)  # As they were reported
+
+
+def test_edits_match_fresh_parse():
+    program = IncrementalProgram(PROGRAM * 20)
+    rng = random.Random(5)
+    edits = [('a + b', 'a + b + 1'), ('print a + d;', ''), ('const c = 3;', 'const c = 3;\nprint c;'),
+             ('\n', '\n\n'), ('b * 2.0', 'b'), ('while a < 10', 'while a < 100')]
+    for _ in range(60):
+        old, new = rng.choice(edits)
+        count = program.text.count(old)
+        if count:
+            edit(program, old, new, rng.randint(1, count))
+            assert_same_as_fresh(program)
+
+
+def test_delete_everything():
+    program = IncrementalProgram(PROGRAM)
+    program.edit(0, len(PROGRAM), '')
+    assert program.statements == []
+    program.edit(0, 0, 'print 1;\n')
+    assert_same_as_fresh(program)
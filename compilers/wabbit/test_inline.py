@@ -0,0 +1,93 @@
+# test_inline.py
+#
+# Programs with small functions inlined (inline.py) must print what
+# they print without.  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_inline.py
+import contextlib
+import io
+import os
+
+from compilers.wabbit import errors
+from compilers.wabbit.check import check_program
+from compilers.wabbit.inline import inline_functions
+from compilers.wabbit.ir_code_interpreter import Interpreter
+from compilers.wabbit.ircode import generate_module
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.tokenizer import tokenize
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Tests')
+
+
+def compile_module(text, inline):
+    statements = Parser(tokenize(text)).parse_statements()
+    with errors.collecting(echo=False) as diagnostics:
+        check_program(statements)
+        inlined = inline_functions(statements).inlined if inline else {}
+    assert not diagnostics.error_count
+    return generate_module(statements), inlined
+
+
+def run(module):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        interpreter = Interpreter(functions=module.functions)
+        interpreter.run(module.code)
+        if 'main' in module.functions:
+            interpreter.call('main')
+    return out.getvalue()
+
+
+def instructions(module):
+    return [instruction for function in module.functions.values() for instruction in function.code] + module.code
+
+
+def check_inlined(text, functions):
+    """ The output is the same, the functions are inlined and no declarations are left in loops """
+    module, _ = compile_module(text, False)
+    inlined_module, inlined = compile_module(text, True)
+    assert run(inlined_module) == run(module)
+    assert set(inlined) == set(functions)
+    code = instructions(inlined_module)
+    assert not any(instruction[0] == 'CALL' and instruction[1] in functions for instruction in code)
+    loops = 0
+    for instruction in code:
+        loops += {'LOOP': 1, 'ENDLOOP': -1}.get(instruction[0], 0)
+        assert not (loops and instruction[0][:-1] in ('LOCAL', 'GLOBAL') and '__' in instruction[1])
+    return inlined_module
+
+
+def test_mandel():
+    with open(os.path.join(TESTS_DIR, 'mandel.wb'), encoding='ascii') as f:
+        check_inlined(f.read().replace('threshhold = 1000', 'threshhold = 50'), {'in_mandelbrot'})
+
+
+def test_result_in_target():
+    module = check_inlined('func sq(x int) int { return x * x; }\n'
+                           'func clamp(x int, limit int) int { if x > limit { return limit; } return x; }\n'
+                           'func main() int { var i int = 0; var total int = 0;\n'
+                           '    while i < 100 { total = clamp(total + sq(i), 1000); i = i + 1; }\n'
+                           '    print total; return 0; }\n', {'sq', 'clamp'})
+    # sq(i) is i * i where the call was, clamp stores into total: no result variables
+    assert not any(instruction[1].startswith('result__') for instruction in module.functions['main'].code
+                   if instruction[0] in ('LOCALI', 'STORE'))
+
+
+def test_global_written_by_function():
+    # get() reads g, which bump() writes in the same statement: its result is kept in a variable
+    check_inlined('var g int = 1;\nfunc get() int { return g; }\nfunc bump() int { g = g + 10; return 1; }\n'
+                  'func main() int { var i int = 0;\n'
+                  '    while i < 3 { print get() + bump(); i = i + 1; } return 0; }\n', {'get', 'bump'})
+
+
+def test_returns_in_loops():
+    check_inlined('func find(n int, k int) int { var i int = 0;\n'
+                  '    while i < n { var j int = 0; while j < n { if k < i * j { return i; } j = j + 1; } i = i + 1; }\n'
+                  '    return -1; }\n'
+                  'var t int = 0;\nwhile t < 12 { print find(5, t); t = t + 1; }\n', {'find'})
+
+
+def test_uninitialized_variable_in_loop():
+    # last starts at 0 for each call, also when the calls are in a loop
+    check_inlined('func f(n int) int { var last int; if n > 2 { last = n; } return last; }\n'
+                  'var i int = 0;\nwhile i < 5 { print f(i); i = i + 1; }\n', {'f'})
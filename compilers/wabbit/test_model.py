@@ -0,0 +1,81 @@
+# test_model.py
+#
+# The slotted model classes (model.py): their _fields, pickling them
+# and reading annotations that haven't been filled in.  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_model.py
+import pickle
+
+import pytest
+
+from compilers.wabbit import errors
+from compilers.wabbit.check import check_program
+from compilers.wabbit.model import Node, Integer, Variable, NamedLocation, BinaryOperator, Function, Print
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.test_parse import flatten
+from compilers.wabbit.tokenizer import tokenize
+
+PROGRAM = '''\
+var x int = 2;
+func f(a int) int { return a * x; }
+print f(3) + 1;
+'''
+
+
+def parse(text):
+    return Parser(tokenize(text)).parse_statements()
+
+
+def test_fields():
+    assert Node._fields == ('offset',)
+    assert BinaryOperator._fields == ('offset', 'type', 'structural_hash', 'operator', 'left', 'right')
+    assert NamedLocation._fields == ('offset', 'type', 'structural_hash', 'mutable', 'declaration',
+                                     'name', 'depth', 'slot')
+    assert Integer._fields == ('offset', 'structural_hash', 'value')  # The type is a class attribute
+    assert Integer(1).type == 'int'
+    assert 'type' in Variable._fields and 'type' not in Function._fields
+
+
+def test_no_dict():
+    for node in (Integer(1), NamedLocation('x'), Print(Integer(1))):
+        assert not hasattr(node, '__dict__')
+        with pytest.raises(AttributeError):
+            node.color = 'red'
+
+
+def test_unset_annotations():
+    location = NamedLocation('x')
+    assert location.offset is None and location.declaration is None and location.slot is None
+    with pytest.raises(AttributeError, match='not been checked'):
+        location.type
+    with pytest.raises(AttributeError, match='not been checked'):
+        location.mutable
+    with pytest.raises(AttributeError):
+        Print(Integer(1)).type  # Not an expression at all
+    with pytest.raises(AttributeError):
+        location.colour
+
+
+def test_pickle_parsed():
+    statements = parse(PROGRAM)
+    copy = pickle.loads(pickle.dumps(statements))
+    assert flatten(copy) == flatten(statements)
+    multiply = copy[1].statements[0].value  # Unset before and after
+    with pytest.raises(AttributeError):
+        multiply.type
+    with pytest.raises(AttributeError):
+        multiply.right.mutable
+    assert multiply.right.declaration is None
+
+
+def test_pickle_checked():
+    statements = parse(PROGRAM)
+    with errors.collecting(echo=False):
+        assert check_program(statements)
+    copy = pickle.loads(pickle.dumps(statements))
+    assert flatten(copy) == flatten(statements)
+    multiply = copy[1].statements[0].value
+    assert (multiply.type, multiply.right.type, multiply.right.mutable) == ('int', 'int', True)
+    assert multiply.right.declaration is copy[0]  # Shared nodes stay shared
+    assert (multiply.right.depth, multiply.right.slot) == (statements[1].statements[0].value.right.depth,
+                                                           statements[1].statements[0].value.right.slot)
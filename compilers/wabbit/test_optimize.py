@@ -0,0 +1,123 @@
+# test_optimize.py
+#
+# Optimized IR code (optimize.py) must do what the original does.  Run
+# with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_optimize.py
+import contextlib
+import io
+import os
+
+from compilers.wabbit import errors
+from compilers.wabbit.bytecode import encode, Bytecode
+from compilers.wabbit.check import check_program
+from compilers.wabbit.ir_code_interpreter import Interpreter
+from compilers.wabbit.ircode import IRFunction, generate_module
+from compilers.wabbit.optimize import PassManager, propagate_constants, fold_constants, simplify, peephole, \
+    eliminate_dead_code
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.resolve import GLOBAL
+from compilers.wabbit.tokenizer import tokenize
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Tests')
+TEST_FILES = ['chartest.wb', 'fact.wb', 'fib.wb', 'floattest.wb', 'inttest.wb', 'mandel.wb', 'mandel_loop.wb']
+
+
+def compile_module(text):
+    statements = Parser(tokenize(text)).parse_statements()
+    with errors.collecting(echo=False) as diagnostics:
+        check_program(statements)
+    assert not diagnostics.error_count
+    return generate_module(statements)
+
+
+def run(code, functions=None):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        interpreter = Interpreter(functions=functions)
+        interpreter.run(code)
+        if functions and 'main' in functions:
+            interpreter.call('main')
+    return out.getvalue()
+
+
+def check_optimized(text):
+    """ The program prints the same with all of its code optimized.  Returns the PassManager """
+    module = compile_module(text)
+    manager = PassManager()
+    functions = {}
+    for name, function in module.functions.items():
+        functions[name] = IRFunction(name, function.parameters, function.return_type)
+        functions[name].code = manager.run(function.code)
+    code = manager.run(module.code)
+    assert run(code, functions) == run(module.code, module.functions)
+    assert manager.after <= manager.before
+    return manager
+
+
+def test_test_programs():
+    for filename in TEST_FILES:
+        with open(os.path.join(TESTS_DIR, filename), encoding='ascii') as f:
+            check_optimized(f.read().replace('threshhold = 1000', 'threshhold = 50'))  # Slow in the interpreter
+
+
+def test_program_with_constants():
+    manager = check_optimized('const n = 4;\nconst half = 0.5;\nvar i int = 0;\n'
+                              'while i < n * 2 { if 1 < 2 { print i * 1 + 0 - (6 / 4); } else { print 99; }\n'
+                              '    print half * 2.0; print -7 / 2; i = i + 1; }\n')
+    assert manager.after < manager.before
+    assert all(manager.changes[name] for name in ('propagate_constants', 'fold_constants', 'simplify', 'peephole',
+                                                  'eliminate_dead_code'))
+
+
+def test_fold_constants():
+    assert fold_constants([('CONSTI', 2), ('CONSTI', 3), ('MULI',)]) == [('CONSTI', 6)]
+    assert fold_constants([('CONSTI', -7), ('CONSTI', 2), ('DIVI',)]) == [('CONSTI', -3)]  # Truncated
+    assert fold_constants([('CONSTI', 2), ('ITOF',)]) == [('CONSTF', 2.0)]
+    kept = [[('CONSTI', 1), ('CONSTI', 0), ('DIVI',)],            # Division by zero is left for run time
+            [('CONSTI', 2 ** 30), ('CONSTI', 4), ('MULI',)],      # Doesn't fit in 32 bits
+            [('CONSTF', float('inf')), ('FTOI',)]]
+    for code in kept:
+        assert fold_constants(code) == code
+
+
+def test_simplify():
+    x = ('LOAD', 'x', GLOBAL, 0)
+    assert simplify([x, ('CONSTI', 0), ('ADDI',)]) == [x]
+    assert simplify([('CONSTI', 1), x, ('MULI',)]) == [x]
+    assert simplify([x, ('CONSTF', 1.0), ('DIVF',)]) == [x]
+    for code in ([x, ('CONSTF', 0.0), ('ADDF',)],   # x + 0.0 is 0.0 for x = -0.0
+                 [x, ('CONSTF', -0.0), ('SUBF',)],
+                 [('CONSTI', 0), x, ('SUBI',)]):
+        assert simplify(code) == code
+
+
+def test_peephole():
+    x, y = ('LOAD', 'x', GLOBAL, 0), ('LOAD', 'y', GLOBAL, 1)
+    assert peephole([('CONSTI', 1), x, y, ('LTI',), ('SUBI',), ('CBREAK',)]) == [x, y, ('GEI',), ('CBREAK',)]
+    floats = [('CONSTI', 1), x, y, ('LTF',), ('SUBI',), ('CBREAK',)]  # Not for NaN
+    assert peephole(floats) == floats
+    assert peephole([x, ('IF',), ('PRINTI',), ('ELSE',), ('ENDIF',)]) == [x, ('IF',), ('PRINTI',), ('ENDIF',)]
+
+
+def test_eliminate_dead_code():
+    x = ('LOAD', 'x', GLOBAL, 0)
+    assert eliminate_dead_code([('CONSTI', 0), ('IF',), x, ('PRINTI',), ('ELSE',), ('CONSTI', 2), ('PRINTI',),
+                                ('ENDIF',)]) == [('CONSTI', 2), ('PRINTI',)]
+    assert eliminate_dead_code([x, ('RET',), x, ('PRINTI',)]) == [x, ('RET',)]
+    assert eliminate_dead_code([('LOOP',), ('CONSTI', 1), ('CBREAK',), x, ('PRINTI',), ('ENDLOOP',), x]) == [x]
+
+
+def test_propagate_constants():
+    store = [('GLOBALI', 'n', 0), ('CONSTI', 4), ('STORE', 'n', GLOBAL, 0)]
+    load = ('LOAD', 'n', GLOBAL, 0)
+    assert propagate_constants(store + [load, ('PRINTI',)]) == store + [('CONSTI', 4), ('PRINTI',)]
+    assigned = store + [('CONSTI', 5), ('STORE', 'n', GLOBAL, 0), load, ('PRINTI',)]
+    assert propagate_constants(assigned) == assigned
+
+
+def test_bytecode():
+    code = [('CONSTI', 2), ('CONSTI', 3), ('ADDI',), ('PRINTI',)]
+    optimized = PassManager().run(encode(code))
+    assert isinstance(optimized, Bytecode)
+    assert run(optimized) == '5\n'
@@ -0,0 +1,128 @@
+# test_parallel.py
+#
+# parse_parallel() (parallel.py) against the serial Parser: the same
+# statements and the same diagnostics.  check_parallel() against
+# check_program(): the same diagnostics, annotations and IR.  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_parallel.py
+import os
+
+import pytest
+
+from compilers.wabbit import errors
+from compilers.wabbit.bench import function_program
+from compilers.wabbit.check import check_program
+from compilers.wabbit.errors import ParseError
+from compilers.wabbit.flat import FlatTree
+from compilers.wabbit.ircode import generate_module
+from compilers.wabbit.parallel import parse_parallel, check_parallel
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.test_flat import checked, model_annotations, flat_annotations, ir, ERRORS
+from compilers.wabbit.test_parse import flatten
+from compilers.wabbit.tokenizer import tokenize
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Tests')
+WORKERS = 2
+
+
+def diagnosed(parse, text):
+    """ The statements (or the ParseError) and the diagnostics of parsing text """
+    with errors.collecting(echo=False) as diagnostics:
+        try:
+            result = flatten(parse(text))
+        except ParseError as e:
+            result = (e.message, e.offset)
+    return result, [(d.severity, d.code, d.message, d.offset) for d in diagnostics], diagnostics.has_errors
+
+
+def serial(text):
+    return Parser(tokenize(text)).parse_statements()
+
+
+def parallel(text):
+    return parse_parallel(text, WORKERS)
+
+
+def functions(count, body='return a;'):
+    return ''.join(f'func f{n}(a int) int {{ {body} }}\n' for n in range(count))
+
+
+def test_test_programs():
+    for filename in ['fact.wb', 'fib.wb', 'mandel.wb', 'mandelplot.wb']:
+        with open(os.path.join(TESTS_DIR, filename), encoding='ascii') as f:
+            text = f.read()
+        assert diagnosed(parallel, text) == diagnosed(serial, text)
+
+
+def test_many_functions():
+    text = 'var g int = 1;\n' + functions(40, 'var b int = a * g; return b + 1;') + 'print f3(2);\n'
+    assert diagnosed(parallel, text) == diagnosed(serial, text)
+
+
+def test_tokenizer_errors():
+    text = functions(40, 'return a; @')
+    result, records, has_errors = diagnosed(parallel, text)
+    assert (result, records, has_errors) == diagnosed(serial, text)
+    assert len(records) == 40 and has_errors
+
+
+def test_parse_error():
+    # Tokenizer errors before the ParseError are reported, then it is raised
+    text = functions(10, 'return a; @') + 'func bad(a int) int { return a + ; }\n' + functions(10)
+    result, records, has_errors = diagnosed(parallel, text)
+    assert (result, records, has_errors) == diagnosed(serial, text)
+    assert isinstance(result, tuple) and len(records) == 10
+
+
+def test_max_errors():
+    text = functions(40, 'return a; @')
+    with errors.collecting(max_errors=5, echo=False) as diagnostics:
+        with pytest.raises(errors.TooManyErrors):
+            parallel(text)
+    assert diagnostics.error_count == 5
+
+
+# Globals used from function bodies, calls between functions, and errors
+# at the top level and in bodies (before, between and after functions)
+CHECK_PROGRAM = (
+    'var g int = 2;\nconst h = 1.5;\nprint g + h;\n'
+    + functions(30, 'var b int = a * g; return b + f0(a);')
+    + 'func broken(a int) int { var c float = a; return a + h; }\n'
+    + 'print f3(g) + broken(1);\nprint f99(1);\n'
+    + functions(30, 'return a + undefined;').replace('func f', 'func k')
+    + 'g = h;\n'
+)
+
+
+def check_both(text, max_errors=None):
+    model = serial(text)
+    tree = FlatTree.from_model(serial(text))
+    with errors.collecting(max_errors, echo=False) as diagnostics:
+        ok = check_parallel(tree, WORKERS)
+    result = (ok, [(d.severity, d.code, d.message, d.offset) for d in diagnostics], diagnostics.aborted)
+    assert result == checked(model, max_errors)
+    return model, tree, result
+
+
+def test_check_with_errors():
+    model, tree, (ok, records, _) = check_both(CHECK_PROGRAM)
+    assert not ok and len(records) == 35
+    assert flat_annotations(tree) == model_annotations(model)
+
+
+def test_check_error_kinds():
+    check_both(ERRORS + functions(10) + ERRORS)
+
+
+def test_check_max_errors():
+    for max_errors in (1, 3, 20):
+        _, _, (_, records, aborted) = check_both(CHECK_PROGRAM, max_errors)
+        assert aborted and len(records) == max_errors
+
+
+def test_check_and_compile():
+    for text in (function_program(40), functions(40, 'var b int = a * 2; return b + f0(a);') + 'print f7(3);\n'):
+        model, tree, (ok, records, _) = check_both(text)
+        assert ok and records == []
+        assert flat_annotations(tree) == model_annotations(model)
+        assert ir(generate_module(tree)) == ir(generate_module(model))
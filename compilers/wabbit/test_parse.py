@@ -0,0 +1,139 @@
+# test_parse.py
+#
+# The shape of expressions (precedence and associativity), then
+# StackParser (no recursion) against the recursive Parser.  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_parse.py
+import os
+
+from compilers.wabbit import errors
+from compilers.wabbit.check import check_program
+from compilers.wabbit.ir_code_interpreter import Interpreter
+from compilers.wabbit.ircode import generate_ircode
+from compilers.wabbit.model import Node, OPTIONAL_FIELDS, If, While, UnaryOperator, BinaryOperator
+from compilers.wabbit.parse import Parser, StackParser
+from compilers.wabbit.peg import parse_program
+from compilers.wabbit.tokenizer import tokenize
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Tests')
+DEEP = 100_000
+
+
+def nested_blocks(depth):
+    opening = ''.join('if x < 1 {\n' if n % 2 else 'while x < 1 {\n' for n in range(depth))
+    return 'var x int = 0;\n' + opening + 'x = x + 1;\n' + '}\n' * depth
+
+
+def nested_parens(depth):
+    return 'var x int = 0;\nprint ' + '-(' * depth + 'x' + ')' * depth + ';\n'
+
+
+def flatten(statements):
+    """ Every node, parents first, as (class, offset, fields that aren't nodes).  Not recursive """
+    flat = []
+    work = [statements]
+    while work:
+        item = work.pop()
+        if isinstance(item, list):
+            flat.append(('list', len(item)))
+            work.extend(reversed(item))
+        elif isinstance(item, Node):
+            values, children = [], []
+            for name in item._fields:
+                if name not in OPTIONAL_FIELDS:
+                    value = getattr(item, name, None)
+                    if isinstance(value, (Node, list)):
+                        children.append(value)
+                    else:
+                        values.append((name, value))
+            flat.append((type(item).__name__, item.offset, tuple(values)))
+            work.extend(reversed(children))
+        else:
+            flat.append(item)
+    return flat
+
+
+def parse(parser_class, text):
+    return parser_class(tokenize(text)).parse_statements()
+
+
+def shape(expression):
+    """ The expression with every operation in parentheses """
+    if isinstance(expression, BinaryOperator):
+        return f'({shape(expression.left)} {expression.operator} {shape(expression.right)})'
+    if isinstance(expression, UnaryOperator):
+        return f'({expression.operator}{shape(expression.operand)})'
+    return str(expression)
+
+
+EXPRESSIONS = [
+    ('10 - 4 - 3', '((10 - 4) - 3)', 3),
+    ('100 / 10 / 5', '((100 / 10) / 5)', 2),
+    ('2 * 6 / 3 * 2', '(((2 * 6) / 3) * 2)', 8),
+    ('-2 * 3 + 1', '(((-2) * 3) + 1)', -5),
+    ('2 + 3 * 4', '(2 + (3 * 4))', 14),
+    ('2 * 3 + 4 * 5 - 6', '(((2 * 3) + (4 * 5)) - 6)', 20),
+    ('(2 + 3) * 4', '((2 + 3) * 4)', 20),
+    ('1 - -2', '(1 - (-2))', 3),
+    ('1 + 2 < 2 * 2', '((1 + 2) < (2 * 2))', True),
+    ('10 - 4 > 2 + 3', '((10 - 4) > (2 + 3))', True),
+    ('10 - 4 >= 2 + 4', '((10 - 4) >= (2 + 4))', None),
+    ('2 * 3 > 3 + 4', '((2 * 3) > (3 + 4))', False),
+    ('1 < 2 && 3 > 4 || 5 != 6', '(((1 < 2) && (3 > 4)) || (5 != 6))', None),
+    ('1 < 2 || 3 > 4 && 5 != 6', '((1 < 2) || ((3 > 4) && (5 != 6)))', None),
+    ('!1 < 2', '((!1) < 2)', None),
+]
+
+
+def test_precedence_and_associativity():
+    for text, expected, _ in EXPRESSIONS:
+        for parse_text in (lambda t: parse(Parser, t), lambda t: parse(StackParser, t),
+                           lambda t: parse_program(tokenize(t))):
+            assert shape(parse_text(f'print {text};')[0].expression) == expected, text
+
+
+def test_results():
+    # What the parsed expressions compute (the ones the checker takes: no <=, >=, ==, && ... on ints)
+    for text, _, result in EXPRESSIONS:
+        if result is None:
+            continue
+        if isinstance(result, bool):  # A bool can't be printed
+            text, result = f'if {text} {{ print 1; }} else {{ print 0; }}', int(result)
+        else:
+            text = f'print {text};'
+        statements = parse(Parser, text)
+        with errors.collecting(echo=False):
+            assert check_program(statements)
+        printed = []
+        Interpreter(out=lambda value, end='': printed.append(value)).run(generate_ircode(statements))
+        assert printed == [result], text
+
+
+def test_same_model_as_parser():
+    texts = [nested_blocks(150), nested_parens(150),
+             'var a int = 1 + 2 * 3 - -4;\nwhile a < 10 { if a > 2 { a = (a + 1) * 2; } else { a = 1; } }\n']
+    for filename in sorted(os.listdir(TESTS_DIR)):
+        if filename.endswith('.wb'):
+            with open(os.path.join(TESTS_DIR, filename), encoding='ascii') as f:
+                texts.append(f.read())
+    for text in texts:
+        expected = flatten(parse(Parser, text))
+        assert flatten(parse(StackParser, text)) == expected
+
+
+def test_deep_blocks():
+    statements = parse(StackParser, nested_blocks(DEEP))
+    depth, block = 0, statements[1]
+    while isinstance(block, (If, While)):
+        depth += 1
+        block = block.consequence[0]
+    assert depth == DEEP
+
+
+def test_deep_parentheses():
+    statements = parse(StackParser, nested_parens(DEEP))
+    depth, expression = 0, statements[1].expression
+    while isinstance(expression, UnaryOperator):
+        depth += 1
+        expression = expression.operand
+    assert depth == DEEP
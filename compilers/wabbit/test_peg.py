@@ -0,0 +1,55 @@
+# test_peg.py
+#
+# The PEG engine (peg.py) running the Wabbit grammar against the hand
+# written Parser.  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_peg.py
+import os
+
+import pytest
+
+from compilers.wabbit.errors import ParseError
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.peg import parse_program, PEGParser
+from compilers.wabbit.test_parse import flatten, nested_parens
+from compilers.wabbit.tokenizer import tokenize
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Tests')
+MEMO_SIZES = [None, 100, 10]  # The default, and small enough that the memo table is cut down while parsing
+
+
+def same_model(text):
+    expected = flatten(Parser(tokenize(text)).parse_statements())
+    for max_memo in MEMO_SIZES:
+        statements = parse_program(tokenize(text)) if max_memo is None else parse_program(tokenize(text), max_memo)
+        assert flatten(statements) == expected
+
+
+def test_test_programs():
+    for filename in sorted(os.listdir(TESTS_DIR)):
+        if filename.endswith('.wb'):
+            with open(os.path.join(TESTS_DIR, filename), encoding='ascii') as f:
+                same_model(f.read())
+
+
+def test_expressions():
+    same_model('var a int = 1 + 2 * 3 - -4;\nprint (a + 1) * 2 / 3;\n'
+               'if a < 2 || a > 5 && !(a == 3) { a = int(2.5) + f(a, 1); } else { `a = ^4; }\n')
+    same_model(nested_parens(25))
+
+
+def test_syntax_error():
+    with pytest.raises(ParseError) as info:
+        parse_program(tokenize('var a int = 1;\nprint a +;\n'))
+    assert info.value.offset == len('var a int = 1;\nprint a +')  # The furthest token reached
+
+
+def test_grammar():
+    # A small grammar of its own: one or more NAMEs separated by commas
+    grammar = '''
+    names <- NAME (',' NAME)* EOF
+    '''
+    parser = PEGParser(grammar, {'names': lambda v, tok: [v[0].value] + [name.value for _, name in v[1]]})
+    assert parser.parse(tokenize('a, b, c')) == ['a', 'b', 'c']
+    with pytest.raises(ParseError):
+        parser.parse(tokenize('a, , c'))
@@ -0,0 +1,76 @@
+# test_resolve.py
+#
+# Name resolution (resolve.py): the (depth, slot) each declaration gets
+# and each name is bound to.  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_resolve.py
+from compilers.wabbit.model import Node, NamedLocation, OPTIONAL_FIELDS
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.resolve import resolve_program, GLOBAL, LOCAL
+from compilers.wabbit.tokenizer import tokenize
+
+PROGRAM = '''\
+var x int = 1;
+var y int = 2;
+func f(a int, x int) int {
+    var y int = a + x;
+    while a < y {
+        var x int = x + 1;
+        print x;
+    }
+    return x + y;
+}
+if x < y {
+    var z int = x;
+    print z;
+} else {
+    var z int = y;
+    print z + w;
+}
+print x + y + f(1, 2);
+'''
+
+
+def names(statements):
+    """ (name, depth, slot) of every NamedLocation, in the order they appear in the program """
+    found = []
+    work = [statements]
+    while work:
+        item = work.pop()
+        if isinstance(item, list):
+            work.extend(reversed(item))
+        elif isinstance(item, Node):
+            if isinstance(item, NamedLocation):
+                found.append((item.name, item.depth, item.slot))
+            work.extend(reversed([getattr(item, name, None) for name in item._fields if name not in OPTIONAL_FIELDS]))
+    return found
+
+
+def test_slots():
+    statements = Parser(tokenize(PROGRAM)).parse_statements()
+    assert resolve_program(statements) == 4  # x, y and the two z's
+    x, y, f, test, _ = statements
+    assert [(p.depth, p.slot) for p in f.parameters] == [(LOCAL, 0), (LOCAL, 1)]
+    assert (f.statements[0].depth, f.statements[0].slot) == (LOCAL, 2)
+    assert (f.statements[1].consequence[0].depth, f.statements[1].consequence[0].slot) == (LOCAL, 3)
+    assert [(z.depth, z.slot) for z in (test.consequence[0], test.alternative[0])] == [(GLOBAL, 2), (GLOBAL, 3)]
+    assert names(statements) == [
+        ('a', LOCAL, 0), ('x', LOCAL, 1),       # var y int = a + x;  (the parameter x)
+        ('a', LOCAL, 0), ('y', LOCAL, 2),       # while a < y
+        ('x', LOCAL, 1),                        # var x int = x + 1;  (still the parameter)
+        ('x', LOCAL, 3),                        # print x;  (the x of the block)
+        ('x', LOCAL, 1), ('y', LOCAL, 2),       # return x + y;  (the block has ended)
+        ('x', GLOBAL, 0), ('y', GLOBAL, 1),     # if x < y
+        ('x', GLOBAL, 0), ('z', GLOBAL, 2),
+        ('y', GLOBAL, 1), ('z', GLOBAL, 3), ('w', None, None),  # w is not declared
+        ('x', GLOBAL, 0), ('y', GLOBAL, 1),     # print x + y + f(1, 2);
+    ]
+
+
+def test_declarations():
+    statements = Parser(tokenize(PROGRAM)).parse_statements()
+    resolve_program(statements)
+    x, y, f, test, last = statements
+    assert f.statements[0].value.right.declaration is f.parameters[1]
+    assert test.test.left.declaration is x and last.expression.left.right.declaration is y
+    assert test.alternative[1].expression.right.declaration is None
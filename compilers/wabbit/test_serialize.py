@@ -0,0 +1,82 @@
+# test_serialize.py
+#
+# A checked model saved with serialize.dumps() and read back with
+# loads() must be the same model.  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_serialize.py
+import os
+
+import pytest
+
+from compilers.wabbit import errors
+from compilers.wabbit.check import check_program
+from compilers.wabbit.hashcons import Interner
+from compilers.wabbit.ircode import generate_module
+from compilers.wabbit.model import Node, NamedLocation
+from compilers.wabbit.parse import Parser, StackParser
+from compilers.wabbit.serialize import dumps, loads, MAGIC
+from compilers.wabbit.test_parse import flatten, nested_blocks, nested_parens, DEEP
+from compilers.wabbit.tokenizer import tokenize
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Tests')
+TEST_FILES = ['chartest.wb', 'fact.wb', 'fib.wb', 'floattest.wb', 'inttest.wb', 'mandel.wb', 'mandel_loop.wb']
+
+
+def checked(text, interner=None):
+    statements = Parser(tokenize(text), interner).parse_statements()
+    with errors.collecting(echo=False) as diagnostics:
+        check_program(statements)
+    assert not diagnostics.error_count
+    return statements
+
+
+def ircode(statements):
+    module = generate_module(statements)
+    return module.code, {name: function.code for name, function in module.functions.items()}
+
+
+def test_test_programs():
+    for filename in TEST_FILES:
+        with open(os.path.join(TESTS_DIR, filename), encoding='ascii') as f:
+            statements = checked(f.read())
+        loaded = loads(dumps(statements))
+        assert flatten(loaded) == flatten(statements)
+        assert ircode(loaded) == ircode(statements)  # Types, depths and slots came back too
+
+
+def distinct_nodes(statements):
+    """ id -> node for every node in statements, a shared one once """
+    found = {}
+    work = [statements]
+    while work:
+        item = work.pop()
+        if isinstance(item, list):
+            work.extend(item)
+        elif isinstance(item, Node) and id(item) not in found:
+            found[id(item)] = item
+            work.extend(getattr(item, name, None) for name in item._fields if name != 'declaration')
+    return found
+
+
+def test_declarations_and_sharing():
+    with open(os.path.join(TESTS_DIR, 'mandel.wb'), encoding='ascii') as f:
+        statements = checked(f.read(), Interner())
+    loaded = loads(dumps(statements))
+    originals, copies = distinct_nodes(statements), distinct_nodes(loaded)
+    assert len(copies) == len(originals)  # Shared nodes are still shared
+    names = [node for node in copies.values() if isinstance(node, NamedLocation)]
+    assert names and all(id(node.declaration) in copies and node.declaration.name == node.name for node in names)
+
+
+def test_deep_nesting():
+    for text in (nested_blocks(DEEP), nested_parens(DEEP)):
+        statements = StackParser(tokenize(text)).parse_statements()
+        assert flatten(loads(dumps(statements))) == flatten(statements)
+
+
+def test_bad_data():
+    data = dumps(checked('var x int = 1;\nprint x;\n'))
+    with pytest.raises(ValueError):
+        loads(b'junk' + data)
+    with pytest.raises(ValueError):
+        loads(MAGIC + b'\x7f' + data[len(MAGIC) + 1:])  # Another version
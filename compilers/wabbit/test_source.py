@@ -0,0 +1,70 @@
+# test_source.py
+#
+# SourceIndex (source.py): offsets to line and column.  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_source.py
+from compilers.wabbit import source
+from compilers.wabbit.source import SourceIndex
+
+TEXT = 'var x int;\nprint x;\n\nprint 1 + 2;\n'
+CRLF = TEXT.replace('\n', '\r\n')
+
+
+def positions(text):
+    """ (line, column) of every offset of text, counted the slow way """
+    found = []
+    line, column = 1, 1
+    for char in text:
+        found.append((line, column))
+        line, column = (line + 1, 1) if char == '\n' else (line, column + 1)
+    found.append((line, column))  # The end of the text
+    return found
+
+
+def write(tmp_path, text, name='prog.wb'):
+    path = tmp_path / name
+    path.write_bytes(text.encode('utf-8'))
+    return str(path)
+
+
+def test_every_offset():
+    for text in (TEXT, CRLF, 'no newline', '\n\n\n', ''):
+        index = SourceIndex(text)
+        assert [index.position(offset) for offset in range(len(text) + 1)] == positions(text)
+
+
+def test_first_and_last_line():
+    index = SourceIndex(TEXT)
+    assert index.position(0) == (1, 1)
+    assert index.position(TEXT.index('print 1')) == (4, 1)
+    assert index.position(len(TEXT) - 1) == (4, 13)  # The last newline
+    assert index.position(len(TEXT)) == (5, 1)
+
+
+def test_newlines():
+    index = SourceIndex(TEXT)
+    first = TEXT.index('\n')
+    assert index.position(first) == (1, 11)  # A newline is the last column of its line
+    assert index.position(first + 1) == (2, 1)
+    assert index.position(TEXT.index('\n\n') + 1) == (3, 1)  # An empty line
+
+
+def test_crlf():
+    index = SourceIndex(CRLF)
+    assert index.position(CRLF.index('\r')) == (1, 11)
+    assert index.position(CRLF.index('\n')) == (1, 12)
+    assert index.position(CRLF.index('print 1')) == (4, 1)
+
+
+def test_from_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(source, 'CHUNK_SIZE', 7)  # Lines cut by the chunks
+    for text in (TEXT, CRLF, 'ä = 1;\n€\n'):
+        index = SourceIndex.from_file(write(tmp_path, text))
+        assert [index.position(offset) for offset in range(len(text) + 1)] == positions(text)
+        assert index.line_starts == SourceIndex(text).line_starts
+
+
+def test_describe(tmp_path):
+    filename = write(tmp_path, CRLF)
+    assert SourceIndex.from_file(filename).describe(CRLF.index('print 1')) == f'{filename}:4:1'
+    assert SourceIndex(CRLF).describe(CRLF.index('print 1')) == '4:1'
@@ -0,0 +1,123 @@
+# test_ssa.py
+#
+# IR code converted to SSA form and back (ssa.py) must do what the
+# original does: print the same, and return the same from functions.
+# Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_ssa.py
+import contextlib
+import io
+import os
+
+import pytest
+
+from compilers.wabbit import errors
+from compilers.wabbit.check import check_program
+from compilers.wabbit.ir_code_interpreter import Interpreter
+from compilers.wabbit.ircode import IRFunction, generate_module
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.ssa import to_ssa, from_ssa, global_types
+from compilers.wabbit.tokenizer import tokenize
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Tests')
+TEST_FILES = ['fact.wb', 'fib.wb', 'floattest.wb', 'inttest.wb', 'chartest.wb', 'mandel.wb']
+
+
+def compile_module(text):
+    statements = Parser(tokenize(text)).parse_statements()
+    with errors.collecting(echo=False) as diagnostics:
+        check_program(statements)
+    assert not diagnostics.error_count
+    return generate_module(statements)
+
+
+def function_round_trip(function, memory=None):
+    """ A copy of an IRFunction with its code converted to SSA form and back """
+    copy = IRFunction(function.name, function.parameters, function.return_type)
+    copy.code = from_ssa(to_ssa(function.code, function.parameters, memory))
+    return copy
+
+
+def run(code, functions=None):
+    """ What a program prints: its code, then main() if it has one """
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        interpreter = Interpreter(functions=functions)
+        interpreter.run(code)
+        if functions and 'main' in functions:
+            interpreter.call('main')
+    return out.getvalue()
+
+
+def round_trip(text):
+    """ The program with its code and the functions that make no calls round-tripped """
+    module = compile_module(text)
+    memory = global_types(module.code)
+    functions = {name: function if any(i[0] == 'CALL' for i in function.code) else function_round_trip(function, memory)
+                 for name, function in module.functions.items()}
+    back = from_ssa(to_ssa(module.code))
+    assert run(back, functions) == run(module.code, module.functions)
+    return back
+
+
+def test_test_programs():
+    for filename in TEST_FILES:
+        with open(os.path.join(TESTS_DIR, filename), encoding='ascii') as f:
+            round_trip(f.read().replace('threshhold = 1000', 'threshhold = 50'))  # mandel.wb, slow in the interpreter
+
+
+def test_swap_in_loop():
+    round_trip('var a int = 1;\nvar b int = 2;\nvar t int = 0;\nvar i int = 0;\n'
+               'while i < 5 { i = i + 1; t = a; a = b; b = t; print a; }\nprint b;\n')
+
+
+def test_unread_loop_phi():
+    # g is stored to in the loop, so the loop header has a phi for it, but
+    # nothing reads it after the last store
+    text = ('var g int = 1;\nvar a int = 0;\nvar i int = 0;\n'
+            'while i < 4 { i = i + 1; g = i; g = g + i; }\na = g;\n')
+    round_trip(text)
+    round_trip(text + 'print a;\n')
+
+
+def test_function():
+    module = compile_module('var g int = 5;\nfunc sq(x int) int { return x * x; }\nprint sq(7);\nprint g;\n')
+    functions = {'sq': function_round_trip(module.functions['sq'])}
+    assert Interpreter(functions=functions).call('sq', 7) == 49
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        Interpreter(functions=functions).run(module.code)
+    assert out.getvalue() == '49\n5\n'  # The temporaries of sq don't touch g
+
+
+def test_function_with_loop():
+    with open(os.path.join(TESTS_DIR, 'mandel.wb'), encoding='ascii') as f:
+        module = compile_module(f.read())
+    function = module.functions['in_mandelbrot']  # Assigns its parameter n in a loop
+    functions = {'in_mandelbrot': function_round_trip(function)}
+    for x in range(-20, 10, 3):
+        for y in range(-15, 15, 4):
+            args = (x / 10, y / 10, 1000)
+            expected = Interpreter(functions={'in_mandelbrot': function}).call('in_mandelbrot', *args)
+            assert Interpreter(functions=functions).call('in_mandelbrot', *args) == expected
+
+
+def test_function_assigns_global():
+    module = compile_module('var g int = 1;\nvar h float = 0.5;\n'
+                            'func bump(n int) int { g = g + n; h = h * 2.0; return g; }\n'
+                            'func main() int { print bump(2); print g; print bump(3); print h; return g; }\n')
+    functions = dict(module.functions, bump=function_round_trip(module.functions['bump'], global_types(module.code)))
+    assert run(module.code, functions) == '3\n3\n6\n2.0\n'
+
+
+def test_globals_at_exit():
+    # The code of the program stores nothing that it reads itself, but
+    # main() reads what it leaves in the globals
+    round_trip('const w = 80.0;\nvar n int = 3;\nn = n + 1;\nfunc main() int { print w; print n; return 0; }\n')
+
+
+def test_undeclared_variable():
+    module = compile_module('var g int = 5;\nfunc get() int { return g; }\nprint get();\n')
+    function = module.functions['get']
+    with pytest.raises(ValueError):
+        to_ssa(function.code, function.parameters)  # g is in memory, not a variable of the function
@@ -1,5 +1,6 @@
 from time import sleep
 
+from compilers.wabbit import errors
 from compilers.wabbit.check import check_program
 from compilers.wabbit.ircode import generate_ircode
 from compilers.wabbit.parse import Parser
@@ -12,9 +13,12 @@ with open('../Tests/mandel_loop.wb', 'r', encoding='ascii') as f:
 # for token in tokenize(input_wabbit_code):
 #     print(token)
 sleep(0.2)
-tokens = tokenize(input_wabbit_code)
-parsed_tokens = Parser(tokens).parse_statements()
-check_program(parsed_tokens)
+with errors.collecting(max_errors=20) as diagnostics:
+    tokens = tokenize(input_wabbit_code)
+    parsed_tokens = Parser(tokens).parse_statements()
+    check_program(parsed_tokens)
+if diagnostics.has_errors:
+    raise SystemExit(f'{diagnostics.error_count} errors, no code generated')
 ircode = generate_ircode(parsed_tokens)
 
 encoder = WasmEncoder()
@@ -0,0 +1,167 @@
+# test_tokenizer.py
+#
+# The tokenizer (tokenizer.py): tokenize() against the tokens expected,
+# then tokenize_file() in chunks and TokenStream against tokenize() on
+# the whole text.  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_tokenizer.py
+import os
+import re
+from io import BytesIO
+
+from compilers.wabbit import errors
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.test_parse import flatten
+from compilers.wabbit.tokenizer import tokenize, tokenize_file, TokenStream, KIND_CODES
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Tests')
+CHUNK_SIZES = (1, 2, 3, 5, 7, 16, 1 << 16)
+
+EDGES = '''\
+/* a block comment */ var x int = 10; // a line comment
+const c = '\\x41';  print '\\n'; print '\\''; print 'a';
+/* a comment
+   over lines */ print x <= 1.5 * .5 + 3.;
+print x >= 2 && x != 3 || !(x == 4); @ `x = 1; $
+// à line comment wïth ünicode
+print 'z'; /*/ still a comment */ print 0;
+print 1 // a line comment at the end'''
+
+
+def read_tests():
+    for filename in sorted(os.listdir(TESTS_DIR)):
+        if filename.endswith('.wb'):
+            with open(os.path.join(TESTS_DIR, filename), encoding='utf-8', newline='') as f:
+                yield f.read()
+
+
+def tokenized(tokens):
+    """ (type, value, offset) of each token and the diagnostics, as they are printed """
+    with errors.collecting(echo=False) as diagnostics:
+        tokens = [(t.type, t.value, t.offset) for t in tokens]
+        return tokens, [str(d) for d in diagnostics]
+
+
+# Whatever may come between two tokens
+SKIPPED = re.compile(r'(?:[ \t\n]+|//[^\n]*|/\*.*?\*/)*', re.DOTALL)
+
+FACT = [
+    ('VAR', 'var', 34), ('NAME', 'n', 38), ('NAME', 'int', 40), ('ASSIGN', '=', 44), ('INT', '1', 46),
+    ('SEMI', ';', 47),
+    ('VAR', 'var', 49), ('NAME', 'value', 53), ('NAME', 'int', 59), ('ASSIGN', '=', 63), ('INT', '1', 65),
+    ('SEMI', ';', 66),
+    ('WHILE', 'while', 69), ('NAME', 'n', 75), ('LT', '<', 77), ('INT', '10', 79), ('LBRACE', '{', 82),
+    ('NAME', 'value', 88), ('ASSIGN', '=', 94), ('NAME', 'value', 96), ('TIMES', '*', 102), ('NAME', 'n', 104),
+    ('SEMI', ';', 105),
+    ('PRINT', 'print', 111), ('NAME', 'value', 117), ('SEMI', ';', 123),
+    ('NAME', 'n', 129), ('ASSIGN', '=', 131), ('NAME', 'n', 133), ('PLUS', '+', 135), ('INT', '1', 137),
+    ('SEMI', ';', 138),
+    ('RBRACE', '}', 140),
+]
+
+
+def test_fact():
+    with open(os.path.join(TESTS_DIR, 'fact.wb'), encoding='utf-8') as f:
+        assert tokenized(tokenize(f.read())) == (FACT, [])
+
+
+def test_test_programs():
+    # Every token is where it says it is, and only whitespace and comments are left out
+    for text in read_tests():
+        tokens, messages = tokenized(tokenize(text))
+        assert messages == []
+        index = 0
+        for type, value, offset in tokens:
+            assert SKIPPED.fullmatch(text, index, offset)
+            index = offset + (len(value) if type != 'CHAR' else text.index("'", offset + 2) + 1 - offset)
+            assert text[offset:index] == value or type == 'CHAR'
+        assert SKIPPED.fullmatch(text, index)
+
+
+def test_chars():
+    text = "'a' '\\n' '\\'' '\\\\' '\\x41' '\\x0a' ' ' '\"'"
+    assert [t[:2] for t in tokenized(tokenize(text))[0]] == \
+        [('CHAR', 'a'), ('CHAR', '\n'), ('CHAR', "'"), ('CHAR', '\\'), ('CHAR', 'A'), ('CHAR', '\n'), ('CHAR', ' '),
+         ('CHAR', '"')]
+
+
+def test_numbers_and_symbols():
+    assert [t[:2] for t in tokenized(tokenize('1 12. .5 1.25 <= < == = != ! && || ^ `'))[0]] == \
+        [('INT', '1'), ('FLOAT', '12.'), ('FLOAT', '.5'), ('FLOAT', '1.25'), ('LE', '<='), ('LT', '<'),
+         ('EQ', '=='), ('ASSIGN', '='), ('NE', '!='), ('LNOT', '!'), ('LAND', '&&'), ('LOR', '||'),
+         ('GROW', '^'), ('DEREF', '`')]
+
+
+def test_keywords_and_names():
+    text = 'print printx _print if1 true false truex var int func import while else'
+    assert [t[:2] for t in tokenized(tokenize(text))[0]] == \
+        [('PRINT', 'print'), ('NAME', 'printx'), ('NAME', '_print'), ('NAME', 'if1'), ('BOOL', 'true'),
+         ('BOOL', 'false'), ('NAME', 'truex'), ('VAR', 'var'), ('NAME', 'int'), ('FUNC', 'func'),
+         ('IMPORT', 'import'), ('WHILE', 'while'), ('ELSE', 'else')]
+
+
+def test_comments():
+    assert tokenized(tokenize('print 1; //')) == ([('PRINT', 'print', 0), ('INT', '1', 6), ('SEMI', ';', 7)], [])
+    assert tokenized(tokenize('print 1 // two\n;')) == \
+        ([('PRINT', 'print', 0), ('INT', '1', 6), ('SEMI', ';', 15)], [])
+    assert tokenized(tokenize('1 /* a */ 2 /**/ 3 /*/ 4 */ 5')) == \
+        ([('INT', '1', 0), ('INT', '2', 10), ('INT', '3', 17), ('INT', '5', 28)], [])
+    assert tokenized(tokenize('print 1;\n/* no end\nprint 2;')) == \
+        ([('PRINT', 'print', 0), ('INT', '1', 6), ('SEMI', ';', 7)], ['2:1: Unterminated Comment'])
+
+
+def test_illegal_chars():
+    assert tokenized(tokenize('print 1 @ 2 $;\n#')) == \
+        ([('PRINT', 'print', 0), ('INT', '1', 6), ('INT', '2', 10), ('SEMI', ';', 13)],
+         ["1:9: Illegal char '@'", "1:13: Illegal char '$'", "2:1: Illegal char '#'"])
+    # A quote that doesn't make a char literal
+    assert tokenized(tokenize("print 'ab';"))[1] == ["1:7: Illegal char \"'\"", "1:10: Illegal char \"'\""]
+
+
+def texts():
+    yield from read_tests()
+    yield EDGES
+    yield EDGES + '\n/* unterminated'
+    yield 'print 1; /*' + ' long comment ' * 1000 + '*/ print 2; //' + ' long line' * 1000 + '\nprint 3;'
+    yield 'print 1; /*' + ' long comment ' * 1000
+
+
+def test_chunks():
+    for text in texts():
+        expected = tokenized(tokenize(text))
+        for chunk_size in CHUNK_SIZES:
+            assert tokenized(tokenize_file(BytesIO(text.encode('utf-8')), chunk_size)) == expected, chunk_size
+
+
+def test_path(tmp_path):
+    path = tmp_path / 'edges.wb'
+    path.write_bytes(EDGES.encode('utf-8'))
+    tokens, messages = tokenized(tokenize_file(str(path), 7))
+    expected_tokens, expected_messages = tokenized(tokenize(EDGES))
+    assert tokens == expected_tokens
+    assert messages == [f'{path}:{message}' for message in expected_messages]
+
+
+def test_file_object_positions():
+    # Positions come from the text read, not from the last source registered
+    tokenized(tokenize('print 1; @'))
+    assert tokenized(tokenize_file(BytesIO(b'print 1;\n\n\nprint 2; @\n')))[1] == ["4:10: Illegal char '@'"]
+    assert tokenized(tokenize_file(BytesIO(b'print 1;\r\n\r\n/* no end\n'), 3))[1] == \
+        ["1:9: Illegal char '\\r'", "2:1: Illegal char '\\r'", '3:1: Unterminated Comment']
+
+
+def test_token_stream():
+    for text in texts():
+        tokens, messages = tokenized(tokenize(text))
+        with errors.collecting(echo=False) as diagnostics:
+            stream = TokenStream.from_text(text)
+        assert [str(d) for d in diagnostics] == messages
+        assert tokenized(stream) == (tokens, [])
+        assert [t.kind for t in stream] == list(stream.kinds) == [KIND_CODES[t[0]] for t in tokens]
+        assert [(stream.type(n), stream.value(n)) for n in range(len(stream))] == [t[:2] for t in tokens]
+
+
+def test_token_stream_parse():
+    for text in read_tests():
+        assert flatten(Parser(TokenStream.from_text(text)).parse_statements()) == \
+            flatten(Parser(tokenize(text)).parse_statements())
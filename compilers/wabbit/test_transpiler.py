@@ -0,0 +1,64 @@
+# test_transpiler.py
+#
+# The Python source from ir_code_transpiler.py must print what the IR
+# code prints in the interpreter.  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_transpiler.py
+import contextlib
+import io
+import os
+
+from compilers.wabbit import errors
+from compilers.wabbit.check import check_program
+from compilers.wabbit.ir_code_interpreter import Interpreter
+from compilers.wabbit.ir_code_transpiler import Transpiler
+from compilers.wabbit.ircode import generate_ircode
+from compilers.wabbit.parse import Parser
+from compilers.wabbit.tokenizer import tokenize
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Tests')
+TEST_FILES = ['chartest.wb', 'fact.wb', 'fib.wb', 'floattest.wb', 'inttest.wb', 'mandel_loop.wb']
+
+
+def compile_ircode(text):
+    statements = Parser(tokenize(text)).parse_statements()
+    with errors.collecting(echo=False) as diagnostics:
+        check_program(statements)
+    assert not diagnostics.error_count
+    return generate_ircode(statements)
+
+
+def printed(function, *args):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        function(*args)
+    return out.getvalue()
+
+
+def transpile(code):
+    transpiler = Transpiler()
+    transpiler.translate(code)
+    return transpiler.source
+
+
+def check_same_output(text):
+    code = compile_ircode(text)
+    source = transpile(code)
+    assert printed(exec, source, {}) == printed(Interpreter().run, code)
+
+
+def test_test_programs():
+    for filename in TEST_FILES:
+        with open(os.path.join(TESTS_DIR, filename), encoding='ascii') as f:
+            check_same_output(f.read().replace('threshhold = 1000', 'threshhold = 50'))  # Slow in the interpreter
+
+
+def test_shadowed_names():
+    # Each block declares its own y (another slot with the same name)
+    check_same_output('var i int = 0;\n'
+                      'while i < 3 { if i < 1 { var y int = 10; print y; } else { var y int = i; print y; } i = i + 1; }\n')
+
+
+def test_if_else_and_division():
+    check_same_output('var a int = -7;\nif a < 0 { print a / 2; } else { }\n'
+                      'if a > 0 { } else { print 7 / -2; print 7.0 / 2.0; }\n')
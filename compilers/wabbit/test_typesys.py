@@ -0,0 +1,55 @@
+# test_typesys.py
+#
+# The interned types and the dense operator tables (typesys.py)
+# against the dicts they are built from.  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_typesys.py
+import pickle
+
+from compilers.wabbit.typesys import TYPES, INT, FLOAT, BOOL, CHAR, BINARY_OPS, UNARY_OPS, TYPE_CASTS, \
+    binary_ops, unary_ops, type_casts, check_binop, check_unop, check_typecast, intern_type, type_id
+
+OPERATORS = ['+', '-', '*', '/', '<', '<=', '>', '>=', '==', '!=', '&&', '||', '!', '^', '%']
+
+
+def test_types():
+    assert [t.id for t in TYPES] == list(range(len(TYPES)))
+    assert INT == 'int' and hash(FLOAT) == hash('float') and str(BOOL) == 'bool'
+    assert intern_type('char') is CHAR and intern_type('string') == 'string' and intern_type(None) is None
+    assert pickle.loads(pickle.dumps(CHAR)) is CHAR
+    assert type_id('float') == type_id(FLOAT) == 1 and type_id('string') is None and type_id(None) is None
+
+
+def test_binary_ops():
+    assert set(BINARY_OPS) == {op for _, op, _ in binary_ops}
+    for op in OPERATORS:
+        for left in TYPES:
+            for right in TYPES:
+                expected = binary_ops.get((left, op, right))
+                if op in BINARY_OPS:
+                    assert BINARY_OPS[op][left.id][right.id] is expected
+                assert check_binop(left, op, right) is expected
+                assert check_binop(str(left), op, str(right)) is expected  # Names that weren't interned
+            assert check_binop(left, op, None) is None and check_binop(None, op, left) is None
+
+
+def test_unary_ops():
+    assert set(UNARY_OPS) == {op for op, _ in unary_ops}
+    for op in OPERATORS:
+        for operand in TYPES:
+            expected = unary_ops.get((op, operand))
+            if op in UNARY_OPS:
+                assert UNARY_OPS[op][operand.id] is expected
+            assert check_unop(op, operand) is expected
+            assert check_unop(op, str(operand)) is expected
+        assert check_unop(op, None) is None
+
+
+def test_type_casts():
+    for from_type in TYPES:
+        for to_type in TYPES:
+            expected = type_casts.get((from_type, to_type))
+            assert TYPE_CASTS[from_type.id][to_type.id] is expected
+            assert check_typecast(from_type, to_type) is expected
+            assert check_typecast(str(from_type), str(to_type)) is expected
+        assert check_typecast(from_type, None) is None and check_typecast(None, from_type) is None
@@ -0,0 +1,69 @@
+# test_visitor.py
+#
+# Dispatching on the class of a node (visitor.py).  Run with:
+#
+#     bash % python3 -m pytest compilers/wabbit/test_visitor.py
+import pytest
+
+from compilers.wabbit.check import CHECKERS, check_Literal, check_NamedLocation, check_object
+from compilers.wabbit.model import Node, Literal, Integer, Float, NamedLocation, Print
+from compilers.wabbit.visitor import Dispatcher, Visitor, functions
+
+
+def handle_Literal(node):
+    return 'literal'
+
+
+def handle_Integer(node):
+    return 'integer'
+
+
+def test_parent_handler_cached():
+    looked_up = []
+
+    def find(cls):
+        looked_up.append(cls)
+        return {Literal: handle_Literal}.get(cls)
+
+    handlers = Dispatcher(find)
+    assert handlers[Integer] is handle_Literal
+    assert looked_up == [Integer, Literal]  # Up the __mro__ until there is one
+    assert handlers[Integer] is handle_Literal and Integer in handlers
+    assert looked_up == [Integer, Literal]  # The second time it's a dict lookup
+    assert handlers[Float] is handle_Literal
+    assert looked_up == [Integer, Literal, Float, Literal]
+
+
+def test_own_handler_first():
+    handlers = functions({'handle_Literal': handle_Literal, 'handle_Integer': handle_Integer}, 'handle_')
+    assert handlers[Integer](Integer(1)) == 'integer'
+    assert handlers[Float](Float(1.0)) == 'literal'
+
+
+def test_no_handler():
+    handlers = functions({'handle_Literal': handle_Literal}, 'handle_')
+    with pytest.raises(TypeError, match='No handler for Print'):
+        handlers[Print]
+    assert Print not in handlers
+
+
+def test_visitor():
+    class Names(Visitor):
+        prefix = 'name_'
+
+        def name_Node(self, node, suffix):
+            return 'node' + suffix
+
+        def name_NamedLocation(self, node, suffix):
+            return node.name + suffix
+
+    names = Names()
+    assert names.visit(NamedLocation('x'), '!') == 'x!'
+    assert names.visit(Integer(1), '!') == 'node!'
+    assert Names._handlers[Integer] is Names.name_Node
+
+
+def test_checkers():
+    assert CHECKERS[Integer] is check_Literal
+    assert CHECKERS[NamedLocation] is check_NamedLocation
+    assert CHECKERS[Node] is check_object  # The one for object, which raises
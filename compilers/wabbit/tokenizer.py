@@ -37,13 +37,40 @@ error messages:
 
 '''
 
+import codecs
+import os
 import re
+from array import array
+from itertools import repeat
+
+from compilers.wabbit import errors
+from compilers.wabbit.source import SourceIndex
+
+
+# All token types.  Each type is also numbered by its position here (its
+# "kind").  Parsers test kinds against precomputed bit masks instead of
+# comparing strings, see parse.py.
+TOKEN_KINDS = (
+    'EOF', 'NAME', 'INT', 'FLOAT', 'CHAR',
+    # Keywords
+    'CONST', 'VAR', 'PRINT', 'RETURN', 'BREAK', 'CONTINUE', 'IF', 'ELSE', 'WHILE', 'FUNC', 'IMPORT', 'BOOL',
+    # Operators
+    'PLUS', 'MINUS', 'TIMES', 'DIVIDE', 'LT', 'LE', 'GT', 'GE', 'EQ', 'NE', 'LAND', 'LOR', 'LNOT', 'GROW',
+    # Miscellaneous Symbols
+    'ASSIGN', 'SEMI', 'LPAREN', 'RPAREN', 'LBRACE', 'RBRACE', 'COMMA', 'DEREF',
+)
+
+KIND_CODES = {kind: code for code, kind in enumerate(TOKEN_KINDS)}
 
 
 class Token:
-    def __init__(self, type, value):
+    __slots__ = ('type', 'value', 'offset', 'kind')
+
+    def __init__(self, type, value, offset=None, kind=None):
         self.type = type  # what it is
         self.value = value  # text
+        self.offset = offset  # where it is (see source.py for line numbers)
+        self.kind = KIND_CODES[type] if kind is None else kind  # what it is, as a number
 
     def __repr__(self):
         return f'Token({self.type}, {self.value})'
@@ -94,79 +121,255 @@ known_tokens = {
 
 }
 
-FLOAT_OR_INT_REGEX = re.compile(r"""
-            ^         # Start of pattern: don't swallow characters before number!
-            \.*       # Floats may start with a decimal point
-            [0-9]+    # Then any number of numeric characters
-            \.*       # Then maybe a decmial point
-            [0-9]*    # Then maybe some more characters
-            """, re.VERBOSE)
+KEYWORD_CODES = {text: tok.kind for text, tok in RESERVED_KEYWORDS.items()}
+SYMBOL_CODES = {text: tok.kind for text, tok in known_tokens.items()}
+NAME_KIND, INT_KIND, FLOAT_KIND, CHAR_KIND = (KIND_CODES[kind] for kind in ('NAME', 'INT', 'FLOAT', 'CHAR'))
+
+# Master pattern for the scanner.  Each alternative is a named group and the
+# name of the group that matched (match.lastgroup) tells us what was found.
+# Order matters: comments must be tried before '/', floats before ints.
+TOKEN_REGEX = re.compile(r"""
+      (?P<WHITESPACE>[ \t\n]+)
+    | (?P<BLOCK_COMMENT>/\*.*?\*/)
+    | (?P<UNTERMINATED_COMMENT>/\*)
+    | (?P<LINE_COMMENT>//[^\n]*)
+    | (?P<CHAR>'(?:\\x[0-9a-fA-F]{2}|\\.|[^\\'\n])')
+    | (?P<FLOAT>[0-9]+\.[0-9]*|\.[0-9]+)
+    | (?P<INT>[0-9]+)
+    | (?P<NAME>[_a-zA-Z][_a-zA-Z0-9]*)
+    | (?P<SYMBOL><=|>=|==|!=|&&|\|\||[-+*/<>!^=;(){},`])
+    | (?P<ILLEGAL>.)
+    """, re.VERBOSE | re.DOTALL)
+
+CHAR_ESCAPES = {
+    'n': '\n',
+    "'": "'",
+    '\\': '\\',
+}
+
+
+def decode_char(literal):
+    """ Turn the source text of a character literal (quotes included) into the character """
+    body = literal[1:-1]
+    if len(body) == 1:
+        return body
+    if body[1] == 'x':
+        return chr(int(body[2:], 16))
+    if body[1] in CHAR_ESCAPES:
+        return CHAR_ESCAPES[body[1]]
+    raise ValueError(f'Unsupported Char!! {literal}')
+
+
+# Longest stretch at the end of a chunk where a token may still be cut in
+# two by the chunk boundary (the longest fixed size token is '\xhh').
+LOOKAHEAD = 6
+
+CHUNK_SIZE = 1 << 16
 
 
 def tokenize(text):
+    """
+    Single pass scanner.  The master regex is matched at the current position
+    (no slicing of the text) so tokenizing is linear in the size of the input.
+    """
+    errors.set_source(text)
+    return _scan(text, 0, True)
+
+
+def tokenize_file(source, chunk_size=CHUNK_SIZE):
+    """
+    Tokenize a file given as a path or as a binary file object.  The file is
+    read in fixed size chunks so memory use stays flat however big the
+    program is.  Produces the same tokens as tokenize(f.read()).  Error
+    positions of a path are found by reading the file again if needed, those
+    of a file object from the line starts recorded while reading it.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        errors.set_source(SourceIndex.from_file(source))
+        with open(source, 'rb') as f:
+            yield from _scan_chunks(f, chunk_size)
+        return
+
+    name = getattr(source, 'name', None)
+    index = SourceIndex.from_stream(name if isinstance(name, str) else None)
+    errors.set_source(index)
+    yield from _scan_chunks(source, chunk_size, index.add)
+
+
+def _scan_chunks(f, chunk_size, add_text=None):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    text = ''
     index = 0
-    while index < len(text):
-        # Produce a token
-
-        # Skip Comments
-        if text[index:index + 2] == '/*':
-            end = text.find('*/', index + 2)
-            if end >= 0:
-                index = end + 2
-            else:
-                print("Unterminated Comment")
-                index = len(text)
-
-        elif text[index:index + 2] == '//':
-            index_of_next_newline = text.find('\n', index)
-            index = len(text) if index_of_next_newline == -1 else index_of_next_newline
-
-        elif re.match("^'.*'", text[index:]):
-            match = re.match("'.*'", text[index:]).group(0)
-            if match == "'\\n'":
-                single_character = "\n"
-            elif len(match) == 3:
-                single_character = match[1]
-            else:
-                raise ValueError(f'Unsupported Char!! {match}')
-            yield Token('CHAR', single_character)
-            index += len(match)
-
-        # Skip white space
-        elif text[index] in ' \t\n':
-            index += 1
-            continue
+    base = 0        # Offset of text[0] in the file
+    closing = None  # '*/' or '\n' while in a comment whose end hasn't been read yet
+    comment = None  # ... and the offset of the comment
+    final = False
+    while not final:
+        chunk = f.read(chunk_size)
+        final = not chunk
+        decoded = decoder.decode(chunk, final)
+        if add_text is not None:
+            add_text(decoded)
+        # Carry over the unscanned tail: tokens, comments or char literals cut by the boundary
+        text = text[index:] + decoded
+        base += index
+        index = 0
+        if closing is not None:
+            close = text.find(closing)
+            if close < 0:
+                if final and closing == '*/':
+                    errors.error("Unterminated Comment", comment, 'comment')
+                index = max(len(text) - len(closing) + 1, 0)  # Only keep what may be the start of closing
+                continue
+            index = close + len(closing)
+            closing = None
+        index = yield from _scan(text, index, final, base)
+        if final:
+            break
+        # A comment that goes on past the end of text.  Only look for its end in
+        # the text that follows, instead of matching it from its start again with
+        # every chunk.
+        if text.startswith('/*', index) and text.find('*/', index + 2) < 0:
+            closing, comment = '*/', base + index
+            index = max(len(text) - 1, index + 2)
+        elif text.startswith('//', index) and text.find('\n', index) < 0:
+            closing, comment = '\n', base + index
+            index = len(text)
+
+
+def _scan(text, index, final, base=0, stream=None):
+    """
+    Produce the tokens in text starting at index.  If final is False, more text
+    may follow so scanning stops in front of anything that could continue past
+    the end.  Returns the index where scanning stopped.  Token offsets are
+    relative to base.  Given a TokenStream, the tokens are added to its arrays
+    instead (and nothing is produced).
+    """
+    if stream is not None:
+        add_kind, add_start, add_end = stream.kinds.append, stream.starts.append, stream.ends.append
+    match = TOKEN_REGEX.match
+    end = len(text)
+    limit = end - LOOKAHEAD
+    while index < end:
+        m = match(text, index)
+        kind = m.lastgroup
+        if not final and (m.end() > limit or kind == 'UNTERMINATED_COMMENT'):
+            return index
+        start = index
+        index = m.end()
 
-        # Get names and keywords
-        elif re.match(r'[_a-zA-Z][_a-zA-Z0-9]*', text[index:]):
-            m = re.match(r'[_a-zA-Z][_a-zA-Z0-9]*', text[index:]).group(0)
-            if m in RESERVED_KEYWORDS:
-                yield RESERVED_KEYWORDS[m]
-            else:
-                yield Token('NAME', m)
-            index += len(m)
-
-        elif FLOAT_OR_INT_REGEX.search(text[index:]):
-            match = FLOAT_OR_INT_REGEX.search(text[index:]).group(0)
-            decimal_points_found = match.count('.')
-            if decimal_points_found == 0:
-                yield Token('INT', match)
-            elif decimal_points_found == 1:
-                yield Token('FLOAT', match)
-            else:
-                print(f'Bad number found: {match}. Not an Int or a Float')
-            index += len(match)
-
-        elif text[index:index + 2] in known_tokens:
-            yield known_tokens[text[index:index + 2]]
-            index += 2
-        elif text[index] in known_tokens:
-            yield known_tokens[text[index]]
-            index += 1
+        if kind == 'WHITESPACE':
+            continue
+        elif kind == 'NAME':
+            code = KEYWORD_CODES.get(m.group(), NAME_KIND)
+        elif kind == 'SYMBOL':
+            code = SYMBOL_CODES[m.group()]
+        elif kind == 'INT':
+            code = INT_KIND
+        elif kind == 'FLOAT':
+            code = FLOAT_KIND
+        elif kind == 'CHAR':
+            code = CHAR_KIND
+        elif kind == 'UNTERMINATED_COMMENT':
+            errors.error("Unterminated Comment", base + start, 'comment')
+            index = end
+            continue
+        else:
+            if kind == 'ILLEGAL':
+                errors.error(f'Illegal char {m.group()!r}', base + start, 'illegal-char')
+            continue  # Comments are skipped
 
+        if stream is not None:
+            add_kind(code)
+            add_start(base + start)
+            add_end(base + index)
+        elif code == CHAR_KIND:
+            yield Token('CHAR', decode_char(m.group()), base + start, code)
         else:
-            print(f'!! Unknown Token: {text[index]} !!')
-            index += 1
+            yield Token(TOKEN_KINDS[code], m.group(), base + start, code)
+    return index
+
+
+# Compact token streams
+# =====================
+# A list of Token objects costs a Python object per token.  For big
+# programs the tokens can instead be kept in a TokenStream: the kind of
+# each token is a small integer and the value is only sliced out of the
+# source text when somebody asks for it.
+
+class TokenStream:
+    """
+    Tokens stored as parallel arrays: kinds is an array('B') of codes from
+    TOKEN_KINDS, starts/ends are array('I') offsets into the source text.
+    Iterating produces lightweight TokenRef objects, so a Parser accepts
+    a TokenStream anywhere it accepts a stream of Tokens.
+    """
+    def __init__(self, source):
+        self.source = source
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+
+    @classmethod
+    def from_text(cls, text):
+        """
+        Scan text straight into the arrays: only the kind code and the two
+        offsets of each token are kept.  _scan() does the scanning, so the
+        tokens and diagnostics are the same as tokenize()'s.
+        """
+        errors.set_source(text)
+        stream = cls(text)
+        for _ in _scan(text, 0, True, 0, stream):
+            pass  # Nothing is produced, the tokens go to the arrays
+        return stream
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        if not -len(self.kinds) <= index < len(self.kinds):
+            raise IndexError('token index out of range')
+        return TokenRef(self, index % len(self.kinds))
+
+    def __iter__(self):
+        return map(TokenRef, repeat(self), range(len(self.kinds)))
+
+    def type(self, index):
+        return TOKEN_KINDS[self.kinds[index]]
+
+    def value(self, index):
+        text = self.source[self.starts[index]:self.ends[index]]
+        if self.kinds[index] == CHAR_KIND:
+            return decode_char(text)
+        return text
+
+
+class TokenRef:
+    """ A token inside of a TokenStream. Looks like a Token, but nothing is copied """
+    __slots__ = ('stream', 'index')
+
+    def __init__(self, stream, index):
+        self.stream = stream
+        self.index = index
+
+    @property
+    def type(self):
+        return TOKEN_KINDS[self.stream.kinds[self.index]]
+
+    @property
+    def value(self):
+        return self.stream.value(self.index)
+
+    @property
+    def offset(self):
+        return self.stream.starts[self.index]
+
+    @property
+    def kind(self):
+        return self.stream.kinds[self.index]
+
+    def __repr__(self):
+        return f'Token({self.type}, {self.value})'
 
 
 if __name__ == '__main__':
@@ -17,27 +17,79 @@ it will work as a starting point.  You can come back and refactor the
 type system later.
 '''
 
-# Capabilities of operations (simple and straightforward)
-from compilers.wabbit.model import Integer, Bool, Float, Char
+# Types
+#
+# A type is an interned Type object: a str (so it prints, compares and
+# hashes like its name, Integer.type == 'int') with a small integer id.
+# There is exactly one object per type, made here, and the model
+# classes intern the types they are given (see intern_type()).  The
+# operator tables below are written out as dicts, but the checker and
+# ircode.py look things up in dense tables built from them, indexed by
+# type id:
+#
+#     BINARY_OPS[op][left.id][right.id]   result type (or None)
+#     UNARY_OPS[op][operand.id]           result type (or None)
+#     TYPE_CASTS[from.id][to.id]          result type (or None)
+#
+# so typing an operator is a couple of list indexes instead of building
+# and hashing a tuple key.  binary_table() and unary_table() build
+# tables of the same shape for other per-operator data (opcodes, ...).
+
+
+class Type(str):
+    __slots__ = ('id',)
+
+    def __new__(cls, name, id):
+        self = super().__new__(cls, name)
+        self.id = id
+        return self
+
+    def __reduce__(self):
+        return intern_type, (str(self),)  # Unpickles to the same object
+
+
+INT = Type('int', 0)
+FLOAT = Type('float', 1)
+BOOL = Type('bool', 2)
+CHAR = Type('char', 3)
+
+TYPES = (INT, FLOAT, BOOL, CHAR)  # By id
+TYPE_IDS = {type: type.id for type in TYPES}
+_INTERNED = {type: type for type in TYPES}
+
+
+def intern_type(name):
+    """ The Type object for a type name (anything else is returned as is) """
+    return _INTERNED.get(name, name)
+
 
+def type_id(type):
+    """ The id of a type (or of its name), None if it isn't a type """
+    try:
+        return type.id
+    except AttributeError:  # No type (None), or a name that isn't interned
+        return TYPE_IDS.get(type)
+
+
+# Capabilities of operations (simple and straightforward)
 binary_ops = {
-    (Integer.type, '+', Integer.type): Integer.type,
-    (Integer.type, '*', Integer.type): Integer.type,
-
-    (Integer.type, '-', Integer.type): Integer.type,
-    (Integer.type, '/', Integer.type): Integer.type,
-    (Integer.type, '<', Integer.type): Bool.type,
-    (Integer.type, '>', Integer.type): Bool.type,
-
-    (Float.type, '*', Float.type): Float.type,
-    (Float.type, '/', Float.type): Float.type,
-    (Float.type, '+', Float.type): Float.type,
-    (Float.type, '-', Float.type): Float.type,
-
-    (Float.type, '<', Float.type): Bool.type,
-    (Float.type, '>', Float.type): Bool.type,
-    (Float.type, '<=', Float.type): Bool.type,
-    (Float.type, '>=', Float.type): Bool.type,
+    (INT, '+', INT): INT,
+    (INT, '*', INT): INT,
+
+    (INT, '-', INT): INT,
+    (INT, '/', INT): INT,
+    (INT, '<', INT): BOOL,
+    (INT, '>', INT): BOOL,
+
+    (FLOAT, '*', FLOAT): FLOAT,
+    (FLOAT, '/', FLOAT): FLOAT,
+    (FLOAT, '+', FLOAT): FLOAT,
+    (FLOAT, '-', FLOAT): FLOAT,
+
+    (FLOAT, '<', FLOAT): BOOL,
+    (FLOAT, '>', FLOAT): BOOL,
+    (FLOAT, '<=', FLOAT): BOOL,
+    (FLOAT, '>=', FLOAT): BOOL,
     # TODO: *, /, and for floats, ...
 }
 
@@ -46,40 +98,82 @@ unary_ops = {
     # -operand (Negation)
     # !operand (logical not)
     # ^operand (Grow memory)
-    ('-', Integer.type): Integer.type,
-    ('+', Integer.type): Integer.type,
-    ('^', Integer.type): Integer.type,
-    ('-', Float.type): Float.type,
-    ('+', Float.type): Float.type,
-    ('!', Bool.type): Bool.type,
+    ('-', INT): INT,
+    ('+', INT): INT,
+    ('^', INT): INT,
+    ('-', FLOAT): FLOAT,
+    ('+', FLOAT): FLOAT,
+    ('!', BOOL): BOOL,
 
 }
 
 
 type_casts = {
     # Casting to Integer:
-    (Float.type, Integer.type): Integer.type,
-    (Integer.type, Integer.type): Integer.type,
+    (FLOAT, INT): INT,
+    (INT, INT): INT,
 
     # Casting to Float
-    (Float.type, Float.type): Float.type,
-    (Integer.type, Float.type): Float.type,
+    (FLOAT, FLOAT): FLOAT,
+    (INT, FLOAT): FLOAT,
 
     # Casting to Bool
-    (Integer.type, Bool.type): Bool.type,
-    (Float.type, Bool.type): Bool.type,
-    (Char.type, Bool.type): Bool.type,
-    (Bool.type, Bool.type): Bool.type,
+    (INT, BOOL): BOOL,
+    (FLOAT, BOOL): BOOL,
+    (CHAR, BOOL): BOOL,
+    (BOOL, BOOL): BOOL,
 }
 
+
+
+def binary_table(table):
+    """ {(left, op, right): value} as {op: [[value for each right type] for each left type]} """
+    dense = {}
+    for (left, op, right), value in table.items():
+        rows = dense.setdefault(op, [[None] * len(TYPES) for _ in TYPES])
+        rows[left.id][right.id] = value
+    return dense
+
+
+def unary_table(table):
+    """ {(op, operand): value} as {op: [value for each operand type]} """
+    dense = {}
+    for (op, operand), value in table.items():
+        dense.setdefault(op, [None] * len(TYPES))[operand.id] = value
+    return dense
+
+
+BINARY_OPS = binary_table(binary_ops)
+UNARY_OPS = unary_table(unary_ops)
+TYPE_CASTS = [[type_casts.get((from_type, to_type)) for to_type in TYPES] for from_type in TYPES]
+
+
 def check_binop(left_type, op, right_type):
     """ Check if a binary operator is supported. Return result type or None if unsupported """
-    return binary_ops.get((left_type, op, right_type))
+    table = BINARY_OPS.get(op)
+    if table is None:
+        return None
+    try:
+        return table[left_type.id][right_type.id]
+    except AttributeError:  # See type_id()
+        left, right = type_id(left_type), type_id(right_type)
+        return None if left is None or right is None else table[left][right]
 
 
 def check_unop(operator, operand):
-    return unary_ops.get((operator, operand))
+    table = UNARY_OPS.get(operator)
+    if table is None:
+        return None
+    try:
+        return table[operand.id]
+    except AttributeError:
+        operand = type_id(operand)
+        return None if operand is None else table[operand]
 
 
 def check_typecast(from_type, to_type):
-    return type_casts.get((from_type, to_type))
\ No newline at end of file
+    try:
+        return TYPE_CASTS[from_type.id][to_type.id]
+    except AttributeError:
+        from_type, to_type = type_id(from_type), type_id(to_type)
+        return None if from_type is None or to_type is None else TYPE_CASTS[from_type][to_type]
@@ -0,0 +1,50 @@
+# visitor.py
+#
+# Dispatching on the class of a node.
+#
+# The passes over the model (check.py, ircode.py, ...) have a handler
+# per kind of node.  Finding the handler with a chain of isinstance()
+# tests costs a test per branch for every node visited.  Here the class
+# of the node is looked up in a dict instead.  The first time a class
+# is seen its handler is found by going up its __mro__, so a class
+# without a handler of its own uses its parent's (Integer -> Literal,
+# the views in flat.py -> the model class they look like).  After that
+# it's a single dict lookup.
+
+
+class Dispatcher(dict):
+    """
+    {class: handler}.  find(cls) returns the handler written for exactly
+    cls (or None).  Missing classes are filled in from their parents.
+    """
+    def __init__(self, find):
+        super().__init__()
+        self.find = find
+
+    def __missing__(self, cls):
+        for klass in cls.__mro__:
+            handler = self.find(klass)
+            if handler is not None:
+                self[cls] = handler
+                return handler
+        raise TypeError(f'No handler for {cls.__name__}')
+
+
+def functions(namespace, prefix):
+    """ Dispatcher for module level functions named prefix + class name (e.g. check_Print) """
+    return Dispatcher(lambda cls: namespace.get(prefix + cls.__name__))
+
+
+class Visitor:
+    """
+    Base class for passes written as a class: visit(node, ...) calls the
+    method named prefix + class name (visit_Print, visit_list, ...).
+    """
+    prefix = 'visit_'
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._handlers = Dispatcher(lambda klass: getattr(cls, cls.prefix + klass.__name__, None))
+
+    def visit(self, node, *args):
+        return self._handlers[type(node)](self, node, *args)
@@ -22,6 +22,10 @@
 
 import struct
 
+from compilers.wabbit.bytecode import as_bytecode, dispatch, handler_table
+from compilers.wabbit.cfg import ControlFlow
+from compilers.wabbit.resolve import GLOBAL
+
 
 # Challenge: Compile to Wasm and load it in the browser
 # What if you had a tiny stack machine with a CPU and four datatypes
@@ -129,19 +133,28 @@ INSTRUCTION_i32_SUB = b'\x6B'
 INSTRUCTION_i32_MUL = b'\x6C'
 
 INSTRUCTION_i32_DIV_SIGNED = b'\x6D'
+INSTRUCTION_i32_EQ = b'\x46'
+INSTRUCTION_i32_NE = b'\x47'
 INSTRUCTION_i32_LT_SIGNED = b'\x48'
 INSTRUCTION_i32_GT_SIGNED = b'\x4A'
+INSTRUCTION_i32_LE_SIGNED = b'\x4C'
+INSTRUCTION_i32_GE_SIGNED = b'\x4E'
 
 INSTRUCTION_f64_ADD = b'\xA0'
 INSTRUCTION_f64_SUB = b'\xA1'
 INSTRUCTION_f64_MUL = b'\xA2'
 INSTRUCTION_f64_DIV = b'\xA3'
 
+INSTRUCTION_f64_EQ = b'\x61'
+INSTRUCTION_f64_NE = b'\x62'
 INSTRUCTION_f64_LT = b'\x63'
 INSTRUCTION_f64_GT = b'\x64'
 INSTRUCTION_f64_LE = b'\x65'
 INSTRUCTION_f64_GE = b'\x66'
 
+INSTRUCTION_i32_TRUNC_f64_SIGNED = b'\xAA'
+INSTRUCTION_f64_CONVERT_i32_SIGNED = b'\xB7'
+
 
 # wtype - WASM value types:
 i32 = b'\x7f'  # Wabbit uses 32 bit ints.
@@ -155,6 +168,7 @@ class WasmEncoder:
         # Globals
         self.globals = {}       # the names
         self.global_defns = []  # the reality / storage (a vector)
+        self.global_slots = {}  # slot (see resolve.py) -> index of the global
 
         # Function information
         self.signatures = []   # A vector of the signatures
@@ -180,8 +194,14 @@ class WasmEncoder:
         for n, pname in enumerate(parmnames):
             self.locals[pname] = n
 
-        for op, *opargs in code:
-            getattr(self, f'encode_{op}')(*opargs)
+        # code is IR code, as Bytecode or a list of instructions.  The handlers
+        # get the operand words of the Bytecode (see bytecode.py), and self.pc
+        # is the word of the instruction, to look it up in self.flow (see cfg.py)
+        bytecode = as_bytecode(code)
+        self.constants = bytecode.constants
+        self.names = bytecode.names
+        self.flow = ControlFlow(bytecode)
+        dispatch(bytecode, handler_table(self, 'encode_'), self)
 
         fcode = encode_vector(self.local_defns) + self.wcode + INSTRUCTION_END
         encoded_size_of_fcode = encode_unsigned(len(fcode))
@@ -206,11 +226,11 @@ class WasmEncoder:
         module += encode_section(10, encode_vector(self.func_code))
         return module
 
-    def encode_CONSTI(self, value):
-        self._wcode.append(INSTRUCTION_i32_CONST + encode_signed(value))
+    def encode_CONSTI(self, constant):
+        self._wcode.append(INSTRUCTION_i32_CONST + encode_signed(self.constants[constant]))
 
-    def encode_CONSTF(self, value):
-        self._wcode.append(INSTRUCTION_f64_CONST + encode_f64(value))
+    def encode_CONSTF(self, constant):
+        self._wcode.append(INSTRUCTION_f64_CONST + encode_f64(self.constants[constant]))
 
     def encode_ADDI(self):
         self._wcode.append(INSTRUCTION_i32_ADD)  # i32.add
@@ -239,6 +259,27 @@ class WasmEncoder:
     def encode_GTI(self):
         self._wcode.append(INSTRUCTION_i32_GT_SIGNED)
 
+    def encode_LEI(self):
+        self._wcode.append(INSTRUCTION_i32_LE_SIGNED)
+
+    def encode_GEI(self):
+        self._wcode.append(INSTRUCTION_i32_GE_SIGNED)
+
+    def encode_EQI(self):
+        self._wcode.append(INSTRUCTION_i32_EQ)
+
+    def encode_NEI(self):
+        self._wcode.append(INSTRUCTION_i32_NE)
+
+    def encode_LEF(self):
+        self._wcode.append(INSTRUCTION_f64_LE)
+
+    def encode_EQF(self):
+        self._wcode.append(INSTRUCTION_f64_EQ)
+
+    def encode_NEF(self):
+        self._wcode.append(INSTRUCTION_f64_NE)
+
     def encode_GEF(self):
         self._wcode.append(INSTRUCTION_f64_GE)
 
@@ -251,6 +292,12 @@ class WasmEncoder:
     def encode_MULF(self):
         self._wcode.append(INSTRUCTION_f64_MUL)  # i32.mul
 
+    def encode_ITOF(self):
+        self._wcode.append(INSTRUCTION_f64_CONVERT_i32_SIGNED)
+
+    def encode_FTOI(self):
+        self._wcode.append(INSTRUCTION_i32_TRUNC_f64_SIGNED)
+
     def encode_PRINTI(self):
         self._wcode.append(b'\x10' + encode_unsigned(self.functions['_printi']))
 
@@ -266,27 +313,31 @@ class WasmEncoder:
         # Will add name entry to self.locals
         pass
 
-    def encode_GLOBALI(self, name):
+    def encode_GLOBALI(self, name, slot=-1):
         # \x01 -> mutability of 'mutable'
         # \x41 -> 'const', this is actually part of the initial value
 
         # Initial value = 0
         defn = i32 + INSTRUCTION_NOOP + INSTRUCTION_i32_CONST + encode_signed(0) + INSTRUCTION_END
         self.global_defns.append(defn)
-        self.globals[name] = len(self.global_defns) - 1  # index of our global
+        self.globals[self.names[name]] = self.global_slots[slot] = len(self.global_defns) - 1  # index of our global
 
 
-    def encode_GLOBALF(self, name):
+    def encode_GLOBALF(self, name, slot=-1):
         defn = f64 + INSTRUCTION_NOOP + INSTRUCTION_f64_CONST + encode_f64(0) + INSTRUCTION_END
         self.global_defns.append(defn)
-        self.globals[name] = len(self.global_defns) - 1  # index of our global
+        self.globals[self.names[name]] = self.global_slots[slot] = len(self.global_defns) - 1  # index of our global
 
-    def encode_STORE(self, name):
-        index = self.globals[name]
+    # Resolved variables (see resolve.py) come with a slot (-1 if not).  Slots
+    # needn't be dense (IncrementalChecker never reuses one), hence global_slots
+    def encode_STORE(self, name, depth=GLOBAL, slot=-1):
+        assert depth == GLOBAL or depth == -1, 'Local variables are not supported yet'
+        index = self.globals[self.names[name]] if slot == -1 else self.global_slots[slot]
         self._wcode.append(INSTRUCTION_GLOBAL_SET + encode_unsigned(index))
 
-    def encode_LOAD(self, name):
-        index = self.globals[name]
+    def encode_LOAD(self, name, depth=GLOBAL, slot=-1):
+        assert depth == GLOBAL or depth == -1, 'Local variables are not supported yet'
+        index = self.globals[self.names[name]] if slot == -1 else self.global_slots[slot]
         self._wcode.append(INSTRUCTION_GLOBAL_GET + encode_unsigned(index))
 
     #  Control Flow:
@@ -306,9 +357,15 @@ class WasmEncoder:
                            + INSTRUCTION_LOOP_START
                            + BLOCK_TYPE)
 
+    # A loop is a block (label 1 inside the loop, to break out of) around a loop
+    # (label 0, to go back to the start).  Each IF a branch is in adds a label
     def encode_CBREAK(self):
         self._wcode.append(INSTRUCTION_LOOP_BREAK_IF
-                           + b'\x01')  # index ID
+                           + encode_unsigned(self.flow.labels[self.pc] + 1))  # index ID
+
+    def encode_CONTINUE(self):
+        self._wcode.append(INSTRUCTION_LOOP_BREAK
+                           + encode_unsigned(self.flow.labels[self.pc]))
 
     def encode_ENDLOOP(self):
         self._wcode.append(INSTRUCTION_LOOP_BREAK
@@ -320,22 +377,22 @@ class WasmEncoder:
 
 if __name__ == '__main__':
     code = [
-        ('GLOBALI', 'x'),
+        ('GLOBALI', 'x', 0),
         ('CONSTI', 4),
-        ('STORE', 'x'),
-        ('GLOBALI', 'y'),
+        ('STORE', 'x', GLOBAL, 0),
+        ('GLOBALI', 'y', 1),
         ('CONSTI', 5),
-        ('STORE', 'y'),
-        ('GLOBALI', 'd'),
-        ('LOAD', 'x'),
-        ('LOAD', 'x'),
+        ('STORE', 'y', GLOBAL, 1),
+        ('GLOBALI', 'd', 2),
+        ('LOAD', 'x', GLOBAL, 0),
+        ('LOAD', 'x', GLOBAL, 0),
         ('MULI',),
-        ('LOAD', 'y'),
-        ('LOAD', 'y'),
+        ('LOAD', 'y', GLOBAL, 1),
+        ('LOAD', 'y', GLOBAL, 1),
         ('MULI',),
         ('ADDI',),
-        ('STORE', 'd'),
-        ('LOAD', 'd'),
+        ('STORE', 'd', GLOBAL, 2),
+        ('LOAD', 'd', GLOBAL, 2),
         ('PRINTI',)
     ]
 